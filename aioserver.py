@@ -0,0 +1,407 @@
+import buffers
+import connection
+import delta
+import integrity
+import manifest
+import messages
+import metrics
+import protocol
+import transfer
+import asyncio
+import concurrent.futures
+import logging
+import os
+import time
+
+LINGER = 5                  # сколько секунд завершенная передача еще отвечает на повторы клиента
+WRITE_WORKERS = 4           # потоки для записи на диск
+
+
+class TransferServerProtocol(asyncio.DatagramProtocol):
+    """ Асинхронный сервер: много передач одновременно на одном сокете. Передачи различаются по адресу
+    клиента и идентификатору сессии, запись фрагментов на диск выполняется в пуле потоков.
+    К передаче файла с параметром streams присоединяются потоки с других адресов клиента (parallel.py). """
+
+    def __init__(self, dir_path, executor, content_store=None, on_message=None):
+        """ dir_path: Директория для сохранения файлов.
+        executor: Пул потоков для записи на диск.
+        content_store: store.ContentStore для приема по содержимому или None.
+        on_message: Обработчик текста и сообщений (адрес, текст), по умолчанию вывод в консоль.
+                    Вызывается в цикле событий и не должен блокировать его (messages.to_queue). """
+
+        self.dir_path = dir_path
+        self.content_store = content_store
+        self.executor = executor
+        self.transport = None
+        self.loop = None
+        self.transfers = {}             # (адрес, сессия) -> transfer.Transfer
+        self.writes = {}                # (адрес, сессия) -> незавершенные записи на диск
+        self.messages = {}              # (адрес, сессия) -> части текста
+        self.finished = {}              # (адрес, сессия) -> время завершения
+        self.joined = {}                # (адрес потока, сессия) -> ключ основной передачи
+        self.closing = {}               # путь .part -> задача закрытия прерванной передачи
+        self.on_message = on_message
+        self.connections = connection.ConnectionTable(on_message)   # постоянные сессии клиентов
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.loop = asyncio.get_running_loop()
+
+    def datagram_received(self, data, address):
+        self.dispatch(data, address)
+
+    def dispatch(self, data, address, release=None):
+        """ Обработка одной датаграммы.
+
+        data: Датаграмма (bytes или memoryview буфера из пула).
+        address: Адрес клиента.
+        release: Функция возврата буфера в пул. Вызывается сразу или, если данные ушли на запись, после записи. """
+
+        write = None
+        try:
+            write = self.handle(data, address)
+        finally:
+            if release is not None:
+                if write is None:
+                    release()
+                else:
+                    write.add_done_callback(lambda _: release())
+
+    def handle(self, data, address):
+        """ Обработка датаграммы. Возвращает future записи на диск, если данные датаграммы еще используются. """
+
+        if len(data) < protocol.HEADER_SIZE:
+            return None
+        if protocol.get_msg_type(data) == protocol.MsgType.PRB.value:          # проба PMTU, без состояния
+            reply = protocol.probe_reply(data)
+            if reply is not None:
+                self.transport.sendto(reply, address)
+            return None
+        if protocol.get_msg_type(data) == protocol.MsgType.SIG.value:          # сигнатуры считаются в пуле потоков
+            reply = self.loop.run_in_executor(self.executor, delta.signature_reply, bytes(data), self.dir_path)
+            reply.add_done_callback(lambda reply: self.send_result(reply, address))
+            return None
+        if self.connections.owns(data, address):        # открытие, пробы, сообщения и закрытие постоянной сессии
+            reply = self.connections.handle(data, address)
+            if reply is not None:
+                self.transport.sendto(reply, address)
+            return None
+        key = (address, protocol.get_session(data))
+        key = self.joined.get(key, key)                 # ответы уходят по адресу датаграммы, состояние - общее
+        incoming = self.transfers.get(key)
+        if incoming is None:
+            if key in self.finished:
+                self.reply_finished(data, address, key[1])
+            else:
+                self.start(data, address, key)
+            return None
+
+        if protocol.get_msg_type(data) == protocol.MsgType.DIG.value and incoming.verifier is not None:
+            self.loop.create_task(self.check_digests(key, incoming, bytes(data), address))
+            return None
+        reply, seq, payload = incoming.handle(data)
+        if incoming.finished:                           # FIN клиента подтверждается после закрытия файла
+            self.finish(key, incoming.complete())
+            return None
+        if reply is not None:
+            self.transport.sendto(reply, address)
+        write = self.store(key, incoming, seq, payload)
+        for reply, seq, payload in incoming.take_rebuilt():        # восстановленные по четности
+            self.transport.sendto(reply, address)
+            self.store(key, incoming, seq, payload)
+        if incoming.complete() and incoming.verifier is None:  # с проверкой хешей - до FIN клиента
+            self.finish(key)
+        return write
+
+    async def check_digests(self, key, incoming, data, address):
+        """ Проверка хешей диапазонов (MsgType.DIG) после записи всех принятых фрагментов на диск.
+        В пуле потоков диапазоны только читаются и хешируются, а битовая карта меняется и ответ строится
+        в цикле событий, где фрагменты отмечаются принятыми. """
+
+        writes = self.writes.get(key)
+        if writes:
+            await asyncio.gather(*list(writes))
+        verifier = incoming.verifier
+        if protocol.check_crc(data) == protocol.MsgType.ACK:
+            indexes = verifier.unhashed(protocol.get_seq(data), len(protocol.get_data(data)) // integrity.DIGEST_SIZE)
+            if indexes:
+                digests = await self.loop.run_in_executor(self.executor, verifier.hash_ranges, indexes)
+                for index, digest in zip(indexes, digests):
+                    if verifier.unhashed(index, 1):         # пока хешировали, диапазон мог быть снят повтором DIG
+                        verifier.digests[index] = digest
+        reply, _, _ = incoming.handle(data)
+        if reply is not None:
+            self.transport.sendto(reply, address)
+
+    def store(self, key, incoming, seq, payload):
+        """ Сохранение нового фрагмента: текст - сразу, файл - в пуле потоков. Возвращает future записи или None. """
+
+        if payload is None:
+            return None
+        if incoming.assembler is None:
+            self.messages[key].append(incoming.store(seq, payload))
+            return None
+        write = self.loop.run_in_executor(self.executor, incoming.store, seq, payload)
+        self.writes[key].add(write)
+        write.add_done_callback(self.writes[key].discard)
+        return write
+
+    def send_result(self, reply, address):
+        """ Отправка ответа, подготовленного в пуле потоков.
+
+        reply: Future с датаграммой ответа или None, если отвечать не нужно.
+        address: Адрес клиента. """
+
+        if reply.result() is not None:
+            self.transport.sendto(reply.result(), address)
+
+    def start(self, data, address, key):
+        """ Начало новой передачи по сообщению инициализации. Остальные датаграммы без передачи отбрасываются.
+
+        data: Полученная датаграмма.
+        address: Адрес клиента.
+        key: Пара (адрес, сессия). """
+
+        msg_type = protocol.get_msg_type(data)
+        if msg_type not in (protocol.MsgType.SET.value, protocol.MsgType.SET_MSG.value):
+            return
+        reply_crc = protocol.check_crc(data)
+        if reply_crc == protocol.MsgType.ACK:
+            try:
+                params = protocol.get_params(data)
+                if params.get('join'):
+                    self.join(address, key)
+                    return
+                self.connections.touch(address, params)
+                path = None
+                if msg_type == protocol.MsgType.SET.value:
+                    path = self.dir_path + os.path.basename(params.get('name', ''))
+                    reply = self.content_store.claim(params, path, key[1]) if self.content_store is not None else None
+                    if reply is not None:                       # содержимое уже есть, передача не нужна
+                        self.transport.sendto(reply, address)
+                        print(f'{address[0]}:{address[1]} файл уже есть в хранилище', os.path.abspath(path))
+                        return
+                    if manifest.resumable(params) and self.wait_part(data, address, key,
+                                                                     manifest.part_path(path, params)):
+                        return
+                incoming = transfer.Transfer(key[1], msg_type, params, path, self.content_store)
+            except (ValueError, KeyError):
+                reply_crc = protocol.MsgType.RST
+            except OSError as error:
+                print('Ошибка создания файла:', error)
+                return
+        if reply_crc != protocol.MsgType.ACK:
+            self.transport.sendto(protocol.add_header(reply_crc, b'', 0, key[1]), address)
+            return
+        self.transport.sendto(incoming.accept_reply, address)
+
+        self.transfers[key] = incoming
+        self.writes[key] = set()
+        self.messages[key] = []
+        print(f'{address[0]}:{address[1]} начата передача', path or 'текста', f'({incoming.count} фрагментов'
+              + (f', продолжение с {incoming.resumed})' if incoming.resumed else ')'))
+        if incoming.complete() and incoming.verifier is None:
+            self.finish(key)
+
+    def wait_part(self, data, address, key, part_path):
+        """ Продолжение передачи в новой сессии, пока прежняя передача того же .part еще не закрыта
+        (клиент перезапущен раньше, чем сервер сбросил его по тишине). Прежняя передача прерывается,
+        и новая начинается после ее закрытия - с ее манифестом. Возвращает True, если начало отложено.
+
+        data: Сообщение инициализации.
+        address: Адрес клиента.
+        key: Пара (адрес, сессия).
+        part_path: Путь к недополученному файлу. """
+
+        active = next((other for other, incoming in self.transfers.items()
+                       if incoming.resumable and incoming.part_path == part_path), None)
+        if active is not None:
+            print(f'{active[0][0]}:{active[0][1]} передача продолжена в новой сессии')
+            self.finish(active, complete=False)
+        closing = self.closing.get(part_path)
+        if closing is None:
+            return False
+        data = bytes(data)                              # буфер вернется в пул раньше
+        closing.add_done_callback(lambda _: self.restart(data, address, key))
+        return True
+
+    def restart(self, data, address, key):
+        """ Начало отложенной передачи, если ее еще не начал повтор инициализации. """
+
+        if key not in self.transfers and key not in self.finished:
+            self.start(data, address, key)
+
+    def join(self, address, key):
+        """ Присоединение потока к начатой передаче с той же сессией, если она допускает еще потоки.
+
+        address: Адрес потока.
+        key: Пара (адрес потока, сессия). """
+
+        main = next((main for main, incoming in self.transfers.items()
+                     if main[1] == key[1] and 'streams' in incoming.params), None)
+        if main is None or list(self.joined.values()).count(main) >= self.transfers[main].params['streams']:
+            self.transport.sendto(protocol.add_header(protocol.MsgType.RST, b'', 0, key[1]), address)
+            return
+        self.joined[key] = main
+        self.transport.sendto(self.transfers[main].accept_reply, address)
+        print(f'{address[0]}:{address[1]} присоединен поток к передаче', self.transfers[main].path)
+
+    def reply_finished(self, data, address, session):
+        """ Повторный ответ на фрагмент или FIN уже завершенной передачи: клиент не получил ACK или FIN. """
+
+        if protocol.check_crc(data) != protocol.MsgType.ACK:
+            return
+        if protocol.get_msg_type(data) == protocol.MsgType.PSH.value:
+            self.transport.sendto(protocol.add_header(protocol.MsgType.ACK, b'', protocol.get_seq(data), session), address)
+        elif protocol.get_msg_type(data) != protocol.MsgType.FIN.value:
+            return
+        self.transport.sendto(protocol.add_header(protocol.MsgType.FIN, b'', 0, session), address)
+
+    def finish(self, key, complete=True):
+        """ Завершение передачи: она сразу убирается из таблицы, файл закрывается в фоне.
+
+        key: Пара (адрес, сессия).
+        complete: False, если передача сброшена по тишине. """
+
+        incoming = self.transfers.pop(key)
+        writes = self.writes.pop(key)
+        text = ''.join(self.messages.pop(key))
+        streams = [stream for stream, main in self.joined.items() if main == key]
+        for stream in streams:
+            del self.joined[stream]
+        closing = self.loop.create_task(self.close(key, incoming, writes, text, complete, streams))
+        if incoming.resumable:                          # новая передача того же .part ждет закрытия
+            self.closing[incoming.part_path] = closing
+            closing.add_done_callback(lambda _: self.closed(incoming.part_path, closing))
+
+    def closed(self, part_path, closing):
+        if self.closing.get(part_path) is closing:
+            del self.closing[part_path]
+
+    async def close(self, key, incoming, writes, text, complete, streams=()):
+        """ Ожидание записей на диск, закрытие файла и FIN клиенту.
+        streams: Ключи присоединенных потоков, они тоже отвечают на повторы после завершения. """
+
+        if writes:
+            await asyncio.gather(*writes)
+        await self.loop.run_in_executor(self.executor, incoming.close)
+        address, session = key
+        self.connections.touch(address, incoming.params)   # передача, даже долгая, продлевает сессию
+
+        if not complete:
+            print(f'{address[0]}:{address[1]} передача прервана, получено', incoming.bitmap.received, 'из', incoming.count,
+                  '- ее можно продолжить' if incoming.resumable else '')
+            logging.info(f"Передача прервана: {incoming.path}, получено {incoming.bitmap.received}/{incoming.count}")
+            return
+        for finished in (key, *streams):
+            self.finished[finished] = time.monotonic()
+        self.transport.sendto(protocol.add_header(protocol.MsgType.FIN, b'', 0, session), address)
+        if incoming.assembler is None:
+            messages.deliver(self.on_message, address, text)
+        elif incoming.batch is not None:
+            print(f'{address[0]}:{address[1]} пакет распакован, файлов:', len(incoming.unpacked or ()))
+            logging.info(f"Пакет {incoming.path}: распаковано файлов {len(incoming.unpacked or ())}")
+        else:
+            print(f'{address[0]}:{address[1]} файл сохранен', os.path.abspath(incoming.path))
+            logging.info(f"Файл сохранен как: {os.path.abspath(incoming.path)}")
+
+    def cleanup(self):
+        """ Сброс замолчавших передач, сохранение манифестов продолжаемых передач и забывание давно завершенных. """
+
+        now = time.monotonic()
+        for key, incoming in list(self.transfers.items()):
+            if now - incoming.last_activity > incoming.idle_timeout():
+                self.finish(key, complete=False)
+            elif incoming.resumable and not self.writes[key]:          # все принятые фрагменты уже на диске
+                checkpoint = self.loop.run_in_executor(self.executor, incoming.checkpoint, incoming.bitmap.ranges())
+                self.writes[key].add(checkpoint)                        # close дождется и его
+                checkpoint.add_done_callback(self.writes[key].discard)
+        for key, finished in list(self.finished.items()):
+            if now - finished > LINGER:
+                del self.finished[key]
+        self.connections.expire()
+
+
+class SocketTransport:
+    """ Отправка ответов напрямую через неблокирующий сокет, когда прием идет через sock_recvfrom_into. """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def sendto(self, data, address):
+        try:
+            self.sock.sendto(data, address)
+        except BlockingIOError:                 # буфер сокета полон - ответ теряется, как и любая UDP-датаграмма
+            pass
+
+
+async def receive_into(sock, handler, pool):
+    """ Цикл приема датаграмм в буферы из пула без выделения памяти на каждый пакет.
+
+    sock: Неблокирующий UDP-сокет.
+    handler: TransferServerProtocol.
+    pool: buffers.BufferPool буферов приема. """
+
+    loop = asyncio.get_running_loop()
+    while True:
+        buffer = pool.acquire()
+        nbytes, address = await loop.sock_recvfrom_into(sock, buffer)
+        handler.dispatch(memoryview(buffer)[:nbytes], address, lambda buffer=buffer: pool.release(buffer))
+
+
+async def serve(server_socket, dir_path, workers=WRITE_WORKERS, pool_size=buffers.POOL_SIZE,
+                buffer_size=buffers.BUFFER_SIZE, content_store=None, on_message=None):
+    """ Прием передач от многих клиентов одновременно, пока задача не будет отменена.
+    В Python 3.11+ датаграммы читаются через sock_recvfrom_into в буферы из пула, иначе - через DatagramProtocol.
+
+    server_socket: Привязанный UDP-сокет сервера. Не закрывается, после остановки снова блокирующий.
+    dir_path: Директория для сохранения файлов.
+    workers: Количество потоков записи на диск.
+    pool_size: Количество буферов приема.
+    buffer_size: Размер одного буфера приема.
+    content_store: store.ContentStore для приема по содержимому или None.
+    on_message: Обработчик текста и сообщений (адрес, текст) или None для вывода в консоль. """
+
+    loop = asyncio.get_running_loop()
+    sock = server_socket.dup()
+    sock.setblocking(False)
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        handler = TransferServerProtocol(dir_path, executor, content_store, on_message)
+        if hasattr(loop, 'sock_recvfrom_into'):
+            handler.connection_made(SocketTransport(sock))
+            receiver = loop.create_task(receive_into(sock, handler, buffers.BufferPool(pool_size, buffer_size)))
+            stop = receiver.cancel
+        else:
+            transport, _ = await loop.create_datagram_endpoint(lambda: handler, sock=sock)
+            stop = transport.close
+        try:
+            while True:
+                await asyncio.sleep(1)
+                handler.cleanup()
+        finally:
+            stop()
+            sock.close()
+            server_socket.setblocking(True)
+
+
+def run(server_socket, dir_path, workers=WRITE_WORKERS, pool_size=buffers.POOL_SIZE, buffer_size=buffers.BUFFER_SIZE,
+        metrics_port=None, content_store=None, on_message=None):
+    """ Запуск асинхронного сервера до Ctrl+C.
+
+    server_socket: Привязанный UDP-сокет сервера.
+    dir_path: Директория для сохранения файлов.
+    workers: Количество потоков записи на диск.
+    pool_size: Количество буферов приема.
+    buffer_size: Размер одного буфера приема.
+    metrics_port: Порт HTTP на 127.0.0.1 для метрик (/metrics - Prometheus, /metrics.json - JSON) или None.
+    content_store: store.ContentStore для приема по содержимому или None.
+    on_message: Обработчик текста и сообщений (адрес, текст) или None для вывода в консоль. """
+
+    exporter = metrics.start(metrics_port)
+    print('Сервер ожидает! Ctrl+C - остановка')
+    try:
+        asyncio.run(serve(server_socket, dir_path, workers, pool_size, buffer_size, content_store, on_message))
+    except KeyboardInterrupt:
+        print('Сервер остановлен')
+    finally:
+        metrics.stop(exporter)
@@ -0,0 +1,104 @@
+import json
+import os
+import struct
+
+SUFFIX = '.batch'           # имя пакета на сервере: <имя первого пути>.batch, после распаковки удаляется
+INDEX_SIZE = struct.Struct('!Q')    # длина оглавления, затем оглавление JSON, затем содержимое файлов подряд
+COPY_CHUNK = 1 << 20        # файлы копируются в пакет и из пакета частями этого размера
+
+
+def collect(paths):
+    """ Файлы для пакетной передачи. Возвращает список (путь на диске, относительный путь с '/'),
+    директории обходятся рекурсивно и сохраняют свое имя (как cp -r). Повторы путей пропускаются.
+
+    paths: Пути к файлам и директориям. """
+
+    entries, seen = [], set()
+    for path in paths:
+        path = os.path.abspath(os.fsdecode(path))
+        if os.path.isdir(path):
+            parent = os.path.dirname(path.rstrip(os.sep)) or path
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    if full not in seen and os.path.isfile(full):
+                        seen.add(full)
+                        entries.append((full, os.path.relpath(full, parent).replace(os.sep, '/')))
+        elif os.path.isfile(path):
+            if path not in seen:
+                seen.add(path)
+                entries.append((path, os.path.basename(path)))
+        else:
+            raise FileNotFoundError(f'Путь {path} не существует')
+    return entries
+
+
+def pack(entries, out):
+    """ Запись пакета: оглавление [относительный путь, размер, время изменения] и содержимое файлов подряд.
+    Мелкие файлы оказываются в общих фрагментах, каждому файлу не нужна своя инициализация.
+    Возвращает количество байт содержимого. Файл, изменивший размер во время упаковки, - ValueError.
+
+    entries: Список из collect.
+    out: Файл для пакета. """
+
+    index = []
+    for path, name in entries:
+        stat = os.stat(path)
+        index.append([name, stat.st_size, stat.st_mtime_ns])
+    blob = json.dumps(index, ensure_ascii=False).encode('utf-8')
+    out.write(INDEX_SIZE.pack(len(blob)) + blob)
+    total = 0
+    for (path, _), (name, size, _) in zip(entries, index):
+        with open(path, 'rb') as file:
+            left = size
+            while left:
+                data = file.read(min(COPY_CHUNK, left))
+                if not data:
+                    raise ValueError(f'Файл {name} изменился во время упаковки')
+                out.write(data)
+                left -= len(data)
+        total += size
+    return total
+
+
+def target(dir_path, name):
+    """ Путь для файла пакета внутри dir_path или ValueError, если имя выходит за ее пределы. """
+
+    parts = name.split('/')
+    if any(part in ('', '.', '..') or os.sep in part or (os.altsep and os.altsep in part)
+           or os.path.splitdrive(part)[0] for part in parts):
+        raise ValueError(f'Недопустимый путь в пакете: {name}')
+    return os.path.join(dir_path, *parts)
+
+
+def unpack(bundle_path, dir_path, rename=None):
+    """ Восстановление дерева файлов из принятого пакета. Возвращает список сохраненных путей.
+    Поврежденный пакет или путь вне dir_path - ValueError, уже распакованные файлы остаются.
+
+    bundle_path: Принятый пакет.
+    dir_path: Директория, в которой создаются файлы и директории пакета.
+    rename: Функция выбора свободного имени для существующего файла, по умолчанию файл заменяется. """
+
+    saved = []
+    with open(bundle_path, 'rb') as bundle:
+        (length,) = INDEX_SIZE.unpack(bundle.read(INDEX_SIZE.size).ljust(INDEX_SIZE.size, b'\0'))
+        try:
+            index = json.loads(bundle.read(length))
+            entries = [(target(dir_path, name), int(size), int(mtime)) for name, size, mtime in index]
+        except (ValueError, TypeError, AttributeError) as error:
+            raise ValueError(f'Поврежденное оглавление пакета: {error}') from None
+        for path, size, mtime in entries:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            path = rename(path) if rename is not None else path
+            with open(path, 'wb') as file:
+                left = size
+                while left:
+                    data = bundle.read(min(COPY_CHUNK, left))
+                    if not data:
+                        raise ValueError('Пакет обрезан')
+                    file.write(data)
+                    left -= len(data)
+            os.utime(path, ns=(mtime, mtime))
+            saved.append(path)
+    return saved
@@ -0,0 +1,218 @@
+import client
+import impairment
+import protocol
+import server
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import socket
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+FORMAT_VERSION = 1              # версия формата JSON с результатами
+SEED = 20240101                 # содержимое файлов одинаково от запуска к запуску
+PAYLOAD_SIZES = (64, 1454, 8192)
+FRAGMENT_SIZES = (512, 1454, 8192)
+FILE_SIZES = (1 << 20, 8 << 20)
+QUICK_FILE_SIZES = (1 << 20,)
+MICRO_REPEAT = 5                # повторов замера, берется лучший
+MICRO_TIME = 0.2                # секунд на один повтор
+TRANSFER_REPEAT = 3             # повторов передачи, берется медиана
+THRESHOLD = 0.10                # ухудшение больше этой доли - регрессия
+
+
+def measure(func, repeat=MICRO_REPEAT, duration=MICRO_TIME):
+    """ Время одного вызова func в наносекундах: лучший из repeat замеров по duration секунд. """
+
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * duration / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def micro(payload_sizes=PAYLOAD_SIZES, modes=None):
+    """ Микробенчмарки функций протокола. Возвращает словарь имя -> {ns_per_op, ops_per_s[, mb_per_s]}.
+
+    payload_sizes: Размеры данных фрагмента.
+    modes: Режимы контрольной суммы, по умолчанию все из checksum.MODES. """
+
+    results = {}
+    saved_mode = protocol.CHECKSUM_MODE
+    rnd = random.Random(SEED)
+    try:
+        for mode in modes or ('crc32', 'crc32c', 'legacy'):
+            protocol.set_checksum_mode(mode)
+            for size in payload_sizes:
+                payload = rnd.randbytes(size)
+                header = protocol.HEADER_PREFIX.pack(protocol.VERSION, protocol.MsgType.PSH.value, 0, 1, 7, size)
+                packet = protocol.add_header(protocol.MsgType.PSH, payload, 7, 1)
+                cases = {'set_crc': lambda: protocol.set_crc(header, payload),
+                         'make_header': lambda: protocol.make_header(protocol.MsgType.PSH, payload, 7, 1),
+                         'add_header': lambda: protocol.add_header(protocol.MsgType.PSH, payload, 7, 1),
+                         'check_crc': lambda: protocol.check_crc(packet)}
+                for name, func in cases.items():
+                    ns = measure(func)
+                    results[f'{name}/{mode}/{size}'] = {'ns_per_op': round(ns, 1), 'ops_per_s': round(1e9 / ns),
+                                                        'mb_per_s': round(size / ns * 1e3, 2)}
+    finally:
+        protocol.set_checksum_mode(saved_mode)
+    packet = protocol.add_header(protocol.MsgType.PSH, b'x' * 1454, 7, 1)
+    for name, func in {'get_seq': lambda: protocol.get_seq(packet),
+                       'parse_header': lambda: protocol.parse_header(packet)}.items():
+        ns = measure(func)
+        results[name] = {'ns_per_op': round(ns, 1), 'ops_per_s': round(1e9 / ns)}
+    return results
+
+
+def percentile(values, fraction):
+    """ Процентиль выборки (fraction от 0 до 1), None для пустой выборки. """
+
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def transfer(fragment_size, file_size, impair=None, **options):
+    """ Одна передача файла через loopback: client.send_file -> server.receive в одном процессе.
+    Возвращает словарь с временем, скоростью, задержками подтверждения фрагментов и временем CPU
+    (клиент и сервер вместе). Вывод клиента и сервера подавляется.
+
+    fragment_size: Размер данных фрагмента.
+    file_size: Размер файла.
+    impair: Помехи вида 'loss=0.05,delay=20ms' (impairment.Impairment.parse), одинаковые в каждом запуске.
+    options: Дополнительные параметры client.send_file (compress, redundancy, ...). """
+
+    with tempfile.TemporaryDirectory() as work:
+        source = os.path.join(work, 'bench.bin')
+        with open(source, 'wb') as file:
+            file.write(random.Random(SEED).randbytes(file_size))
+        out_dir = os.path.join(work, 'out') + os.sep
+        os.mkdir(out_dir)
+        latencies = []
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server_socket, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket, \
+                contextlib.redirect_stdout(io.StringIO()):
+            server_socket.bind(('127.0.0.1', 0))
+            client_socket.bind(('127.0.0.1', 0))
+            receiver = threading.Thread(target=server.receive, args=(server_socket, out_dir))
+            receiver.start()
+            settings = impairment.Impairment.parse(impair)
+            with contextlib.ExitStack() as stack:
+                address = server_socket.getsockname()
+                if settings is not None:
+                    address = stack.enter_context(impairment.Relay(address, settings, settings)).address
+                cpu_start, start = time.process_time(), time.perf_counter()
+                client.send_file(address[0], client_socket, address[1], fragment_size + protocol.HEADER_SIZE,
+                                 source.encode('utf-8'), latencies=latencies, **options)
+                receiver.join()
+                elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+        received = os.path.join(out_dir, 'bench.bin')
+        ok = os.path.exists(received) and os.path.getsize(received) == file_size
+    fragments = -(-file_size // fragment_size)
+    return {'fragment': fragment_size, 'file_size': file_size, 'ok': ok, 'seconds': round(elapsed, 4),
+            'mb_per_s': round(file_size / elapsed / 1e6, 2), 'fragments_per_s': round(fragments / elapsed),
+            'latency_p50_ms': round(percentile(latencies, 0.5) * 1e3, 3) if latencies else None,
+            'latency_p99_ms': round(percentile(latencies, 0.99) * 1e3, 3) if latencies else None,
+            'cpu_seconds': round(cpu, 4)}
+
+
+def transfers(fragment_sizes=FRAGMENT_SIZES, file_sizes=FILE_SIZES, repeat=TRANSFER_REPEAT, **options):
+    """ Сквозные передачи по всем сочетаниям размеров фрагмента и файла. Для каждого сочетания -
+    медиана из repeat передач по скорости. Возвращает список результатов transfer. """
+
+    results = []
+    for fragment_size in fragment_sizes:
+        for file_size in file_sizes:
+            runs = sorted((transfer(fragment_size, file_size, **options) for _ in range(repeat)),
+                          key=lambda run: run['mb_per_s'])
+            results.append(dict(runs[len(runs) // 2], runs=repeat))
+    return results
+
+
+def run(quick=False, skip_transfers=False, **options):
+    """ Полный набор замеров. Возвращает словарь для JSON.
+
+    quick: Меньше размеров и повторов (проверка перед коммитом).
+    skip_transfers: Только микробенчмарки.
+    options: Дополнительные параметры client.send_file для сквозных передач. """
+
+    report = {'format': FORMAT_VERSION, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'platform': platform.platform(),
+              'checksum_mode': protocol.CHECKSUM_MODE, 'options': options,
+              'micro': micro((1454,) if quick else PAYLOAD_SIZES)}
+    if not skip_transfers:
+        report['transfers'] = transfers((1454,) if quick else FRAGMENT_SIZES, QUICK_FILE_SIZES if quick else FILE_SIZES,
+                                        1 if quick else TRANSFER_REPEAT, **options)
+    return report
+
+
+def compare(old, new, threshold=THRESHOLD):
+    """ Сравнение двух отчетов. Возвращает список строк о регрессиях: микробенчмарк медленнее
+    или передача с меньшей скоростью больше чем на долю threshold. """
+
+    regressions = []
+    for name, result in new.get('micro', {}).items():
+        before = old.get('micro', {}).get(name)
+        if before and result['ns_per_op'] > before['ns_per_op'] * (1 + threshold):
+            regressions.append(f"{name}: {before['ns_per_op']} -> {result['ns_per_op']} нс")
+    old_transfers = {(item['fragment'], item['file_size']): item for item in old.get('transfers', ())}
+    for result in new.get('transfers', ()):
+        before = old_transfers.get((result['fragment'], result['file_size']))
+        if before and result['mb_per_s'] < before['mb_per_s'] * (1 - threshold):
+            regressions.append(f"передача {result['fragment']}/{result['file_size']}: "
+                               f"{before['mb_per_s']} -> {result['mb_per_s']} МБ/с")
+    return regressions
+
+
+def print_report(report):
+    """ Вывод отчета таблицей. """
+
+    for name, result in report['micro'].items():
+        print(f"{name:<28} {result['ns_per_op']:>12.1f} нс {result.get('mb_per_s', ''):>10}")
+    for result in report.get('transfers', ()):
+        print(f"фрагмент {result['fragment']:>5} файл {result['file_size']:>9}: {result['mb_per_s']:>7} МБ/с "
+              f"{result['fragments_per_s']:>7} фр/с p50 {result['latency_p50_ms']} мс p99 {result['latency_p99_ms']} мс "
+              f"CPU {result['cpu_seconds']} с" + ('' if result['ok'] else ' ОШИБКА'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры производительности протокола и передачи файлов')
+    parser.add_argument('--quick', action='store_true', help='меньше размеров и повторов')
+    parser.add_argument('--micro-only', action='store_true', help='без сквозных передач')
+    parser.add_argument('--checksum', choices=('crc32', 'crc32c', 'legacy'), help='режим контрольной суммы передач')
+    parser.add_argument('--compress', help="сжатие передач, например 'zlib'")
+    parser.add_argument('--fec', help="FEC передач, например '16:2'")
+    parser.add_argument('--impair', help="помехи передач на loopback, например 'loss=0.05,delay=20ms' (impairment.py)")
+    parser.add_argument('--output', '-o', help='файл для отчета JSON')
+    parser.add_argument('--compare', help='отчет JSON прошлого запуска для поиска регрессий')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='допустимое ухудшение, доля')
+    args = parser.parse_args(argv)
+
+    if args.checksum:
+        protocol.set_checksum_mode(args.checksum)
+    options = {key: value for key, value in (('compress', args.compress), ('redundancy', args.fec),
+                                             ('impair', args.impair)) if value}
+    report = run(args.quick, args.micro_only, **options)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(json.load(file), report, args.threshold)
+        for line in regressions:
+            print('Регрессия:', line)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
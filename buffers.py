@@ -0,0 +1,27 @@
+POOL_SIZE = 64             # количество заранее выделенных буферов приема
+BUFFER_SIZE = 65535         # максимальный размер UDP-датаграммы
+
+
+class BufferPool:
+    """ Пул переиспользуемых буферов приема для recvfrom_into. Датаграмма читается в готовый bytearray,
+    заголовок и данные разбираются срезами memoryview, поэтому на каждый пакет память не выделяется. """
+
+    def __init__(self, count=POOL_SIZE, size=BUFFER_SIZE):
+        """ count: Количество буферов, выделяемых сразу и хранимых в пуле.
+        size: Размер одного буфера, не меньше самой большой ожидаемой датаграммы. """
+
+        self.count = count
+        self.size = size
+        self.free = [bytearray(size) for _ in range(count)]
+
+    def acquire(self):
+        """ Возвращает свободный буфер. Если все заняты (например, ждут записи на диск), выделяется новый. """
+        return self.free.pop() if self.free else bytearray(self.size)
+
+    def release(self, buffer):
+        """ Возвращает буфер в пул. Лишние буферы сверх count отдаются сборщику мусора.
+
+        buffer: Буфер, полученный из acquire. """
+
+        if len(self.free) < self.count:
+            self.free.append(buffer)
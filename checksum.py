@@ -0,0 +1,80 @@
+import zlib
+
+try:                                # необязательное C-расширение для CRC-32C
+    import crc32c as _crc32c_ext
+except ImportError:
+    _crc32c_ext = None
+
+CRC32C_POLY = 0x82F63B78            # отраженный полином CRC-32C (Castagnoli)
+MODES = ('crc32', 'crc32c', 'legacy')
+LEGACY_BITS = {code: format(code, 'b') for code in range(128)}     # str(bytes) содержит только ASCII
+
+
+def make_table(poly):
+    """ Строит таблицу из 256 значений для табличного вычисления CRC. Возвращает список int.
+
+    poly: Отраженный полином CRC. """
+
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ poly if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC32C_TABLE = make_table(CRC32C_POLY)
+
+
+def crc32c(data, value=0):
+    """ Табличный CRC-32C для bytes/bytearray/memoryview. Возвращает int.
+
+    data: Данные для контрольной суммы.
+    value: Предыдущее значение CRC для продолжения вычисления. """
+
+    if _crc32c_ext is not None:
+        return _crc32c_ext.crc32c(data, value)
+    crc = value ^ 0xFFFFFFFF
+    table = CRC32C_TABLE
+    for byte in memoryview(data).cast('B'):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def legacy(data):
+    """ Совместимая со старыми версиями контрольная сумма: сумма битов остатка от деления на CRC_KEY = x^3 + 1.
+    Возвращает int, равный значению старого protocol.set_crc.
+
+    Старый алгоритм строил строку битов из str(data) и делил её столбиком. Так как x^3 = 1 по модулю x^3 + 1,
+    остаток равен XOR всех 3-битных групп числа, поэтому деление заменено свёрткой большого целого.
+
+    data: Данные для контрольной суммы. """
+
+    if isinstance(data, (bytearray, memoryview)):
+        data = bytes(data)
+    text = str(data)
+    bits = text.translate(LEGACY_BITS) if text.isascii() else ''.join(format(ord(char), 'b') for char in text)
+    number = int(bits, 2) << 3                              # дописанные нули степени ключа
+    width = number.bit_length()
+    while width > 3:                                        # свёртка пополам по границе, кратной 3
+        shift = (width // 2 + 2) // 3 * 3
+        number = (number >> shift) ^ (number & ((1 << shift) - 1))
+        width = number.bit_length()
+    return bin(number).count('1')
+
+
+def checksum(data, mode='crc32', value=0):
+    """ Контрольная сумма данных в выбранном режиме. Возвращает int.
+
+    data: Данные для контрольной суммы.
+    mode: 'crc32', 'crc32c' или 'legacy'.
+    value: Предыдущее значение CRC для продолжения вычисления (в режиме legacy не используется). """
+
+    if mode == 'crc32':
+        return zlib.crc32(data, value)      # табличная реализация zlib на C
+    if mode == 'crc32c':
+        return crc32c(data, value)
+    if mode == 'legacy':
+        return legacy(data)
+    raise ValueError(f'Неизвестный режим контрольной суммы: {mode}')
@@ -1,5 +1,3 @@
-
-
 import server
 import protocol
 import select
@@ -7,22 +5,40 @@ import socket
 import sys
 import os
 import ntpath
+import json
 import math
+import mmap
+import random
+import rtt
+import congestion
+import pmtu
+import reassembly
+import parallel
+import store
+import compression
+import connection
+import batch
+import delta
+import fec
+import integrity
+import metrics
+import report
+import tempfile
 import time
 import logging
-from datetime import datetime
-import matplotlib.pyplot as plt
 
 
-# Настройка логгирования 
-log_filename = f"transfer_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-logging.basicConfig(
-    filename=log_filename,
-    filemode='w',
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s'
-)
-logger = logging.getLogger()
+logger = logging.getLogger()                # журнал настраивает точка входа (logs.configure)
+
+FRAGMENTS = metrics.FRAGMENTS_SENT.labels('client')     # метрики клиента с уже выбранными метками
+BYTES = metrics.BYTES_SENT.labels('client')
+TIMEOUT_RETRANSMITS = metrics.RETRANSMITS.labels('client', 'timeout')
+NACK_RETRANSMITS = metrics.RETRANSMITS.labels('client', 'nack')
+CRC_FAILURES = metrics.CRC_FAILURES.labels('client')
+RECOVERED = metrics.RECOVERED.labels('client')
+RTT = metrics.RTT.labels('client')
+WINDOW = metrics.WINDOW.labels('client')
+GOODPUT = metrics.GOODPUT.labels('client')
 
 def get_file_name(file_path):
     """ Получает имя файла из пути к файлу. Возвращает имя файла.
@@ -31,161 +47,684 @@ def get_file_name(file_path):
     return ntpath.split(file_path.decode('utf-8'))[1]
 
 
-def initialization(client_socket, server_ip, server_port, fragment_size, data):
-    """ Инициализация передачи текста или файла.
+def request(client_socket, address, packet, session, reply_type, estimator, retries=protocol.MAX_RETRIES):
+    """ Отправка управляющего сообщения (SET, FIN) с повторами по таймауту RTO и экспоненциальным увеличением
+    таймаута, пока не придет ответ нужного типа. Возвращает ответ или None, если сервер не ответил
+    за protocol.MAX_RETRIES повторов. RTT измеряется только по ответу на первую отправку (правило Карна).
+
+    client_socket: Клиентский сокет.
+    address: Адрес сервера.
+    packet: Сообщение с заголовком протокола.
+    session: Идентификатор сессии, ответы других сессий пропускаются.
+    reply_type: Ожидаемый тип ответа MsgType.
+    estimator: rtt.RttEstimator соединения.
+    retries: Количество повторов. """
+
+    for attempt in range(retries + 1):
+        client_socket.sendto(packet, address)
+        sent_time = time.monotonic()
+        deadline = sent_time + estimator.rto
+        timed_out = True
+        while timed_out:
+            ready = select.select([client_socket], [], [], max(deadline - time.monotonic(), 0))
+            if not ready[0]:
+                break
+            reply, _ = client_socket.recvfrom(protocol.DEFAULT_BUFF)
+            if protocol.check_crc(reply) != protocol.MsgType.ACK or protocol.get_session(reply) != session:
+                continue
+            if protocol.get_msg_type(reply) == reply_type.value:
+                if attempt == 0:
+                    estimator.sample(sent_time)
+                return reply
+            if protocol.get_msg_type(reply) == protocol.MsgType.RST.value:     # сообщение повреждено - сразу повтор
+                timed_out = False
+        if timed_out:
+            estimator.backoff()
+    return None
+
+
+def initialization(client_socket, server_ip, server_port, msg_type, params, estimator, session=None):
+    """ Инициализация передачи текста или файла. Возвращает идентификатор сессии (0, если соединение не установлено)
+    и параметры из ответа сервера: для продолжаемой передачи файла - уже принятые диапазоны фрагментов.
 
         client_socket: Клиентский сокет содержит адрес источника и метод sendto.
         server_ip: Одна часть целевого адреса в сокете
         server_port: Вторая часть целевого адреса в сокете
-        fragment_size: Максимальный размер одного фрагмента, заданный пользователем
-        data: данные для передачи текста содержат один байт, указывающий протоколу
-              на добавление типа msg в качестве текстовой передачи.
-              Данные для передачи файла содержат имя файла, который будет создан на сервере.
-              Остальное - количество фрагментов как для передачи текста, так и для передачи файла.  """
-    try:
-        while True:
-            client_socket.sendto(  # инициализация передачи данных
-                protocol.msg_initialization(fragment_size, data),  # инициализационный msg
-                (server_ip, server_port))  # адрес сервера
-            ready = select.select([client_socket], [], [], 5)
-            if ready[0]:
-                new_data, server_address = client_socket.recvfrom(fragment_size)
-            else:
-                print('Соединение не установлено')
-                return 0
+        msg_type: MsgType.SET для передачи файла или MsgType.SET_MSG для передачи текста.
+        params: параметры передачи: имя файла, который будет создан на сервере (только для файла),
+                количество фрагментов, размер данных фрагмента и размер окна.
+        estimator: rtt.RttEstimator, получает первое измерение RTT.
+        session: Идентификатор уже начатой сессии (присоединение потока), по умолчанию - новый случайный.  """
 
-            if new_data[:1].decode('utf-8') == protocol.MsgType.ACK.value:
-                break
+    session = session or random.randint(1, 0xFFFFFFFF)
+    try:
+        reply = request(client_socket, (server_ip, server_port), protocol.msg_initialization(msg_type, params, session),
+                        session, protocol.MsgType.ACK, estimator)
+        if reply is None:
+            print('Соединение не установлено')
+            return 0, {}
         print(protocol.MsgReply.SET.value)
 
     except ConnectionResetError:
         print('Соединение потеряно. Включите сервер.')
-    return 1
+        return 0, {}
+    try:
+        accepted = protocol.get_params(reply) if len(reply) > protocol.HEADER_SIZE else {}
+    except ValueError:                                              # сервер старой версии
+        accepted = {}
+    return session, accepted
+
+
+def finish(client_socket, server_ip, server_port, session, estimator):
+    """ Завершение передачи: FIN серверу и ожидание его FIN, вместо ожидания тишины. Возвращает True,
+    если сервер подтвердил завершение.
+
+    client_socket: Клиентский сокет.
+    server_ip: Одна часть целевого адреса в сокете
+    server_port: Вторая часть целевого адреса в сокете
+    session: Идентификатор сессии.
+    estimator: rtt.RttEstimator соединения. """
+
+    return request(client_socket, (server_ip, server_port), protocol.add_header(protocol.MsgType.FIN, b'', 0, session),
+                   session, protocol.MsgType.FIN, estimator) is not None
+
+
+def fetch_signatures(client_socket, server_ip, server_port, name, estimator, window_size=protocol.DEFAULT_WINDOW):
+    """ Получение сигнатур блоков прежней версии файла на сервере (delta.py). Первая часть запрашивается
+    с повторами как SET, остальные - окном по window_size запросов, потерянные запрашиваются снова.
+    Возвращает (размер блока, размер и время изменения прежней версии, сигнатуры подряд) или None,
+    если прежней версии нет или сервер не ответил (старый сервер запросы сигнатур пропускает).
+
+    client_socket: Клиентский сокет.
+    server_ip: Одна часть целевого адреса в сокете
+    server_port: Вторая часть целевого адреса в сокете
+    name: Имя файла на сервере.
+    estimator: rtt.RttEstimator соединения.
+    window_size: Сколько запросов отправляется, не дожидаясь ответов. """
+
+    address = (server_ip, server_port)
+    session = random.randint(1, 0xFFFFFFFF)
+    body = json.dumps({'name': name}).encode('utf-8')
+    reply = request(client_socket, address, protocol.add_header(protocol.MsgType.SIG, body, 0, session), session,
+                    protocol.MsgType.SIG, estimator, delta.SIG_RETRIES)           # старый сервер не ответит
+    if reply is None or len(reply) < protocol.HEADER_SIZE + delta.SIG_HEADER.size:
+        return None
+    meta = delta.SIG_HEADER.unpack_from(reply, protocol.HEADER_SIZE)
+    if meta[0] == 0:                                            # прежней версии нет
+        return None
+    chunks = {0: bytes(reply[protocol.HEADER_SIZE + delta.SIG_HEADER.size:])}
+    missing = list(range(1, math.ceil(meta[3] / delta.CHUNK_BLOCKS)))
+    retries = 0
+    while missing:
+        for chunk in missing[:window_size]:
+            client_socket.sendto(protocol.add_header(protocol.MsgType.SIG, body, chunk, session), address)
+        deadline = time.monotonic() + estimator.rto
+        progress = False
+        while missing and select.select([client_socket], [], [], max(deadline - time.monotonic(), 0))[0]:
+            reply, _ = client_socket.recvfrom(protocol.DEFAULT_BUFF)
+            if protocol.check_crc(reply) != protocol.MsgType.ACK or protocol.get_session(reply) != session \
+                    or protocol.get_msg_type(reply) != protocol.MsgType.SIG.value:
+                continue
+            if delta.SIG_HEADER.unpack_from(reply, protocol.HEADER_SIZE) != meta:   # файл на сервере изменился
+                return None
+            chunk = protocol.get_seq(reply)
+            if chunk in missing:
+                missing.remove(chunk)
+                chunks[chunk] = bytes(reply[protocol.HEADER_SIZE + delta.SIG_HEADER.size:])
+                progress = True
+        if not progress:
+            retries += 1
+            estimator.backoff()
+            if retries > protocol.MAX_RETRIES:
+                return None
+    return meta[0], meta[1], meta[2], b''.join(chunks[chunk] for chunk in sorted(chunks))
+
+
+def exchange_digests(client_socket, address, session, digests, ranges, estimator, chunk_ranges,
+                     window_size=protocol.DEFAULT_WINDOW):
+    """ Отправка хешей диапазонов (MsgType.DIG) окном по window_size сообщений, номер сообщения - номер
+    его первого диапазона, потерянные отправляются снова. Возвращает отсортированный список номеров диапазонов,
+    хеши которых на сервере не совпали, или None, если сервер не ответил.
+
+    client_socket: Клиентский сокет.
+    address: Адрес сервера.
+    session: Идентификатор сессии передачи.
+    digests: Хеши всех диапазонов файла (integrity.RangeHasher.digests).
+    ranges: Номера проверяемых диапазонов по возрастанию.
+    estimator: rtt.RttEstimator соединения.
+    chunk_ranges: Хешей в одном сообщении, чтобы оно поместилось в буфер фрагмента сервера.
+    window_size: Сколько сообщений отправляется, не дожидаясь ответов. """
+
+    chunks, run = {}, []
+    for index in ranges:                                        # подряд идущие диапазоны - в одном сообщении
+        if run and (index != run[-1] + 1 or len(run) == chunk_ranges):
+            chunks[run[0]] = b''.join(digests[item] for item in run)
+            run = []
+        run.append(index)
+    if run:
+        chunks[run[0]] = b''.join(digests[item] for item in run)
+    missing = sorted(chunks)
+    bad = set()
+    retries = 0
+    while missing:
+        for first in missing[:window_size]:
+            client_socket.sendto(protocol.add_header(protocol.MsgType.DIG, chunks[first], first, session), address)
+        deadline = time.monotonic() + estimator.rto
+        progress = False
+        while missing and select.select([client_socket], [], [], max(deadline - time.monotonic(), 0))[0]:
+            reply, _ = client_socket.recvfrom(protocol.DEFAULT_BUFF)
+            if protocol.check_crc(reply) != protocol.MsgType.ACK or protocol.get_session(reply) != session \
+                    or protocol.get_msg_type(reply) != protocol.MsgType.DIG.value:
+                continue
+            first = protocol.get_seq(reply)
+            if first in missing:
+                missing.remove(first)
+                bad.update(index for (index,) in integrity.BAD.iter_unpack(protocol.get_data(reply)))
+                progress = True
+        if not progress:
+            retries += 1
+            estimator.backoff()
+            if retries > protocol.MAX_RETRIES:
+                return None
+    return sorted(bad)
+
+
+def verify_ranges(client_socket, server_ip, server_port, session, view, payload_size, hasher, window_size,
+                  estimator, controller, compressor=None):
+    """ Сквозная проверка после отправки всех фрагментов: сервер сравнивает хеши диапазонов с записанными данными,
+    несовпавшие диапазоны отправляются заново (до integrity.ROUNDS раз). Контрольная сумма фрагмента
+    не ловит повреждения после приема (диск, память) и совпавшие по CRC ошибки, хеш диапазона - ловит.
+    Возвращает True, если все диапазоны совпали, False - если повреждение повторяется, None - сервер не ответил.
+
+    view: Данные файла (memoryview), из которых повторяются диапазоны.
+    payload_size: Размер данных фрагмента.
+    hasher: integrity.RangeHasher с хешами всех диапазонов.
+    Остальные параметры - как у send_fragments. """
+
+    address = (server_ip, server_port)
+    per_range = hasher.fragments_per_range
+    chunk_ranges = max(1, min(integrity.CHUNK_RANGES, payload_size // integrity.DIGEST_SIZE))
+    ranges = list(range(len(hasher.digests)))
+    for attempt in range(integrity.ROUNDS + 1):
+        bad = exchange_digests(client_socket, address, session, hasher.digests, ranges, estimator, chunk_ranges,
+                               window_size)
+        if not bad:
+            return None if bad is None else True
+        if attempt == integrity.ROUNDS:
+            break
+        print('Хеши не совпали, повтор диапазонов:', bad)
+        logger.warning(f"Хеши диапазонов {bad} не совпали, повтор")
+        for index in bad:
+            start = index * per_range * payload_size
+            end = min(start + per_range * payload_size, len(view))
+            fragments = (view[offset:offset + payload_size] for offset in range(start, end, payload_size))
+            if send_fragments(client_socket, server_ip, server_port, session, fragments, window_size, False,
+                              estimator, controller, first=index * per_range, compressor=compressor) is None:
+                return None
+        ranges = bad
+    return False
+
+
+def make_delta(file_path, basis):
+    """ Дельта файла относительно прежней версии на сервере во временном файле. Возвращает временный файл
+    (удаляется при закрытии) и количество байт новых данных в дельте.
+
+    file_path: Путь к новой версии файла.
+    basis: Результат fetch_signatures. """
+
+    block, size, _, blob = basis
+    stream = tempfile.TemporaryFile()
+    with open(file_path, 'rb') as file:
+        view = map_file(file)
+        try:
+            literal = delta.diff(view, blob, block, size, stream)
+        finally:
+            view.release()
+    stream.flush()
+    return stream, literal
+
 
+def auto_fragment_size(server_ip, server_port, estimator):
+    """ Выбор размера фрагмента по PMTU пути до сервера. Возвращает размер фрагмента с заголовком протокола.
 
-def send_file(server_ip, client_socket, server_port, fragment_size, file_path):
-    """ Передача файла с логированием. """
+    server_ip: Одна часть целевого адреса в сокете
+    server_port: Вторая часть целевого адреса в сокете
+    estimator: rtt.RttEstimator соединения, получает первые измерения RTT по пробам. """
+
+    try:
+        fragment_size = pmtu.discover(server_ip, server_port, estimator)
+    except OSError:
+        fragment_size = protocol.FRAGMENT_MAX + protocol.HEADER_SIZE
+    print('Размер фрагмента по PMTU:', fragment_size - protocol.HEADER_SIZE)
+    logger.info(f"Размер фрагмента по PMTU: {fragment_size - protocol.HEADER_SIZE}")
+    return fragment_size
+
+
+def send_packet(client_socket, header, data, address):
+    """ Отправка заголовка и данных одной датаграммой без их склеивания (scatter-gather sendmsg).
+    Там, где sendmsg нет (Windows), заголовок и данные объединяются.
+
+    client_socket: Клиентский сокет.
+    header: Заголовок протокола.
+    data: Данные фрагмента (bytes или memoryview).
+    address: Адрес сервера. """
+
+    if hasattr(client_socket, 'sendmsg'):
+        return client_socket.sendmsg([header, data], [], 0, address)
+    return client_socket.sendto(header + data, address)
+
+
+def map_file(file):
+    """ Отображение файла в память только для чтения. Возвращает memoryview, срезы которого не копируют данные.
+    Отображение закрывается само, когда освобождены все срезы.
+
+    file: Открытый в режиме 'rb' файл. """
+
+    if os.fstat(file.fileno()).st_size == 0:                    # пустой файл отобразить нельзя
+        return memoryview(b'')
+    return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def send_fragments(client_socket, server_ip, server_port, session, fragments, window_size=protocol.DEFAULT_WINDOW,
+                   mistake=False, estimator=None, controller=None, skip=(), first=0, compressor=None, encoder=None,
+                   latencies=None, timeline=None, setup=None):
+    """ Передача фрагментов скользящим окном (ARQ Selective Repeat). Возвращает количество отправленных фрагментов,
+    количество повторных передач и status_log, либо None, если сервер перестал отвечать.
+
+    client_socket: Клиентский сокет содержит адрес источника и метод sendto.
+    server_ip: Одна часть целевого адреса в сокете
+    server_port: Вторая часть целевого адреса в сокете
+    session: Идентификатор сессии, полученный при инициализации.
+    fragments: Итератор по данным фрагментов без заголовка (bytes или memoryview).
+    window_size: Количество фрагментов в полете без подтверждения, не больше protocol.WINDOW_MAX.
+    mistake: Повредить первую передачу первого фрагмента (симуляция ошибки).
+    estimator: rtt.RttEstimator, задающий таймер повторной передачи.
+    controller: congestion.CongestionController, ограничивающий число фрагментов в полете,
+                по умолчанию NewReno. Отправка распределяется по RTT (congestion.Pacer).
+    skip: Номера фрагментов, уже принятых сервером (reassembly.FragmentBitmap или множество), они не отправляются.
+    first: Номер первого фрагмента из fragments, когда отправляется только часть файла.
+    compressor: compression.Compressor, сжимающий каждый фрагмент отдельно, или None без сжатия.
+    encoder: fec.Encoder, после каждого блока фрагментов отправляющий фрагменты четности, или None без FEC.
+    latencies: Список, в который добавляется время от первой отправки до подтверждения каждого фрагмента.
+    timeline: Список, в который добавляется момент (секунды от начала) каждой записи status_log (report.py).
+    setup: Сообщение инициализации в постоянной сессии (connection.py): отправляется вместе с фрагментами
+           и повторяется по таймауту, пока сервер не подтвердит его или первый фрагмент. """
+
+    estimator = estimator or rtt.RttEstimator()
+    controller = controller or congestion.NewReno()
+    pacer = congestion.Pacer(controller, estimator)
+    window_size = max(1, min(window_size, protocol.WINDOW_MAX))
+    in_flight = {}                          # номер -> [заголовок, данные, время повтора, число повторов, время отправки]
+    address = (server_ip, server_port)
+    next_seq, all_fragment, nack_fragment = first, 0, 0
+    status_log = []
+    fragments = iter(fragments)
+    exhausted = False
+    backoff_time = 0                        # до этого момента таймаут повторно не удваивается
+    start_time = time.monotonic()
+    setup_time, setup_retries = None, 0     # время повтора неподтвержденной инициализации
+    if setup is not None:
+        client_socket.sendto(setup, address)
+        setup_time = start_time + estimator.rto
+
+    while True:
+        base = next(iter(in_flight), next_seq)                  # самый старый неподтвержденный фрагмент
+        now = time.monotonic()
+        while not exhausted and next_seq < base + window_size and len(in_flight) < controller.window \
+                and pacer.delay(now) == 0:                      # заполнение окна в темпе пейсинга
+            data = next(fragments, None)
+            if data is None:
+                exhausted = True
+                break
+            if next_seq in skip:                                # получен сервером в прерванной передаче
+                if encoder is not None:
+                    encoder.skip(next_seq)
+                next_seq += 1
+                if not in_flight:
+                    base = next_seq
+                continue
+            parity = encoder.add(next_seq, data) if encoder is not None else ()     # четность - до сжатия
+            flags = 0
+            if compressor is not None:
+                data, flags = compressor.encode(data)
+            header = protocol.make_header(protocol.MsgType.PSH, data, next_seq, session, flags)
+            if mistake:
+                client_socket.sendto(header + data[14:], address)
+                mistake = False
+            else:
+                send_packet(client_socket, header, data, address)
+            now = time.monotonic()
+            in_flight[next_seq] = [header, data, now + estimator.rto, 0, now]
+            pacer.sent(now)
+            next_seq += 1
+            all_fragment += 1
+            FRAGMENTS.inc()
+            BYTES.inc(len(data))
+            for group, payload in parity:                       # четность не подтверждается и не повторяется
+                send_packet(client_socket, protocol.make_header(protocol.MsgType.PAR, payload, group, session),
+                            payload, address)
+
+        if not in_flight and exhausted and setup_time is None:
+            break
+
+        deadline = min((entry[2] for entry in in_flight.values()), default=math.inf)
+        if setup_time is not None:
+            deadline = min(deadline, setup_time)
+        if not exhausted and next_seq < base + window_size and len(in_flight) < controller.window:
+            deadline = min(deadline, pacer.next_time)           # есть место в окне - ждем очереди пейсинга
+        ready = select.select([client_socket], [], [], max(deadline - time.monotonic(), 0))
+        if ready[0]:
+            reply, _ = client_socket.recvfrom(protocol.DEFAULT_BUFF)
+            if protocol.check_crc(reply) != protocol.MsgType.ACK:
+                CRC_FAILURES.inc()
+                continue
+            if protocol.get_session(reply) != session:
+                continue
+            if protocol.get_msg_type(reply) == protocol.MsgType.ACK.value:
+                setup_time = None                               # сервер начал передачу
+                if protocol.get_flags(reply) & protocol.FLAG_ACCEPT:
+                    continue                                    # ответ на инициализацию, а не на фрагмент 0
+            seq = protocol.get_seq(reply)
+            if seq not in in_flight:                            # повторное подтверждение
+                continue
+            if protocol.get_msg_type(reply) == protocol.MsgType.ACK.value:
+                entry = in_flight.pop(seq)
+                if protocol.get_flags(reply) & protocol.FLAG_RECOVERED:    # восстановлен по четности, не RTT
+                    RECOVERED.inc()
+                    if encoder is not None:
+                        encoder.recovered += 1
+                elif entry[3] == 0:                             # правило Карна: только без повторов
+                    estimator.sample(entry[4])
+                    RTT.observe(time.monotonic() - entry[4])
+                if latencies is not None:
+                    latencies.append(time.monotonic() - entry[4])
+                controller.on_ack(seq)
+                WINDOW.set(controller.window)
+                GOODPUT.inc(len(entry[1]))
+                status_log.append(1)                            # Успешная передача
+                if timeline is not None:
+                    timeline.append(time.monotonic() - start_time)
+                continue
+            print('negative acknowledgment msg. Ошибка обработки сообщения')
+            nack_fragment += 1
+            expired = [seq]                                     # выборочный повтор только поврежденного фрагмента
+        else:
+            now = time.monotonic()
+            expired = [seq for seq, entry in in_flight.items() if entry[2] <= now]
+            if expired and now >= backoff_time:                 # потеря - таймаут удваивается раз за период таймера
+                estimator.backoff()
+                backoff_time = now + estimator.rto
+            if setup_time is not None and setup_time <= now:    # инициализация потеряна, фрагменты без нее
+                setup_retries += 1                              # сервер отбрасывает
+                if setup_retries > protocol.MAX_RETRIES:
+                    return None
+                client_socket.sendto(setup, address)
+                setup_time = now + estimator.rto
+
+        for seq in expired:
+            entry = in_flight[seq]
+            if not ready[0]:                                    # RST - повреждение, а не перегрузка
+                if entry[3] == 0:
+                    controller.on_loss(seq, next_seq)
+                else:
+                    controller.on_timeout(seq, next_seq)
+            entry[3] += 1
+            if entry[3] > protocol.MAX_RETRIES:
+                return None
+            send_packet(client_socket, entry[0], entry[1], address)
+            entry[2] = time.monotonic() + estimator.rto
+            all_fragment += 1
+            FRAGMENTS.inc()
+            BYTES.inc(len(entry[1]))
+            (NACK_RETRANSMITS if ready[0] else TIMEOUT_RETRANSMITS).inc()
+            status_log.append(0)                                # Повторная передача
+            if timeline is not None:
+                timeline.append(time.monotonic() - start_time)
+        WINDOW.set(controller.window)
+
+    return all_fragment, nack_fragment, status_log
+
+
+def send_file(server_ip, client_socket, server_port, fragment_size, file_path, window_size=protocol.DEFAULT_WINDOW,
+              algorithm=congestion.DEFAULT_CONTROLLER, compress=None, redundancy=None, incremental=False,
+              latencies=None, report_path=None, batch_files=None, dedup=False, verify=True, connection=None):
+    """ Передача файла с логированием. fragment_size - размер фрагмента с заголовком протокола
+    или protocol.FRAGMENT_AUTO для выбора по PMTU пути, window_size ограничивает окно сверху,
+    algorithm - имя алгоритма управления перегрузкой из congestion.CONTROLLERS,
+    compress - сжатие фрагментов вида 'zlib' или 'lzma:9' (compression.parse), если сервер его поддерживает,
+    redundancy - FEC вида '16:2' (fec.parse): на каждые 16 фрагментов 2 фрагмента четности,
+    incremental - если на сервере есть прежняя версия файла, передать только изменения (delta.py),
+    сервер заменит прежнюю версию новой, latencies - список для задержек подтверждения фрагментов (benchmark.py),
+    report_path - файл JSON для графиков скорости и повторных передач (report.py),
+    batch_files - количество файлов, если file_path - пакет из batch.pack (send_batch),
+    dedup - сообщить серверу хеш содержимого (store.py): если такое содержимое у него есть, файл не передается,
+    verify - сверить с сервером хеши диапазонов (integrity.py) и повторить только поврежденные диапазоны,
+    connection - connection.Connection: RTT и окно перегрузки берутся из ее сессии.
+    Возвращает True, если файл передан. """
     # используем глобальную переменную, которую задаёт GUI
-    user_input_mistake = globals().get("user_input_mistake", "n")
+    user_input_mistake = globals().get("user_input_mistake", "н")
     # user_input_mistake = input('Добавить ошибку в передачу данных? д/н ')
 
     if user_input_mistake.lower() not in ['д', 'н']:
         print('Неверный ввод!')
         return
 
-    file_name = bytes(get_file_name(file_path), 'utf-8')
+    estimator = connection.estimator if connection is not None else rtt.RttEstimator()
+    controller = connection.controller if connection is not None else congestion.CONTROLLERS[algorithm]()
+    compress = compression.parse(compress)
+    redundancy = fec.parse(redundancy)
+    if fragment_size == protocol.FRAGMENT_AUTO:
+        fragment_size = auto_fragment_size(server_ip, server_port, estimator)
+    payload_size = fragment_size - protocol.HEADER_SIZE
     file_size = os.path.getsize(file_path)
-    num_of_fragment = math.ceil(file_size / (fragment_size - protocol.HEADER_SIZE))
-
-    nack_fragment, all_fragment = 0, 0
-    status_log = []
+    source, delta_params = None, None                               # дельта вместо файла
 
     try:
-        if initialization(client_socket, server_ip, server_port, fragment_size,
-                          file_name + bytes(str(num_of_fragment), 'utf-8')) == 0:
+        if incremental:
+            basis = fetch_signatures(client_socket, server_ip, server_port, get_file_name(file_path), estimator,
+                                     window_size)
+            if basis is None:
+                print('Прежней версии файла на сервере нет, файл передается целиком')
+            else:
+                source, literal = make_delta(file_path, basis)
+                delta_params = {'block': basis[0], 'basis': [basis[1], basis[2]], 'size': file_size}
+        content = store.file_hash(file_path) if dedup and not batch_files else None
+        transfer_size = os.fstat(source.fileno()).st_size if source else file_size
+        num_of_fragment = math.ceil(transfer_size / payload_size)
+        per_range = integrity.range_fragments(payload_size) if verify and payload_size >= integrity.DIGEST_SIZE \
+            else None                                               # хеш диапазона должен поместиться во фрагмент
+        if source:
+            print(f'Дельта: {transfer_size} байт вместо {file_size}, новых данных {literal} байт')
+            logger.info(f"Дельта: {transfer_size} байт вместо {file_size}, новых данных {literal} байт")
+
+        params = {'name': get_file_name(file_path), 'count': num_of_fragment, 'fragment': payload_size,
+                  'window': window_size, 'size': transfer_size, 'mtime': os.stat(file_path).st_mtime_ns,
+                  'compression': compress and compress[0], 'fec': redundancy, 'delta': delta_params,
+                  'batch': {'files': batch_files} if batch_files else None, 'hash': content, 'digest': per_range,
+                  'connection': connection and connection.session}
+        session, accepted = initialization(client_socket, server_ip, server_port, protocol.MsgType.SET, params,
+                                           estimator)                   # в ответе - уже принятые диапазоны
+        if session == 0:
             return
+        if accepted.get('have'):
+            print('Файл с таким содержимым уже есть на сервере, передача не нужна')
+            logger.info(f"Файл уже есть на сервере: {file_path.decode('utf-8')}")
+            return True
+        compressor = compression.Compressor(*compress) if compress and accepted.get('compression') == compress[0] \
+            else None                                               # старый сервер принимает только несжатые
+        encoder = fec.Encoder(*redundancy, num_of_fragment) if redundancy and accepted.get('fec') == list(redundancy) \
+            else None                                               # старый сервер четность не принимает
+        hasher = integrity.RangeHasher(per_range) if per_range and accepted.get('digest') == per_range \
+            else None                                               # старый сервер хеши не проверяет
+        received = reassembly.FragmentBitmap(num_of_fragment)      # уже принятые сервером фрагменты
+        for start, end in accepted.get('received', ()):
+            received.add_range(start, end)
+        if received.received:
+            print('Продолжение передачи, сервер уже получил фрагментов:', received.received)
+            logger.info(f"Продолжение передачи: получено {received.received}/{num_of_fragment}")
 
         start_time = time.time()
-        with open(file_path, 'rb') as file:
-            data = file.read(fragment_size - protocol.HEADER_SIZE)
-            fragment_count = 0
-
-            while data:
-                new_data = protocol.add_header(protocol.MsgType.PSH, fragment_size, data)
-                if user_input_mistake == 'д':
-                    header = new_data[:6]
-                    new_data = header + new_data[20:]
-                    user_input_mistake = 'н'
-
-                if client_socket.sendto(new_data, (server_ip, server_port)):
-                    reply, _ = client_socket.recvfrom(fragment_size)
-
-                    if reply[:1].decode('utf-8') != protocol.MsgType.ACK.value:
-                        print('negative acknowledgment msg. Ошибка обработки сообщения')
-                        nack_fragment += 1
-                        all_fragment += 1
-                        status_log.append(0)  # Повторная передача
-                    else:
-                        data = file.read(fragment_size - protocol.HEADER_SIZE)
-                        fragment_count += 1
-                        all_fragment += 1
-                        status_log.append(1)  # Успешная передача
-
-        ready = select.select([client_socket], [], [], 5)
-        if ready[0]:
-            _ = client_socket.recvfrom(fragment_size)
+        timeline = [] if report_path else None
+        with source or open(file_path, 'rb') as file:
+            view = map_file(file)
+            try:
+                fragments = (view[offset:offset + payload_size] for offset in range(0, len(view), payload_size))
+                result = send_fragments(client_socket, server_ip, server_port, session,
+                                        hasher.feed(fragments) if hasher is not None else fragments,
+                                        window_size, user_input_mistake == 'д', estimator, controller, received,
+                                        compressor=compressor, encoder=encoder, latencies=latencies,
+                                        timeline=timeline)
+                verified = None
+                if result is not None and hasher is not None:
+                    verified = verify_ranges(client_socket, server_ip, server_port, session, view, payload_size,
+                                             hasher, window_size, estimator, controller, compressor)
+            finally:
+                view.release()
+        if result is None or verified is None and hasher is not None:
+            print('Соединение не установлено')
+            return
+        if verified is False:
+            print('Файл повреждается при передаче: хеши диапазонов не совпали после', integrity.ROUNDS, 'повторов')
+            logger.error(f"Хеши диапазонов не совпали: {file_path.decode('utf-8')}")
+            return False
+        all_fragment, nack_fragment, status_log = result
+        fragment_count = status_log.count(1)
+        if report_path:
+            try:
+                report.save(report_path, get_file_name(file_path), payload_size, status_log, timeline)
+                print('Отчет для графиков:', report_path, '(python report.py', report_path + ')')
+            except OSError as error:
+                print('Отчет не сохранен:', error)
+
+        if finish(client_socket, server_ip, server_port, session, estimator):
             end_time = time.time()
             print(protocol.MsgReply.ACK.value)
             print('Время:', end_time - start_time)
             print('Сохранено в', os.path.abspath(file_path.decode('utf-8')))
+            if hasher is not None:
+                print('Хеш файла (BLAKE2b, сверен с сервером):', hasher.file_digest())
+                logger.info(f"Хеш файла: {hasher.file_digest()}")
             print('Отправлено фрагментов:', fragment_count, ' всего фрагментов:', num_of_fragment)
             print('Отправлено фрагментов:', all_fragment, ' NACK фрагментов:', nack_fragment)
+            rate = controller.pacing_rate(estimator.srtt)
+            print('Окно перегрузки:', round(controller.window, 1), ' темп отправки:',
+                  f'{rate:.0f} фрагментов/с' if rate else 'без ограничения')
+            if compressor is not None:
+                print(f'Сжатие {compressor.method}: {compressor.raw_bytes} -> {compressor.sent_bytes} байт')
+                logger.info(f"Сжатие {compressor.method}: {compressor.raw_bytes} -> {compressor.sent_bytes} байт")
+            if encoder is not None:
+                print('Фрагментов четности:', encoder.parity_sent, ' восстановлено сервером:', encoder.recovered)
+                logger.info(f"FEC {encoder.block}:{encoder.parity}: четность {encoder.parity_sent}, "
+                            f"восстановлено {encoder.recovered}")
 
             # Логгирование
             logger.info(f"Отправленный файл: {file_path.decode('utf-8')}")
             logger.info(f"Всего фрагментов: {all_fragment}, Повторные передачи (NACK): {nack_fragment}")
+            logger.info(f"Окно перегрузки: {controller.window:.1f}, темп отправки: {rate or 0:.0f} фрагментов/с, "
+                        f"SRTT: {estimator.srtt or 0:.4f} с")
             logger.info(f"Время передачи: {end_time - start_time:.2f} секунд")
             logger.info(f"Сохранено как: {os.path.abspath(file_path.decode('utf-8'))}")
+            return True
 
         else:
             print('Соединение не установлено')
 
     except ConnectionResetError:
         print('Соединение потеряно. Включите сервер.')
+    finally:
+        if source is not None:                                      # временный файл дельты, и при раннем выходе
+            source.close()
+
 
+def send_batch(server_ip, client_socket, server_port, fragment_size, paths, window_size=protocol.DEFAULT_WINDOW,
+               **options):
+    """ Передача дерева директорий и списка файлов за одну инициализацию: файлы упаковываются в пакет
+    (batch.py) - мелкие делят фрагменты, большие идут подряд без ожидания, сервер восстанавливает дерево.
+    Возвращает True, если пакет передан.
 
-def send_message(server_ip, client_socket, server_port, fragment_size, message):
+    paths: Пути к файлам и директориям (str или bytes).
+    options: Остальные параметры send_file (algorithm, compress, redundancy, report_path, ...). """
+
+    try:
+        entries = batch.collect(paths)
+    except FileNotFoundError as error:
+        print('ERROR 01:', error)
+        return False
+    if not entries:
+        print('Нет файлов для передачи')
+        return False
+    name = os.path.basename(os.path.abspath(os.fsdecode(paths[0])).rstrip(os.sep)) or 'batch'
+    with tempfile.TemporaryDirectory() as work:
+        bundle = os.path.join(work, name + batch.SUFFIX)
+        try:
+            with open(bundle, 'wb') as out:
+                total = batch.pack(entries, out)
+        except (OSError, ValueError) as error:
+            print('Ошибка упаковки:', error)
+            return False
+        print(f'Пакет: {len(entries)} файлов, {total} байт')
+        logger.info(f"Пакет {name}: {len(entries)} файлов, {total} байт")
+        return send_file(server_ip, client_socket, server_port, fragment_size, os.fsencode(bundle), window_size,
+                         batch_files=len(entries), **options)
+
+
+def send_message(server_ip, client_socket, server_port, fragment_size, message, window_size=protocol.DEFAULT_WINDOW,
+                 connection=None):
     """ Передача текстовых сообщений.
 
      client_socket: Клиентский сокет содержит адрес источника и метод sendto.
      server_ip: Одна часть целевого адреса в сокете
      server_port: Вторая часть целевого адреса в сокете
-     fragment_size: Максимальный размер одного фрагмента, заданный пользователем
-     Message: Данные, которые необходимо передать. """
+     fragment_size: Максимальный размер данных одного фрагмента, заданный пользователем,
+                    или protocol.FRAGMENT_AUTO для выбора по PMTU пути.
+     Message: Данные, которые необходимо передать.
+     window_size: Количество фрагментов в полете без подтверждения.
+     connection: connection.Connection, в открытой сессии которой текст отправляется без ожидания ответа
+                 на инициализацию. Возвращает True, если текст передан. """
 
     fragment_count = 0
-    num_of_fragment = math.ceil(len(message.decode('utf-8')) / fragment_size)
+    estimator = connection.estimator if connection is not None else rtt.RttEstimator()
+    if fragment_size == protocol.FRAGMENT_AUTO:
+        fragment_size = auto_fragment_size(server_ip, server_port, estimator) - protocol.HEADER_SIZE
+    num_of_fragment = math.ceil(len(message) / fragment_size)
 
-    nack_fragment, all_fragment = 0, 0
+    params = {'count': num_of_fragment, 'fragment': fragment_size, 'window': window_size}
+    done = False
     try:
-        if initialization(client_socket, server_ip, server_port, fragment_size + protocol.HEADER_SIZE,
-                          bytes(protocol.MsgType.SET_MSG.value, 'utf-8') + bytes(str(num_of_fragment), 'utf-8')) == 0:
-            return
-        lenght = math.ceil(len(message) / fragment_size)
-        index1, index2 = 0, fragment_size
-
-        while lenght > 0:
-            data = protocol.add_header(protocol.MsgType.PSH, fragment_size, message[index1:index2])
-            client_socket.sendto(data, (server_ip, server_port))
-            ready = select.select([client_socket], [], [], 5)
-            if ready[0]:
-                reply, server_address = client_socket.recvfrom(fragment_size + protocol.HEADER_SIZE)
-                if reply[:1].decode('utf-8') != protocol.MsgType.ACK.value: # проверка на ACK
-                    print('negative acknowledgment msg. Ошибка обработки сообщения')
-                    nack_fragment += 1
-                    all_fragment += 1
-                else:
-                    index1 += fragment_size
-                    index2 += fragment_size
-                    lenght -= 1
-                    fragment_count += 1
-                    all_fragment += 1
-            else:
-                print('Соединение не установлено')
-                return
+        setup = None
+        if connection is not None:                              # 0-RTT: инициализация вместе с фрагментами
+            session, setup = connection.setup(protocol.MsgType.SET_MSG, {**params, 'connection': connection.session})
+        else:
+            session, _ = initialization(client_socket, server_ip, server_port, protocol.MsgType.SET_MSG, params,
+                                        estimator)
+        if session == 0:
+            return False
+        result = send_fragments(client_socket, server_ip, server_port, session,
+                                (memoryview(message)[index:index + fragment_size]
+                                 for index in range(0, len(message), fragment_size)),
+                                window_size, estimator=estimator, controller=connection and connection.controller,
+                                setup=setup)
+        if result is None or not finish(client_socket, server_ip, server_port, session, estimator):
+            print('Соединение не установлено')
+            return False
+        all_fragment, nack_fragment, status_log = result
+        fragment_count = status_log.count(1)
+        done = True
         logger.info(f"Отправлено текстовое сообщение: {message.decode('utf-8')}")
         logger.info(f"Всего фрагментов: {all_fragment}, Повторные передачи (NACK): {nack_fragment}")
 
     except ConnectionResetError:
         print('Соединение потеряно. Включите сервер.')
     print('Отправлено фрагментов:', fragment_count, ' всего фрагментов:', num_of_fragment, '\n')
+    return done
 
 
 def set_client():
     """ Инициализация настроек клиента. Возвращает server_ip,
-      client_port, server_port, fragmentation, введенные пользователем. """
+      client_port, server_port, fragmentation и размер окна, введенные пользователем. """
 
     server_ip, client_port, server_port, fragmentation = '', '', '', ''
+    window_size = protocol.DEFAULT_WINDOW
     while server_ip == '' or server_port == '' or fragmentation == '':  # считывание значений для установки клиентом
         try:
             if server_ip == '':
@@ -208,14 +747,18 @@ def set_client():
                 server_port = ''
                 continue
 
-            fragmentation = int(input('Введите максимальный размер фрагмента: '))
+            fragmentation = int(input('Введите максимальный размер фрагмента (0 - по PMTU пути): '))
 
-            if fragmentation < protocol.FRAGMENT_MIN:  # проверка заданного значения фрагмента
+            if fragmentation != protocol.FRAGMENT_AUTO and fragmentation < protocol.FRAGMENT_MIN:  # проверка фрагмента
                 fragmentation = protocol.FRAGMENT_MIN
 
             if fragmentation > protocol.FRAGMENT_MAX:  # проверка максимального значения фрагмента
                 fragmentation = protocol.FRAGMENT_MAX
 
+            window_size = input(f'Введите размер окна (по умолчанию {protocol.DEFAULT_WINDOW}): ')
+            window_size = int(window_size) if window_size else protocol.DEFAULT_WINDOW
+            window_size = max(1, min(window_size, protocol.WINDOW_MAX))     # проверка размера окна
+
         except ValueError:  # введен неправильный тип данных
             print('Неверный ввод! Попробуйте снова')
             server_ip, server_port, fragmentation = '', '', ''
@@ -226,14 +769,14 @@ def set_client():
             server_ip = ''
             continue
 
-    return server_ip, client_port, server_port, fragmentation
+    return server_ip, client_port, server_port, fragmentation, window_size
 
 
 def user_interface():
     """ Интерфейс пользователя клиента. """
 
     print('\n{:^50}'.format('client'))
-    server_ip, client_port, server_port, fragmentation = set_client()
+    server_ip, client_port, server_port, fragmentation, window_size = set_client()
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # установить сокет с IPv4 и UDP
     client_socket.bind(('', client_port))  # установить порт источника
 
@@ -241,6 +784,8 @@ def user_interface():
         print('0 - выход\n'
               '1 - отправить текстовое сообщение\n'
               '2 - отправить файл\n'
+              '3 - отправить файл несколькими потоками\n'
+              '4 - сообщения в постоянной сессии (без рукопожатия на каждое)\n'
               '9 - переключиться на сервер')
         user_input = input('Введите, что вы хотите сделать: ')
 
@@ -251,14 +796,50 @@ def user_interface():
 
         if user_input == '1':
             message = bytes(input('Введите сообщение: '), 'utf-8')
-            send_message(server_ip, client_socket, server_port, fragmentation, message)
+            send_message(server_ip, client_socket, server_port, fragmentation, message, window_size)
 
-        elif user_input == '2':
+        elif user_input in ('2', '3'):
             file = bytes(input('Введите путь к файлу: '), 'utf-8')
             if not os.path.isfile(file):  # check if given path is valid
                 print('ERROR 01: Путь', file.decode('utf-8'), 'не существует!')
                 continue
-            send_file(server_ip, client_socket, server_port, fragmentation + protocol.HEADER_SIZE, file)
+            fragment_size = fragmentation + protocol.HEADER_SIZE if fragmentation != protocol.FRAGMENT_AUTO \
+                else protocol.FRAGMENT_AUTO
+            compress = input('Сжатие zlib, lzma или bz2, можно с уровнем (zlib:9), Enter - без сжатия: ')
+            redundancy = input('FEC: фрагментов в блоке и четности на блок (16:2), Enter - без FEC: ')
+            try:
+                compression.parse(compress)
+                fec.parse(redundancy)
+            except ValueError as error:
+                print(error)
+                continue
+            if user_input == '2':
+                incremental = input('Передать только изменения, если файл уже есть на сервере? д/н ').lower() == 'д'
+                report_path = input('Файл отчета JSON для графиков (Enter - без отчета): ')
+                send_file(server_ip, client_socket, server_port, fragment_size, file, window_size, compress=compress,
+                          redundancy=redundancy, incremental=incremental, report_path=report_path or None)
+                continue
+            try:
+                streams = int(input(f'Введите количество потоков (по умолчанию {parallel.DEFAULT_STREAMS}): ')
+                              or parallel.DEFAULT_STREAMS)
+            except ValueError:
+                print('Неверный ввод! Попробуйте снова')
+                continue
+            parallel.send_file(server_ip, client_socket, server_port, fragment_size, file, streams, window_size,
+                               compress=compress, redundancy=redundancy)
+
+        elif user_input == '4':
+            persistent = connection.Connection(client_socket, server_ip, server_port,
+                                               fragmentation + protocol.HEADER_SIZE
+                                               if fragmentation != protocol.FRAGMENT_AUTO else protocol.FRAGMENT_AUTO,
+                                               window_size)
+            print('Пустая строка - закрыть сессию')
+            while True:
+                message = input('Введите сообщение: ')
+                if not message:
+                    break
+                persistent.send_message(bytes(message, 'utf-8'))
+            persistent.close()
 
         elif user_input == '9':
             client_socket.close()
@@ -0,0 +1,95 @@
+import protocol
+import bz2
+import lzma
+import zlib
+
+METHODS = ('zlib', 'lzma', 'bz2')
+DEFAULT_LEVELS = {'zlib': 6, 'lzma': 6, 'bz2': 9}
+LEVELS = {'zlib': range(0, 10), 'lzma': range(0, 10), 'bz2': range(1, 10)}
+ZLIB_WBITS = -15            # deflate без заголовка и контрольной суммы zlib, целостность проверяет CRC протокола
+LZMA_DICT_SIZE = 1 << 16    # словарь LZMA не больше датаграммы, иначе распаковщик выделяет его целиком на каждый фрагмент
+
+
+def parse(spec):
+    """ Разбор настройки сжатия вида 'zlib' или 'lzma:9'. Возвращает (метод, уровень) или None без сжатия.
+
+    spec: Строка настройки, пустая строка или None - без сжатия. """
+
+    if not spec:
+        return None
+    method, _, level = spec.partition(':')
+    method = method.strip().lower()
+    if method not in METHODS:
+        raise ValueError(f'Неизвестный метод сжатия: {method}')
+    level = int(level) if level else DEFAULT_LEVELS[method]
+    if level not in LEVELS[method]:
+        raise ValueError(f'Неверный уровень сжатия {level} для {method}')
+    return method, level
+
+
+def lzma_filters(level=None):
+    """ Фильтры сырого LZMA2: без контейнера xz, который для одного фрагмента больше самих данных. """
+    return [{'id': lzma.FILTER_LZMA2, 'preset': DEFAULT_LEVELS['lzma'] if level is None else level,
+             'dict_size': LZMA_DICT_SIZE}]
+
+
+def compress(data, method, level):
+    """ Сжатие одного фрагмента независимо от остальных, потеря одного фрагмента не мешает распаковке других.
+
+    data: Данные фрагмента.
+    method: Метод из METHODS.
+    level: Уровень сжатия. """
+
+    if method == 'zlib':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, ZLIB_WBITS)
+        return compressor.compress(data) + compressor.flush()
+    if method == 'lzma':
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=lzma_filters(level))
+    return bz2.compress(data, level)
+
+
+def decompress(data, method, limit):
+    """ Распаковка одного фрагмента. Возвращает данные не длиннее limit, иначе ValueError.
+
+    data: Сжатые данные фрагмента.
+    method: Метод из METHODS.
+    limit: Наибольший размер распакованного фрагмента. """
+
+    if method == 'zlib':
+        decompressor = zlib.decompressobj(ZLIB_WBITS)
+    elif method == 'lzma':
+        decompressor = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=lzma_filters())
+    else:
+        decompressor = bz2.BZ2Decompressor()
+    try:
+        result = decompressor.decompress(data, limit + 1)
+    except (zlib.error, lzma.LZMAError, OSError, EOFError) as error:
+        raise ValueError(f'Поврежденный сжатый фрагмент: {error}') from None
+    if len(result) > limit:
+        raise ValueError('Распакованный фрагмент больше размера фрагмента')
+    return result
+
+
+class Compressor:
+    """ Сжатие фрагментов на стороне отправителя с обходом: фрагмент, который не уменьшился,
+    отправляется как есть без флага protocol.FLAG_COMPRESSED. """
+
+    def __init__(self, method, level=None):
+        """ method: Метод из METHODS.
+        level: Уровень сжатия, по умолчанию DEFAULT_LEVELS. """
+
+        self.method = method
+        self.level = DEFAULT_LEVELS[method] if level is None else level
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+
+    def encode(self, data):
+        """ Возвращает данные для отправки и флаги заголовка. """
+
+        packed = compress(data, self.method, self.level)
+        self.raw_bytes += len(data)
+        if len(packed) >= len(data):                        # несжимаемые данные - без сжатия
+            self.sent_bytes += len(data)
+            return data, 0
+        self.sent_bytes += len(packed)
+        return packed, protocol.FLAG_COMPRESSED
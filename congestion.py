@@ -0,0 +1,113 @@
+import protocol
+import rtt
+
+INITIAL_WINDOW = 10         # начальное окно перегрузки, фрагментов (RFC 6928)
+MIN_WINDOW = 2              # окно после уменьшения не меньше
+SLOW_START_GAIN = 2.0       # темп отправки относительно окна за RTT в медленном старте
+PACING_GAIN = 1.25          # и после него - небольшой запас, чтобы не отставать от подтверждений
+PACING_BURST = 2            # сколько фрагментов можно отправить подряд без пауз
+
+
+class CongestionController:
+    """ Интерфейс алгоритма управления перегрузкой. Окно window - сколько фрагментов может быть в полете,
+    отправитель берет меньшее из него и окна приема сервера. Базовый класс держит постоянное окно,
+    то есть не управляет перегрузкой; другие алгоритмы переопределяют on_ack, on_loss и on_timeout. """
+
+    def __init__(self, window=protocol.WINDOW_MAX):
+        """ window: Начальное окно в фрагментах. """
+        self.window = window
+
+    def in_slow_start(self):
+        """ Растет ли окно экспоненциально. """
+        return False
+
+    def on_ack(self, seq):
+        """ Подтвержден фрагмент seq. """
+
+    def on_loss(self, seq, next_seq):
+        """ Фрагмент seq потерян (истек его таймер), отправлены фрагменты до next_seq. """
+
+    def on_timeout(self, seq, next_seq):
+        """ Потеряна и повторная передача фрагмента seq - сеть, вероятно, перегружена сильно. """
+
+    def pacing_rate(self, srtt):
+        """ Темп отправки в фрагментах в секунду: окно за RTT с запасом. None, пока RTT не измерен.
+
+        srtt: Сглаженный RTT в секундах или None. """
+
+        if srtt is None:
+            return None
+        gain = SLOW_START_GAIN if self.in_slow_start() else PACING_GAIN
+        return gain * self.window / max(srtt, rtt.CLOCK_GRANULARITY)
+
+
+class NewReno(CongestionController):
+    """ AIMD в духе TCP NewReno (RFC 5681, 6582): медленный старт до порога ssthresh, затем рост окна
+    на один фрагмент за RTT; при потере окно уменьшается вдвое один раз на окно данных,
+    при потере повторной передачи - до одного фрагмента. """
+
+    def __init__(self, window=INITIAL_WINDOW):
+        super().__init__(window)
+        self.ssthresh = float('inf')
+        self.recover = -1           # потери фрагментов до этого номера относятся к уже учтенному событию
+
+    def in_slow_start(self):
+        return self.window < self.ssthresh
+
+    def on_ack(self, seq):
+        if seq <= self.recover:                                 # восстановление после потери - без роста
+            return
+        if self.in_slow_start():
+            self.window += 1
+        else:
+            self.window += 1 / self.window
+        self.window = min(self.window, protocol.WINDOW_MAX)
+
+    def on_loss(self, seq, next_seq):
+        if seq <= self.recover:
+            return
+        self.ssthresh = max(self.window / 2, MIN_WINDOW)
+        self.window = self.ssthresh
+        self.recover = next_seq - 1
+
+    def on_timeout(self, seq, next_seq):
+        if seq > self.recover:                                  # порог не уменьшается дважды за одно событие
+            self.ssthresh = max(self.window / 2, MIN_WINDOW)
+        self.window = 1
+        self.recover = next_seq - 1
+
+
+CONTROLLERS = {'fixed': CongestionController, 'newreno': NewReno}
+DEFAULT_CONTROLLER = 'newreno'
+
+
+class Pacer:
+    """ Распределяет отправку фрагментов по RTT, чтобы окно не уходило в сеть одной пачкой
+    и не переполняло очереди на общем узком месте. """
+
+    def __init__(self, controller, estimator, burst=PACING_BURST):
+        """ controller: CongestionController, задающий окно.
+        estimator: rtt.RttEstimator соединения.
+        burst: Сколько фрагментов можно отправить подряд после паузы. """
+
+        self.controller = controller
+        self.estimator = estimator
+        self.burst = burst
+        self.next_time = 0.0
+
+    def rate(self):
+        """ Текущий темп отправки в фрагментах в секунду или None, если темп еще не ограничен. """
+        return self.controller.pacing_rate(self.estimator.srtt)
+
+    def delay(self, now):
+        """ Сколько секунд подождать до отправки следующего фрагмента.
+
+        now: Текущее время по time.monotonic. """
+        return max(self.next_time - now, 0)
+
+    def sent(self, now):
+        """ Учитывает отправку фрагмента в момент now. """
+
+        rate = self.rate()
+        if rate is not None:
+            self.next_time = max(self.next_time, now - self.burst / rate) + 1 / rate
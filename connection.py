@@ -0,0 +1,280 @@
+import client
+import congestion
+import messages
+import metrics
+import protocol
+import rtt
+import json
+import logging
+import random
+import threading
+import time
+
+KEEPALIVE_INTERVAL = 15     # секунды тишины, после которых клиент перед передачей проверяет сессию пробой KAP
+KEEPALIVE_MIN = 1
+KEEPALIVE_MAX = 300
+KEEPALIVE_MISSES = 3        # сервер забывает сессию после стольких интервалов без датаграмм клиента
+OPEN_RETRIES = 3            # повторов открытия и пробы: старый сервер KAP не знает и молчит
+
+SERVER_CONNECTIONS = metrics.CONNECTIONS.labels('server')
+CLIENT_CONNECTIONS = metrics.CONNECTIONS.labels('client')
+
+
+def kap_reply(session, params):
+    return protocol.add_header(protocol.MsgType.KAP, json.dumps(params).encode('utf-8'), 0, session)
+
+
+def kap_params(reply):
+    """ Параметры ответа KAP или пустой словарь, если ответа нет или он поврежден. """
+
+    if reply is None or len(reply) <= protocol.HEADER_SIZE:
+        return {}
+    try:
+        params = protocol.get_params(reply)
+    except ValueError:
+        return {}
+    return params if isinstance(params, dict) else {}
+
+
+class ConnectionTable:
+    """ Постоянные сессии клиентов на сервере, без работы с сокетом (как transfer.Transfer).
+    KAP с параметрами открывает сессию, KAP без данных - проба: ответ {'open': true} или {'open': false},
+    если сессия неизвестна (сервер перезапущен или забыл ее) и клиенту нужно открыть ее заново.
+    FIN с идентификатором сессии закрывает ее. Сессия без датаграмм клиента дольше KEEPALIVE_MISSES
+    интервалов проб забывается (expire). PSH с идентификатором сессии несут кадры сообщений (messages.py),
+    каждое полное сообщение передается обработчику on_message. """
+
+    def __init__(self, on_message=None):
+        """ on_message: Обработчик сообщений (адрес, текст), по умолчанию messages.print_message.
+        Вызывается в потоке приема и не должен его задерживать (messages.to_queue). """
+
+        self.connections = {}           # (адрес, сессия) -> [интервал проб, время последней активности, поток сообщений]
+        self.on_message = on_message
+
+    def owns(self, data, address):
+        """ Относится ли датаграмма к постоянной сессии, а не к передаче. """
+        return protocol.get_msg_type(data) == protocol.MsgType.KAP.value \
+            or (address, protocol.get_session(data)) in self.connections
+
+    def handle(self, data, address):
+        """ Обработка KAP, PSH или FIN постоянной сессии. Возвращает ответ или None, если отвечать не нужно.
+
+        data: Полученная датаграмма с заголовком протокола.
+        address: Адрес клиента. """
+
+        session = protocol.get_session(data)
+        key = (address, session)
+        msg_type = protocol.get_msg_type(data)
+        if protocol.check_crc(data) != protocol.MsgType.ACK:
+            return protocol.add_header(protocol.MsgType.RST, b'', protocol.get_seq(data), session)
+        if msg_type == protocol.MsgType.PSH.value and key in self.connections:
+            return self.receive(data, address, key)
+        if msg_type == protocol.MsgType.FIN.value:
+            if self.connections.pop(key, None) is not None:
+                SERVER_CONNECTIONS.dec()
+                print(f'{address[0]}:{address[1]} постоянная сессия закрыта')
+                logging.info(f"Постоянная сессия {address[0]}:{address[1]} закрыта клиентом")
+            return protocol.add_header(protocol.MsgType.FIN, b'', 0, session)
+        if msg_type != protocol.MsgType.KAP.value:
+            return None
+        if len(data) == protocol.HEADER_SIZE:                       # проба
+            if key not in self.connections:
+                return kap_reply(session, {'open': False})
+            self.connections[key][1] = time.monotonic()
+            return kap_reply(session, {'open': True})
+        params = kap_params(data)
+        try:
+            interval = min(max(int(params.get('keepalive', KEEPALIVE_INTERVAL)), KEEPALIVE_MIN), KEEPALIVE_MAX)
+        except (ValueError, TypeError):
+            return protocol.add_header(protocol.MsgType.RST, b'', 0, session)
+        if key not in self.connections:
+            SERVER_CONNECTIONS.inc()
+            print(f'{address[0]}:{address[1]} постоянная сессия открыта')
+            logging.info(f"Постоянная сессия {address[0]}:{address[1]} открыта, пробы раз в {interval} с")
+        self.connections[key] = [interval, time.monotonic(), messages.MessageStream()]
+        return kap_reply(session, {'open': True, 'keepalive': interval})
+
+    def receive(self, data, address, key):
+        """ Датаграмма потока сообщений: подтверждение и передача ставших полными сообщений обработчику. """
+
+        entry = self.connections[key]
+        seq = protocol.get_seq(data)
+        if not entry[2].accepts(seq):                               # вне окна: клиент повторит позже
+            return None
+        entry[1] = time.monotonic()
+        for message in entry[2].add(seq, protocol.get_data(data)):
+            messages.deliver(self.on_message, address, message.decode('utf-8', errors='replace'))
+        return protocol.add_header(protocol.MsgType.ACK, b'', seq, key[1])
+
+    def touch(self, address, params):
+        """ Передача в постоянной сессии (параметр connection инициализации) продлевает сессию.
+
+        address: Адрес клиента.
+        params: Параметры из сообщения инициализации. """
+
+        entry = self.connections.get((address, params.get('connection')))
+        if entry is not None:
+            entry[1] = time.monotonic()
+
+    def expire(self):
+        """ Забывание сессий, клиенты которых замолчали. """
+
+        now = time.monotonic()
+        for key, (interval, last_activity, _) in list(self.connections.items()):
+            if now - last_activity > interval * KEEPALIVE_MISSES:
+                del self.connections[key]
+                SERVER_CONNECTIONS.dec()
+                print(f'{key[0][0]}:{key[0][1]} постоянная сессия закрыта: клиент не отвечает')
+                logging.info(f"Постоянная сессия {key[0][0]}:{key[0][1]} закрыта по тишине")
+
+
+class Connection:
+    """ Постоянная сессия клиента с сервером. Одно рукопожатие (KAP с параметрами) выбирает размер фрагмента,
+    после чего передачи текста начинаются сразу: инициализация уходит вместе с первыми фрагментами,
+    не дожидаясь ответа (0-RTT). Файл ждет ответа на инициализацию - в нем диапазоны, уже принятые сервером
+    в прерванной передаче. Оценка RTT и окно перегрузки переходят от передачи к передаче.
+    Пока сессия открыта, фоновый поток после каждого интервала проб без передач отправляет пробу KAP,
+    и сервер не забывает сессию, даже если передач долго нет. Пропавший или забывший сессию сервер
+    обнаруживается пробой, и при следующей передаче сессия открывается заново. """
+
+    def __init__(self, client_socket, server_ip, server_port, fragment_size=protocol.FRAGMENT_AUTO,
+                 window_size=protocol.DEFAULT_WINDOW, algorithm=congestion.DEFAULT_CONTROLLER,
+                 keepalive=KEEPALIVE_INTERVAL):
+        """ client_socket: Клиентский сокет.
+        server_ip: Одна часть целевого адреса в сокете
+        server_port: Вторая часть целевого адреса в сокете
+        fragment_size: Размер фрагмента с заголовком протокола или protocol.FRAGMENT_AUTO для выбора по PMTU пути.
+        window_size: Размер окна передач.
+        algorithm: Имя алгоритма управления перегрузкой из congestion.CONTROLLERS.
+        keepalive: Интервал проб, секунды (сервер может его ограничить). """
+
+        self.client_socket = client_socket
+        self.server_ip = server_ip
+        self.server_port = server_port
+        self.fragment_size = fragment_size
+        self.window_size = window_size
+        self.keepalive = keepalive
+        self.estimator = rtt.RttEstimator()
+        self.controller = congestion.CONTROLLERS[algorithm]()
+        self.session = 0                        # 0 - сессия не открыта
+        self.last_activity = 0.0
+        self.stream_seq = 0                     # номер следующей датаграммы потока сообщений (messages.Coalescer)
+        self.lock = threading.RLock()           # передачи, пробы и отправка сообщений из разных потоков делят сокет
+        self.stopped = threading.Event()        # сессия закрыта, поток проб завершается
+
+    def open(self):
+        """ Открытие сессии. Возвращает True, если сервер поддерживает постоянные сессии и ответил. """
+
+        if self.fragment_size == protocol.FRAGMENT_AUTO:
+            self.fragment_size = client.auto_fragment_size(self.server_ip, self.server_port, self.estimator)
+        session = random.randint(1, 0xFFFFFFFF)
+        packet = protocol.add_header(protocol.MsgType.KAP, json.dumps({'keepalive': self.keepalive}).encode('utf-8'),
+                                     0, session)
+        accepted = kap_params(client.request(self.client_socket, (self.server_ip, self.server_port), packet, session,
+                                             protocol.MsgType.KAP, self.estimator, OPEN_RETRIES))
+        if not accepted.get('open'):
+            return False
+        self.session = session
+        self.stream_seq = 0
+        self.keepalive = accepted.get('keepalive', self.keepalive)
+        self.last_activity = time.monotonic()
+        self.stopped = threading.Event()
+        threading.Thread(target=self.keep, args=(self.stopped,), daemon=True).start()
+        CLIENT_CONNECTIONS.inc()
+        print(protocol.MsgReply.KAP.value)
+        client.logger.info(f"Постоянная сессия с {self.server_ip}:{self.server_port} открыта")
+        return True
+
+    def alive(self):
+        """ Проба KAP. Возвращает True, если сервер отвечает и помнит сессию, иначе сессия считается закрытой. """
+
+        packet = protocol.add_header(protocol.MsgType.KAP, b'', 0, self.session)
+        reply = client.request(self.client_socket, (self.server_ip, self.server_port), packet, self.session,
+                               protocol.MsgType.KAP, self.estimator, OPEN_RETRIES)
+        if not kap_params(reply).get('open'):
+            client.logger.info(f"Постоянная сессия с {self.server_ip}:{self.server_port} потеряна")
+            self.drop()
+            return False
+        self.last_activity = time.monotonic()
+        return True
+
+    def keep(self, stopped):
+        """ Поток проб: проба KAP после каждого интервала проб без передач, пока сессия не закрыта.
+
+        stopped: threading.Event этой сессии. """
+
+        while not stopped.wait(max(self.last_activity + self.keepalive - time.monotonic(), 0)):
+            with self.lock:                     # проба не вклинивается в передачу
+                if stopped.is_set():
+                    return
+                if time.monotonic() - self.last_activity >= self.keepalive:
+                    self.alive()                # неудача закрывает сессию и останавливает поток
+
+    def ensure(self):
+        """ Готовность к передаче: сессия открывается или, после тишины дольше интервала проб, проверяется.
+        Возвращает True, если сессия открыта. """
+
+        if self.session and time.monotonic() - self.last_activity > self.keepalive:
+            self.alive()
+        return bool(self.session) or self.open()
+
+    def setup(self, msg_type, params):
+        """ Инициализация передачи в сессии без ожидания ответа. Возвращает идентификатор сессии передачи
+        и сообщение инициализации для client.send_fragments(setup=...).
+
+        msg_type: MsgType.SET_MSG (ответ на инициализацию файла нужен для продолжения передачи).
+        params: Параметры передачи (с параметром connection). """
+
+        session = random.randint(1, 0xFFFFFFFF)
+        return session, protocol.msg_initialization(msg_type, params, session)
+
+    def done(self, result):
+        """ Учет результата передачи: успешная продлевает сессию, неудачная закрывает ее (сервер мог пропасть). """
+
+        if result:
+            self.last_activity = time.monotonic()
+        else:
+            self.drop()
+        return result
+
+    def send_message(self, message):
+        """ Передача текста в сессии. Возвращает True, если текст передан.
+
+        message: Текст (bytes). """
+
+        with self.lock:
+            if not self.ensure():
+                print('Соединение не установлено')
+                return False
+            return self.done(client.send_message(self.server_ip, self.client_socket, self.server_port,
+                                                 self.fragment_size - protocol.HEADER_SIZE, message, self.window_size,
+                                                 connection=self))
+
+    def send_file(self, file_path, **options):
+        """ Передача файла в сессии. Возвращает True, если файл передан.
+
+        file_path: Путь к файлу (bytes).
+        options: Остальные параметры client.send_file (compress, redundancy, incremental, dedup, ...). """
+
+        with self.lock:
+            if not self.ensure():
+                print('Соединение не установлено')
+                return False
+            return self.done(client.send_file(self.server_ip, self.client_socket, self.server_port, self.fragment_size,
+                                              file_path, self.window_size, connection=self, **options))
+
+    def drop(self):
+        if self.session:
+            CLIENT_CONNECTIONS.dec()
+        self.session = 0
+        self.stopped.set()
+
+    def close(self):
+        """ Закрытие сессии: FIN с ее идентификатором, сервер забывает ее сразу, а не по тишине. """
+
+        with self.lock:
+            if self.session:
+                client.request(self.client_socket, (self.server_ip, self.server_port),
+                               protocol.add_header(protocol.MsgType.FIN, b'', 0, self.session), self.session,
+                               protocol.MsgType.FIN, self.estimator, OPEN_RETRIES)
+                self.drop()
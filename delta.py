@@ -0,0 +1,208 @@
+import protocol
+import hashlib
+import math
+import os
+import struct
+import threading
+import zlib
+
+BLOCK_MIN = 512             # размер блока сигнатур - корень из размера файла в этих пределах (как у rsync)
+BLOCK_MAX = 1 << 16
+ADLER_MOD = 65521           # модуль Adler-32: слабая сумма блока - zlib.adler32, в diff она сдвигается на байт
+SIGNATURE = struct.Struct('!I8s')       # слабая (Adler-32) и сильная (BLAKE2b, 8 байт) сумма блока прежней версии
+SIG_HEADER = struct.Struct('!IQQI')     # размер блока, размер и время изменения прежней версии, количество блоков
+CHUNK_BLOCKS = (protocol.DEFAULT_BUFF - protocol.HEADER_SIZE - SIG_HEADER.size) // SIGNATURE.size   # в одном ответе
+COPY = struct.Struct('!II')             # b'C' + номер первого блока прежней версии и количество блоков подряд
+LITERAL = struct.Struct('!I')           # b'L' + длина новых данных, затем сами данные
+LITERAL_MAX = 1 << 20       # длинные новые данные делятся на записи не больше этой длины
+SIG_RETRIES = 3             # повторов первого запроса сигнатур: старый сервер их не знает и молчит
+CACHE_SIZE = 4              # сигнатур скольких файлов сервер держит в памяти
+_cache = {}                 # путь -> (размер, время изменения, размер блока, сигнатуры)
+_lock = threading.Lock()    # повторные запросы ждут уже начатого подсчета сигнатур
+
+
+def block_size(size):
+    """ Размер блока сигнатур для файла размера size. """
+    return max(BLOCK_MIN, min(BLOCK_MAX, math.ceil(math.isqrt(size) / 8) * 8))
+
+
+def strong(data):
+    """ Сильная сумма блока: проверяет совпадение, найденное по слабой. """
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def signatures(path):
+    """ Сигнатуры блоков файла на сервере. Возвращает (размер, время изменения, размер блока, сигнатуры подряд)
+    или None, если файла нет. Сигнатуры считаются один раз на версию файла и запоминаются.
+
+    path: Путь к прежней версии файла. """
+
+    with _lock:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = _cache.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached
+        block = block_size(stat.st_size)
+        parts = []
+        try:
+            with open(path, 'rb') as file:
+                for data in iter(lambda: file.read(block), b''):
+                    parts.append(SIGNATURE.pack(zlib.adler32(data), strong(data)))
+        except OSError:
+            return None
+        _cache.pop(path, None)
+        if len(_cache) >= CACHE_SIZE:
+            _cache.pop(next(iter(_cache)))
+        _cache[path] = stat.st_size, stat.st_mtime_ns, block, b''.join(parts)
+        return _cache[path]
+
+
+def signature_reply(data, dir_path):
+    """ Ответ на запрос сигнатур MsgType.SIG: часть сигнатур с номером из заголовка запроса.
+    Если прежней версии файла нет, размер блока в ответе 0. Возвращает None для поврежденного запроса.
+
+    data: Запрос с заголовком протокола, в данных - JSON с именем файла.
+    dir_path: Директория сохранения файлов сервера. """
+
+    if protocol.check_crc(data) != protocol.MsgType.ACK:
+        return None
+    try:
+        name = os.path.basename(protocol.get_params(data)['name'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    chunk = protocol.get_seq(data)
+    basis = signatures(dir_path + name) if name else None
+    if basis is None:
+        payload = SIG_HEADER.pack(0, 0, 0, 0)
+    else:
+        size, mtime, block, blob = basis
+        start = chunk * CHUNK_BLOCKS * SIGNATURE.size
+        payload = SIG_HEADER.pack(block, size, mtime, len(blob) // SIGNATURE.size) \
+            + blob[start:start + CHUNK_BLOCKS * SIGNATURE.size]
+    return protocol.add_header(protocol.MsgType.SIG, payload, chunk, protocol.get_session(data))
+
+
+def index(blob, block, size):
+    """ Таблица поиска блоков прежней версии. Возвращает словарь слабая сумма -> {сильная сумма: номер блока}
+    для полных блоков и (слабая, сильная, номер) короткого последнего блока или None. """
+
+    table = {}
+    count = len(blob) // SIGNATURE.size
+    tail = None
+    for number in range(count):
+        weak, digest = SIGNATURE.unpack_from(blob, number * SIGNATURE.size)
+        if number == count - 1 and size % block:
+            tail = weak, digest, number
+            break
+        table.setdefault(weak, {}).setdefault(digest, number)
+    return table, tail
+
+
+def diff(view, blob, block, size, out):
+    """ Дельта новой версии файла относительно прежней на сервере: ссылки на совпавшие блоки прежней версии
+    и новые данные между ними. Совпадение ищется в любом смещении скользящей слабой суммой. Записи пишутся в out.
+    Возвращает количество байт новых данных.
+
+    view: Новая версия файла (memoryview).
+    blob: Сигнатуры прежней версии (signatures).
+    block: Размер блока сигнатур.
+    size: Размер прежней версии.
+    out: Файл для записей дельты. """
+
+    table, tail = index(blob, block, size)
+    length = len(view)
+    literal_bytes = 0
+    copy = None                                             # [первый блок, количество] еще не записанной ссылки
+    literal = pos = 0                                       # новые данные - от literal до pos
+
+    def flush(end):
+        nonlocal copy, literal_bytes
+        if copy is not None and literal < end:
+            out.write(b'C' + COPY.pack(*copy))
+            copy = None
+        for start in range(literal, end, LITERAL_MAX):
+            chunk = view[start:min(start + LITERAL_MAX, end)]
+            out.write(b'L' + LITERAL.pack(len(chunk)))
+            out.write(chunk)
+        literal_bytes += end - literal
+
+    def matched(number, end):
+        nonlocal copy, literal
+        flush(pos)
+        if copy is not None and copy[0] + copy[1] == number:
+            copy[1] += 1
+        else:
+            if copy is not None:
+                out.write(b'C' + COPY.pack(*copy))
+            copy = [number, 1]
+        literal = end
+
+    while table and pos + block <= length:
+        weak = zlib.adler32(view[pos:pos + block])
+        while True:
+            candidates = table.get(weak)
+            if candidates is not None:
+                number = candidates.get(strong(view[pos:pos + block]))
+                if number is not None:
+                    break
+            if pos + block >= length:
+                number = None
+                break
+            out_byte = view[pos]                            # сдвиг окна на байт: A' = A - out + in,
+            a = ((weak & 0xFFFF) - out_byte + view[pos + block]) % ADLER_MOD   # B' = B - block * out + A' - 1
+            weak = ((weak >> 16) - block * out_byte + a - 1) % ADLER_MOD << 16 | a
+            pos += 1
+        if number is None:
+            pos += 1
+            break
+        matched(number, pos + block)
+        pos += block
+    if tail is not None and length - literal >= size % block:  # короткий последний блок - только в конце файла
+        start = length - size % block
+        data = view[start:]
+        if zlib.adler32(data) == tail[0] and strong(data) == tail[1]:
+            pos = start
+            matched(tail[2], length)
+    flush(length)
+    if copy is not None:
+        out.write(b'C' + COPY.pack(*copy))
+    return literal_bytes
+
+
+def patch(basis_path, delta_path, out_path, block, size):
+    """ Сборка новой версии файла из прежней и дельты. Поврежденная дельта или неверный итоговый размер - ValueError.
+
+    basis_path: Прежняя версия файла.
+    delta_path: Принятая дельта.
+    out_path: Путь для новой версии.
+    block: Размер блока сигнатур, по которым строилась дельта.
+    size: Размер новой версии. """
+
+    with open(basis_path, 'rb') as basis, open(delta_path, 'rb') as delta, open(out_path, 'wb') as out:
+        basis_size = os.fstat(basis.fileno()).st_size
+        while kind := delta.read(1):
+            if kind == b'C':
+                first, count = COPY.unpack(delta.read(COPY.size).ljust(COPY.size, b'\0'))
+                start, end = first * block, min((first + count) * block, basis_size)
+                if count == 0 or start >= end:
+                    raise ValueError('Ссылка на блок за концом прежней версии')
+                basis.seek(start)
+                while start < end:
+                    data = basis.read(min(LITERAL_MAX, end - start))
+                    out.write(data)
+                    start += len(data)
+            elif kind == b'L':
+                (length,) = LITERAL.unpack(delta.read(LITERAL.size).ljust(LITERAL.size, b'\0'))
+                data = delta.read(length)
+                if len(data) != length:
+                    raise ValueError('Дельта обрезана')
+                out.write(data)
+            else:
+                raise ValueError('Неизвестная запись дельты')
+            if out.tell() > size:
+                raise ValueError('Новая версия больше заявленного размера')
+        if out.tell() != size:
+            raise ValueError('Размер новой версии не совпадает')
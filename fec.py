@@ -0,0 +1,159 @@
+DEFAULT_BLOCK = 16          # фрагментов данных в блоке
+DEFAULT_PARITY = 1          # фрагментов четности на блок
+BLOCK_MAX = 256
+# Четность j блока - XOR фрагментов блока с номерами j, j + parity, j + 2 * parity, ... (чередование):
+# в каждой группе восстанавливается один потерянный фрагмент, в блоке - до parity потерь, в том числе подряд.
+
+
+def parse(spec):
+    """ Разбор настройки FEC вида '16' или '16:2' (фрагментов данных в блоке и четности на блок).
+    Возвращает (block, parity) или None без FEC.
+
+    spec: Строка настройки, пустая строка или None - без FEC. """
+
+    if not spec:
+        return None
+    block, _, parity = str(spec).partition(':')
+    block, parity = int(block), int(parity) if parity else DEFAULT_PARITY
+    if not 1 <= parity <= block <= BLOCK_MAX:
+        raise ValueError(f'Неверные параметры FEC: {spec}')
+    return block, parity
+
+
+def group_of(seq, block, parity):
+    """ Номер группы четности фрагмента seq. """
+    return seq // block * parity + seq % block % parity
+
+
+def members(group, block, parity, count):
+    """ Номера фрагментов группы четности group среди count фрагментов. """
+
+    start = group // parity * block
+    return range(start + group % parity, min(start + block, count), parity)
+
+
+def block_end(seq, block, count):
+    """ Номер после последнего фрагмента блока, в который входит seq. """
+    return min((seq // block + 1) * block, count)
+
+
+class Encoder:
+    """ Вычисление фрагментов четности на стороне отправителя по мере отправки фрагментов данных. """
+
+    def __init__(self, block, parity, count):
+        """ block: Фрагментов данных в блоке.
+        parity: Фрагментов четности на блок.
+        count: Общее количество фрагментов. """
+
+        self.block = block
+        self.parity = parity
+        self.count = count
+        self.groups = {}                # номер группы -> XOR данных в виде int
+        self.disabled = set()           # блоки с пропущенными фрагментами (продолжение передачи) - без четности
+        self.parity_sent = 0
+        self.recovered = 0
+
+    def skip(self, seq):
+        """ Фрагмент seq не отправляется (уже принят сервером), четность для его блока не считается. """
+
+        block_index = seq // self.block
+        self.disabled.add(block_index)
+        for group in range(block_index * self.parity, (block_index + 1) * self.parity):
+            self.groups.pop(group, None)
+
+    def add(self, seq, data):
+        """ Учитывает отправляемый фрагмент. Возвращает список (номер группы, данные четности),
+        готовых к отправке: после последнего фрагмента блока.
+
+        seq: Номер фрагмента.
+        data: Данные фрагмента до сжатия. """
+
+        block_index = seq // self.block
+        if block_index in self.disabled:
+            if seq == block_end(seq, self.block, self.count) - 1:
+                self.disabled.discard(block_index)
+            return []
+        group = group_of(seq, self.block, self.parity)
+        self.groups[group] = self.groups.get(group, 0) ^ int.from_bytes(data, 'little')
+        if seq != block_end(seq, self.block, self.count) - 1:
+            return []
+        ready = []
+        for group in range(block_index * self.parity, (block_index + 1) * self.parity):
+            if group in self.groups:                # старшие нулевые байты не передаются
+                value = self.groups.pop(group)
+                ready.append((group, value.to_bytes((value.bit_length() + 7) // 8, 'little')))
+        self.parity_sent += len(ready)
+        return ready
+
+
+class Decoder:
+    """ Восстановление потерянных фрагментов на стороне получателя. Для каждой незавершенной группы
+    хранится только XOR уже принятых фрагментов (и четности): когда в группе с четностью не хватает
+    ровно одного фрагмента, этот XOR и есть недостающий фрагмент. """
+
+    def __init__(self, block, parity, bitmap, payload_size, size, initial=None):
+        """ block: Фрагментов данных в блоке.
+        parity: Фрагментов четности на блок.
+        bitmap: reassembly.FragmentBitmap принятых фрагментов передачи.
+        payload_size: Размер данных фрагмента.
+        size: Размер файла, по нему определяется длина последнего фрагмента.
+        initial: Фрагменты, принятые до начала этой передачи; их блоки не восстанавливаются. """
+
+        self.block = block
+        self.parity = parity
+        self.bitmap = bitmap
+        self.payload_size = payload_size
+        self.size = size
+        self.initial = initial
+        self.groups = {}                # номер группы -> [XOR в виде int, есть ли четность]
+
+    def group(self, group):
+        """ Состояние группы или None, если группа завершена или не восстанавливается. """
+
+        if group in self.groups:
+            return self.groups[group]
+        if all(seq in self.bitmap for seq in members(group, self.block, self.parity, self.bitmap.count)):
+            return None
+        start = group // self.parity * self.block
+        if self.initial is not None and any(seq in self.initial for seq in
+                                            range(start, min(start + self.block, self.bitmap.count))):
+            return None
+        self.groups[group] = [0, False]
+        return self.groups[group]
+
+    def add(self, seq, data):
+        """ Учитывает новый фрагмент данных (уже отмеченный в bitmap). Возвращает (номер, данные)
+        восстановленного фрагмента или None. """
+
+        group = group_of(seq, self.block, self.parity)
+        state = self.group(group)
+        if state is None:
+            return None
+        state[0] ^= int.from_bytes(data, 'little')
+        return self.rebuild(group, state)
+
+    def add_parity(self, group, data):
+        """ Учитывает фрагмент четности группы group. Возвращает (номер, данные) восстановленного фрагмента или None. """
+
+        state = self.group(group)
+        if state is None or state[1]:
+            return None
+        state[0] ^= int.from_bytes(data, 'little')
+        state[1] = True
+        return self.rebuild(group, state)
+
+    def rebuild(self, group, state):
+        """ Восстановление, если в группе с четностью не хватает ровно одного фрагмента. """
+
+        missing = [seq for seq in members(group, self.block, self.parity, self.bitmap.count) if seq not in self.bitmap]
+        if not missing:
+            del self.groups[group]
+            return None
+        if len(missing) > 1 or not state[1]:
+            return None
+        del self.groups[group]
+        seq = missing[0]
+        length = min(self.payload_size, self.size - seq * self.payload_size)
+        if state[0].bit_length() > length * 8:                  # четность не сходится с размером - не восстанавливаем
+            return None
+        return seq, state[0].to_bytes(length, 'little')
@@ -4,16 +4,18 @@ import threading
 import socket
 import protocol
 import client
+import parallel
+import impairment
+import logs
 import server
 import os
-import matplotlib.pyplot as plt
 
 
 class UDPCommunicatorApp:
     def __init__(self, root):
         self.root = root
         self.root.title("UDP Communicator")
-        self.root.geometry("500x400")
+        self.root.geometry("500x620")
 
         # Переменные для полей ввода
         self.mode_var = tk.StringVar(value="client")  # "клиент" или "сервер"
@@ -21,10 +23,17 @@ class UDPCommunicatorApp:
         self.port_var = tk.IntVar(value=5000)
         self.client_port_var = tk.IntVar(value=5001)
         self.fragment_size_var = tk.IntVar(value=1024)
+        self.window_size_var = tk.IntVar(value=protocol.DEFAULT_WINDOW)
         self.file_path_var = tk.StringVar()
         self.message_var = tk.StringVar()
         self.dir_path_var = tk.StringVar(value=os.getcwd() + "/")  # По умолчанию текущий каталог
         self.simulate_error_var = tk.BooleanVar(value=False)
+        self.auto_fragment_var = tk.BooleanVar(value=False)
+        self.streams_var = tk.IntVar(value=1)
+        self.compression_var = tk.StringVar(value="")
+        self.fec_var = tk.StringVar(value="")
+        self.incremental_var = tk.BooleanVar(value=False)
+        self.impairment_var = tk.StringVar(value="")
 
         
         self._build_ui()
@@ -54,6 +63,34 @@ class UDPCommunicatorApp:
         self.fragment_size_entry = tk.Entry(self.root, textvariable=self.fragment_size_var)
         self.simulate_error_check = tk.Checkbutton(self.root, text="Симуляция ошибки", variable=self.simulate_error_var)
 
+        self.auto_fragment_check = tk.Checkbutton(self.root, text="Размер фрагмента по PMTU",
+                                                  variable=self.auto_fragment_var)
+
+        # Размер окна Selective Repeat (для клиента)
+        self.window_size_label = tk.Label(self.root, text="Размер окна:")
+        self.window_size_entry = tk.Entry(self.root, textvariable=self.window_size_var)
+
+        # Количество параллельных потоков передачи файла (для клиента)
+        self.streams_label = tk.Label(self.root, text="Потоков:")
+        self.streams_entry = tk.Entry(self.root, textvariable=self.streams_var)
+
+        # Сжатие фрагментов файла (для клиента)
+        self.compression_label = tk.Label(self.root, text="Сжатие:")
+        self.compression_combo = ttk.Combobox(self.root, textvariable=self.compression_var,
+                                              values=["", "zlib", "zlib:9", "lzma", "bz2"])
+
+        # FEC: фрагментов в блоке и четности на блок (для клиента)
+        self.fec_label = tk.Label(self.root, text="FEC (блок:четность):")
+        self.fec_combo = ttk.Combobox(self.root, textvariable=self.fec_var, values=["", "16", "16:2", "32:4", "8:2"])
+
+        # Передача только изменений файла, который уже есть на сервере (для клиента)
+        self.incremental_check = tk.Checkbutton(self.root, text="Только изменения (дельта)",
+                                                variable=self.incremental_var)
+
+        # Помехи сети через ретранслятор на loopback (для клиента), например loss=0.05,delay=20ms
+        self.impairment_label = tk.Label(self.root, text="Помехи (loopback):")
+        self.impairment_entry = tk.Entry(self.root, textvariable=self.impairment_var)
+
         # Путь к файлу (для клиента)
         self.file_path_label = tk.Label(self.root, text="Путь к файлу:")
         self.file_path_entry = tk.Entry(self.root, textvariable=self.file_path_var, state="readonly")
@@ -86,6 +123,18 @@ class UDPCommunicatorApp:
         self.fragment_size_label.grid_forget()
         self.fragment_size_entry.grid_forget()
         self.simulate_error_check.grid_forget()
+        self.auto_fragment_check.grid_forget()
+        self.window_size_label.grid_forget()
+        self.window_size_entry.grid_forget()
+        self.streams_label.grid_forget()
+        self.streams_entry.grid_forget()
+        self.compression_label.grid_forget()
+        self.compression_combo.grid_forget()
+        self.fec_label.grid_forget()
+        self.fec_combo.grid_forget()
+        self.incremental_check.grid_forget()
+        self.impairment_label.grid_forget()
+        self.impairment_entry.grid_forget()
         self.file_path_label.grid_forget()
         self.file_path_entry.grid_forget()
         self.file_browse_button.grid_forget()
@@ -111,6 +160,18 @@ class UDPCommunicatorApp:
             self.file_browse_button.grid(row=6, column=2, padx=10, pady=5)
             self.message_label.grid(row=7, column=0, padx=10, pady=5)
             self.message_entry.grid(row=7, column=1, columnspan=2, padx=10, pady=5)
+            self.window_size_label.grid(row=8, column=0, padx=10, pady=5)
+            self.window_size_entry.grid(row=8, column=1, columnspan=2, padx=10, pady=5)
+            self.auto_fragment_check.grid(row=9, column=0, columnspan=3, padx=10, pady=5)
+            self.streams_label.grid(row=10, column=0, padx=10, pady=5)
+            self.streams_entry.grid(row=10, column=1, columnspan=2, padx=10, pady=5)
+            self.compression_label.grid(row=11, column=0, padx=10, pady=5)
+            self.compression_combo.grid(row=11, column=1, columnspan=2, padx=10, pady=5)
+            self.fec_label.grid(row=12, column=0, padx=10, pady=5)
+            self.fec_combo.grid(row=12, column=1, columnspan=2, padx=10, pady=5)
+            self.incremental_check.grid(row=13, column=0, columnspan=3, padx=10, pady=5)
+            self.impairment_label.grid(row=14, column=0, padx=10, pady=5)
+            self.impairment_entry.grid(row=14, column=1, columnspan=2, padx=10, pady=5)
         else:  # для сервера
             self.port_label.grid(row=1, column=0, padx=10, pady=5)
             self.port_entry.grid(row=1, column=1, columnspan=2, padx=10, pady=5)
@@ -118,7 +179,7 @@ class UDPCommunicatorApp:
             self.dir_path_entry.grid(row=2, column=1, padx=10, pady=5)
             self.dir_browse_button.grid(row=2, column=2, padx=10, pady=5)
 
-        self.start_button.grid(row=10, column=0, columnspan=3, pady=10)
+        self.start_button.grid(row=15, column=0, columnspan=3, pady=10)
 
     def choose_file(self):
         """ Диалоговое окно для выбора файла """
@@ -156,32 +217,61 @@ class UDPCommunicatorApp:
         thread.start()
 
     def run_client(self, file_path, message):
+        relay = None
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             sock.bind(("", self.client_port_var.get()))
-
-            if file_path:
+            server_ip, server_port = self.ip_var.get(), self.port_var.get()
+            impairment_settings = impairment.Impairment.parse(self.impairment_var.get())
+            if impairment_settings is not None:     # передача идет через ретранслятор с помехами
+                relay = impairment.Relay((server_ip, server_port), impairment_settings, impairment_settings).start()
+                server_ip, server_port = relay.address
+
+            auto_fragment = self.auto_fragment_var.get()
+            if file_path and self.streams_var.get() > 1:
+                parallel.send_file(
+                    server_ip=server_ip,
+                    client_socket=sock,
+                    server_port=server_port,
+                    fragment_size=protocol.FRAGMENT_AUTO if auto_fragment
+                    else self.fragment_size_var.get() + protocol.HEADER_SIZE,
+                    file_path=file_path.encode('utf-8'),
+                    streams=self.streams_var.get(),
+                    window_size=self.window_size_var.get(),
+                    compress=self.compression_var.get(),
+                    redundancy=self.fec_var.get()
+                )
+            elif file_path:
                 client.send_file(
-                    server_ip=self.ip_var.get(),
+                    server_ip=server_ip,
                     client_socket=sock,
-                    server_port=self.port_var.get(),
-                    fragment_size=self.fragment_size_var.get() + protocol.HEADER_SIZE,
-                    file_path=file_path.encode('utf-8')
+                    server_port=server_port,
+                    fragment_size=protocol.FRAGMENT_AUTO if auto_fragment
+                    else self.fragment_size_var.get() + protocol.HEADER_SIZE,
+                    file_path=file_path.encode('utf-8'),
+                    window_size=self.window_size_var.get(),
+                    compress=self.compression_var.get(),
+                    redundancy=self.fec_var.get(),
+                    incremental=self.incremental_var.get()
                 )
             elif message:
                 client.send_message(
-                    server_ip=self.ip_var.get(),
+                    server_ip=server_ip,
                     client_socket=sock,
-                    server_port=self.port_var.get(),
-                    fragment_size=self.fragment_size_var.get(),
-                    message=message.encode('utf-8')
+                    server_port=server_port,
+                    fragment_size=protocol.FRAGMENT_AUTO if auto_fragment else self.fragment_size_var.get(),
+                    message=message.encode('utf-8'),
+                    window_size=self.window_size_var.get()
                 )
 
         except Exception as e:
             messagebox.showerror("Ошибка", str(e))
         finally:
             sock.close()
+            if relay is not None:
+                relay.stop()
+                print('Помехи:', impairment_settings.stats)
 
     def start_server(self):
         """ Запуск процесса сервера. """
@@ -202,6 +292,7 @@ class UDPCommunicatorApp:
 
 
 if __name__ == "__main__":
+    logs.configure()
     root = tk.Tk()
     app = UDPCommunicatorApp(root)
     root.mainloop()
@@ -0,0 +1,196 @@
+import argparse
+import heapq
+import ipaddress
+import itertools
+import random
+import select
+import socket
+import threading
+import time
+
+MAX_DATAGRAM = 65535
+POLL = 0.05                 # как часто поток ретранслятора проверяет остановку, секунды
+REORDER_DELAY = 0.005       # на сколько задерживается переставляемая датаграмма сверх обычной задержки
+DUPLICATE_GAP = 0.0005      # через сколько после оригинала отправляется дубликат
+FIELDS = ('loss', 'corrupt', 'delay', 'jitter', 'reorder', 'duplicate', 'seed')
+
+
+def parse_duration(value):
+    """ Длительность в секундах из строки '0.02' или '20ms'. """
+
+    value = value.strip().lower()
+    return float(value[:-2]) / 1000 if value.endswith('ms') else float(value)
+
+
+class Impairment:
+    """ Помехи сети с воспроизводимым генератором случайных чисел: потеря, повреждение бита,
+    задержка с разбросом, перестановка и дублирование датаграмм с заданными вероятностями. """
+
+    def __init__(self, loss=0.0, corrupt=0.0, delay=0.0, jitter=0.0, reorder=0.0, duplicate=0.0, seed=0):
+        """ loss: Вероятность потери датаграммы.
+        corrupt: Вероятность инвертировать один случайный бит.
+        delay: Задержка каждой датаграммы, секунды.
+        jitter: Наибольшее случайное отклонение задержки, секунды.
+        reorder: Вероятность задержать датаграмму на REORDER_DELAY, чтобы ее обогнали следующие.
+        duplicate: Вероятность отправить датаграмму дважды.
+        seed: Начальное значение генератора, одинаковые помехи при одинаковом трафике. """
+
+        for name, rate in (('loss', loss), ('corrupt', corrupt), ('reorder', reorder), ('duplicate', duplicate)):
+            if not 0 <= rate <= 1:
+                raise ValueError(f'Вероятность {name} должна быть от 0 до 1: {rate}')
+        if delay < 0 or jitter < 0:
+            raise ValueError('Задержка не может быть отрицательной')
+        self.loss, self.corrupt, self.reorder, self.duplicate = loss, corrupt, reorder, duplicate
+        self.delay, self.jitter = delay, jitter
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.stats = dict.fromkeys(('packets', 'lost', 'corrupted', 'reordered', 'duplicated'), 0)
+
+    @classmethod
+    def parse(cls, spec):
+        """ Помехи из строки вида 'loss=0.05,delay=20ms,jitter=5ms,reorder=0.1,seed=1'.
+        Пустая строка или None - None (без помех). """
+
+        if not spec or not spec.strip():
+            return None
+        params = {}
+        for item in spec.split(','):
+            name, _, value = item.partition('=')
+            name = name.strip().lower()
+            if name not in FIELDS or not value:
+                raise ValueError(f'Неизвестный параметр помех: {item.strip()}')
+            if name == 'seed':
+                params[name] = int(value)
+            elif name in ('delay', 'jitter'):
+                params[name] = parse_duration(value)
+            else:
+                params[name] = float(value)
+        return cls(**params)
+
+    def apply(self, data):
+        """ Помехи для одной датаграммы. Возвращает список (задержка, данные): пустой для потерянной,
+        две пары для продублированной. """
+
+        self.stats['packets'] += 1
+        if self.random.random() < self.loss:
+            self.stats['lost'] += 1
+            return []
+        if data and self.random.random() < self.corrupt:
+            data = bytearray(data)
+            data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+            data = bytes(data)
+            self.stats['corrupted'] += 1
+        delay = max(0.0, self.delay + self.random.uniform(-self.jitter, self.jitter))
+        if self.random.random() < self.reorder:
+            delay += REORDER_DELAY
+            self.stats['reordered'] += 1
+        copies = [(delay, data)]
+        if self.random.random() < self.duplicate:
+            copies.append((delay + DUPLICATE_GAP, data))
+            self.stats['duplicated'] += 1
+        return copies
+
+
+class Relay:
+    """ Ретранслятор UDP на loopback с помехами: клиент отправляет на address ретранслятора, тот пересылает
+    серверу от отдельного сокета на каждый адрес клиента (потоки parallel.py различимы), ответы идут обратно.
+    Работает в фоновом потоке, клиент и сервер не меняются. """
+
+    def __init__(self, target, forward, backward=None, port=0):
+        """ target: Адрес сервера (ip, порт), только loopback.
+        forward: Impairment для датаграмм клиент -> сервер или None.
+        backward: Impairment для датаграмм сервер -> клиент или None, может быть тем же объектом, что и forward.
+        port: Порт ретранслятора на 127.0.0.1, по умолчанию свободный. """
+
+        if not ipaddress.ip_address(socket.gethostbyname(target[0])).is_loopback:
+            raise ValueError(f'Помехи только на loopback, адрес сервера {target[0]}')
+        self.target = (socket.gethostbyname(target[0]), target[1])
+        self.forward = forward
+        self.backward = backward
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', port))
+        self.address = self.sock.getsockname()
+        self.upstream = {}          # адрес клиента -> сокет к серверу
+        self.clients = {}           # сокет к серверу -> адрес клиента
+        self.queue = []             # куча (время отправки, номер, сокет, данные, адрес)
+        self.counter = itertools.count()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """ Остановка потока и закрытие сокетов, задержанные датаграммы отбрасываются. """
+
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        for sock in (self.sock, *self.clients):
+            sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def schedule(self, impairment, data, sock, address):
+        """ Постановка датаграммы в очередь отправки с помехами impairment (None - без помех). """
+
+        now = time.monotonic()
+        for delay, copy in impairment.apply(data) if impairment is not None else [(0.0, data)]:
+            heapq.heappush(self.queue, (now + delay, next(self.counter), sock, copy, address))
+
+    def run(self):
+        while not self.stopped.is_set():
+            timeout = POLL if not self.queue else min(POLL, max(self.queue[0][0] - time.monotonic(), 0))
+            ready = select.select([self.sock, *self.clients], [], [], timeout)[0]
+            for sock in ready:
+                try:
+                    data, address = sock.recvfrom(MAX_DATAGRAM)
+                except OSError:                     # ICMP о недоступности прошлой датаграммы
+                    continue
+                if sock is self.sock:
+                    upstream = self.upstream.get(address)
+                    if upstream is None:
+                        upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                        upstream.bind(('127.0.0.1', 0))
+                        self.upstream[address] = upstream
+                        self.clients[upstream] = address
+                    self.schedule(self.forward, data, upstream, self.target)
+                else:
+                    self.schedule(self.backward, data, self.sock, self.clients[sock])
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, sock, data, address = heapq.heappop(self.queue)
+                try:
+                    sock.sendto(data, address)
+                except OSError:
+                    pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ретранслятор UDP с помехами на loopback')
+    parser.add_argument('target_port', type=int, help='порт сервера на 127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='порт ретранслятора, клиент отправляет на него')
+    parser.add_argument('--impair', default='', help="помехи, например 'loss=0.05,delay=20ms,jitter=5ms'")
+    parser.add_argument('--forward-only', action='store_true', help='помехи только в направлении к серверу')
+    args = parser.parse_args(argv)
+
+    impairment = Impairment.parse(args.impair)
+    with Relay(('127.0.0.1', args.target_port), impairment, None if args.forward_only else impairment,
+               args.port) as relay:
+        print(f'Ретранслятор {relay.address[0]}:{relay.address[1]} -> 127.0.0.1:{args.target_port}, Ctrl+C - остановка')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+    if impairment is not None:
+        print('Помехи:', impairment.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import protocol
+import hashlib
+import struct
+import threading
+
+RANGE_BYTES = 1 << 20       # данных в диапазоне с отдельным хешем, при несовпадении повторяется только он
+DIGEST_SIZE = 16            # BLAKE2b-128 на диапазон
+FILE_DIGEST_SIZE = 32       # хеш файла - BLAKE2b-256 от хешей диапазонов по порядку
+CHUNK_RANGES = (protocol.DEFAULT_BUFF - protocol.HEADER_SIZE) // DIGEST_SIZE     # хешей в одном сообщении DIG
+BAD = struct.Struct('!I')   # номер несовпавшего диапазона в ответе на DIG
+ROUNDS = 3                  # сколько раз повторяются несовпавшие диапазоны, прежде чем передача считается неудачной
+
+
+def range_fragments(payload_size):
+    """ Фрагментов в одном диапазоне при размере данных фрагмента payload_size. """
+    return max(1, RANGE_BYTES // payload_size)
+
+
+def range_digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE)
+
+
+def file_digest(digests):
+    """ Хеш файла из хешей диапазонов (hex). Не требует повторного чтения файла. """
+    return hashlib.blake2b(b''.join(digests), digest_size=FILE_DIGEST_SIZE).hexdigest()
+
+
+class RangeHasher:
+    """ Хеши диапазонов на стороне отправителя: фрагменты учитываются по порядку, по мере их чтения. """
+
+    def __init__(self, fragments_per_range):
+        """ fragments_per_range: Фрагментов в диапазоне (range_fragments). """
+
+        self.fragments_per_range = fragments_per_range
+        self.digests = []
+        self.current = range_digest(b'')
+        self.filled = 0
+
+    def feed(self, fragments):
+        """ Пропускает фрагменты (итератор по данным по порядку номеров), попутно считая хеши. """
+
+        for data in fragments:
+            self.current.update(data)
+            self.filled += 1
+            if self.filled == self.fragments_per_range:
+                self.digests.append(self.current.digest())
+                self.current, self.filled = range_digest(b''), 0
+            yield data
+        if self.filled:
+            self.digests.append(self.current.digest())
+            self.current, self.filled = range_digest(b''), 0
+
+    def file_digest(self):
+        return file_digest(self.digests)
+
+
+class RangeVerifier:
+    """ Хеши диапазонов на стороне получателя. Диапазон хешируется, как только записан последний его фрагмент:
+    данные читаются обратно из файла, пока они в кэше страниц. Диапазоны, принятые в прошлой (прерванной)
+    передаче, хешируются при проверке. Несовпавший диапазон снимается с битовой карты и принимается заново. """
+
+    def __init__(self, assembler, bitmap, fragments_per_range, payload_size):
+        """ assembler: reassembly.FileAssembler принимаемого файла.
+        bitmap: reassembly.FragmentBitmap принятых фрагментов.
+        fragments_per_range: Фрагментов в диапазоне.
+        payload_size: Размер данных фрагмента. """
+
+        self.assembler = assembler
+        self.bitmap = bitmap
+        self.fragments_per_range = fragments_per_range
+        self.payload_size = payload_size
+        count = -(-bitmap.count // fragments_per_range)
+        self.written = [0] * count              # записано фрагментов диапазона в этой передаче
+        self.digests = [None] * count
+        self.lock = threading.Lock()            # асинхронный сервер пишет фрагменты из пула потоков
+
+    def bounds(self, index):
+        """ Номера первого фрагмента диапазона и после последнего. """
+
+        start = index * self.fragments_per_range
+        return start, min(start + self.fragments_per_range, self.bitmap.count)
+
+    def hash_range(self, index):
+        start, end = self.bounds(index)
+        offset = start * self.payload_size
+        length = min(end * self.payload_size, self.assembler.size) - offset
+        return range_digest(self.assembler.read(offset, length)).digest()
+
+    def stored(self, seq):
+        """ Фрагмент seq записан в файл. """
+
+        index = seq // self.fragments_per_range
+        with self.lock:
+            self.written[index] += 1
+            start, end = self.bounds(index)
+            if self.written[index] != end - start:
+                return
+        self.digests[index] = self.hash_range(index)
+
+    def unhashed(self, first, count):
+        """ Номера диапазонов из count, начиная с first, которые приняты целиком, но еще не хешированы
+        (приняты в прошлой передаче). Вызывается там же, где меняется битовая карта.
+
+        first: Номер первого диапазона.
+        count: Количество диапазонов. """
+
+        return [index for index in range(first, min(first + count, len(self.digests)))
+                if self.digests[index] is None and all(seq in self.bitmap for seq in range(*self.bounds(index)))]
+
+    def hash_ranges(self, indexes):
+        """ Хеши диапазонов из файла, без изменения состояния (можно вызывать в пуле потоков). """
+        return [self.hash_range(index) for index in indexes]
+
+    def check(self, first, digests):
+        """ Сравнение хешей диапазонов отправителя с принятыми. Возвращает номера несовпавших диапазонов,
+        они снимаются с битовой карты.
+
+        first: Номер первого диапазона.
+        digests: Хеши отправителя подряд (bytes). """
+
+        bad = []
+        for index in range(first, min(first + len(digests) // DIGEST_SIZE, len(self.digests))):
+            start, end = self.bounds(index)
+            if any(seq not in self.bitmap for seq in range(start, end)):
+                bad.append(index)                               # уже снят (ответ на прошлый DIG потерян)
+                continue
+            if self.digests[index] is None:
+                self.digests[index] = self.hash_range(index)
+            expected = digests[(index - first) * DIGEST_SIZE:(index - first + 1) * DIGEST_SIZE]
+            if self.digests[index] != expected:
+                with self.lock:
+                    self.written[index] = 0
+                    self.digests[index] = None
+                    self.bitmap.discard_range(start, end)
+                bad.append(index)
+        return bad
+
+    def file_digest(self):
+        """ Хеш файла или None, пока не все диапазоны проверены. """
+        return None if None in self.digests else file_digest(self.digests)
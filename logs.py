@@ -0,0 +1,81 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime
+
+LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+PROGRESS_INTERVAL = 1.0     # прогресс передачи пишется в журнал не чаще раза в столько секунд
+_listener = None            # logging.handlers.QueueListener, пишущий журнал в фоновом потоке
+_lock = threading.Lock()
+
+
+def configure(filename=None, level=logging.INFO, background=True):
+    """ Настройка журнала точкой входа (main.py, gui.py), при импорте модулей журнал не настраивается
+    и записи ниже WARNING отбрасываются. Повторный вызов ничего не меняет. Возвращает имя файла журнала.
+
+    filename: Файл журнала, по умолчанию transfer_<дата>_<время>.log в текущей директории.
+    level: Уровень записей.
+    background: Записи передаются через очередь потоку записи, рабочие потоки не ждут диска. """
+
+    global _listener
+    with _lock:
+        root = logging.getLogger()
+        existing = next((handler for handler in root.handlers if getattr(handler, 'transfer_log', None)), None)
+        if existing is not None:
+            return existing.transfer_log
+        filename = filename or f"transfer_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        file_handler = logging.FileHandler(filename, mode='w', encoding='utf-8')
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        if background:
+            handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+            _listener = logging.handlers.QueueListener(handler.queue, file_handler)
+            _listener.start()
+            atexit.register(shutdown)
+        else:
+            handler = file_handler
+        handler.transfer_log = filename
+        root.addHandler(handler)
+        root.setLevel(level)
+        return filename
+
+
+def shutdown():
+    """ Дописывает записи из очереди и останавливает поток записи. """
+
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+class Progress:
+    """ Прогресс передачи в журнале: вместо записи на каждый фрагмент - не чаще раза в interval секунд
+    и последняя запись по завершении. Между записями update только сравнивает время. """
+
+    def __init__(self, title, total, logger=None, interval=PROGRESS_INTERVAL):
+        """ title: Что передается, начало записи.
+        total: Всего фрагментов.
+        logger: logging.Logger, по умолчанию корневой.
+        interval: Наименьший промежуток между записями, секунды. """
+
+        self.title = title
+        self.total = total
+        self.logger = logger or logging.getLogger()
+        self.interval = interval
+        self.next_time = 0.0
+
+    def update(self, done):
+        """ Учитывает, что готово done фрагментов из total. """
+
+        now = time.monotonic()
+        if now < self.next_time and done < self.total:
+            return
+        self.next_time = now + self.interval
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s: %d/%d фрагментов', self.title, done, self.total)
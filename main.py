@@ -1,22 +1,164 @@
 import client
 import server
+import aioserver
+import checksum
+import compression
+import connection
+import congestion
+import fec
+import logs
+import messages
+import metrics
+import protocol
+import store
+import argparse
+import os
+import socket
 import sys
 
 
 
-def main():
-    if len(sys.argv) != 2:
-        print("ERROR 00: Некорректный ввод!")
-        sys.exit(-1)
+def build_parser():
+    parser = argparse.ArgumentParser(description='Передача файлов по UDP')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('client', 'интерактивный клиент'), ('server', 'интерактивный сервер')):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('checksum', nargs='?', choices=checksum.MODES,    # прежняя форма: main.py client crc32c
+                             help='режим контрольной суммы (legacy - для старых версий)')
 
-    if sys.argv[1] == 'client':
+    send = commands.add_parser('send', help='отправить файлы и директории без вопросов (пакетом, если их несколько)')
+    send.add_argument('host', help='адрес сервера')
+    send.add_argument('port', type=int, help='порт сервера')
+    send.add_argument('paths', nargs='+', help='файлы и директории')
+    send.add_argument('--local-port', type=int, default=0, help='порт клиента, по умолчанию любой')
+    send.add_argument('--fragment', type=int, default=protocol.FRAGMENT_AUTO,
+                      help='размер данных фрагмента, 0 - по PMTU пути')
+    send.add_argument('--window', type=int, default=protocol.DEFAULT_WINDOW, help='размер окна')
+    send.add_argument('--algorithm', choices=tuple(congestion.CONTROLLERS), default=congestion.DEFAULT_CONTROLLER,
+                      help='управление перегрузкой')
+    send.add_argument('--compress', help="сжатие фрагментов, например 'zlib:9'")
+    send.add_argument('--fec', help="FEC, например '16:2'")
+    send.add_argument('--incremental', action='store_true', help='для одного файла - передать только изменения')
+    send.add_argument('--dedup', action='store_true', help='не передавать файл, если сервер уже хранит такое содержимое')
+    send.add_argument('--no-verify', action='store_true',
+                      help='не сверять с сервером хеши диапазонов после передачи')
+    send.add_argument('--report', help='файл отчета JSON для графиков (report.py)')
+    send.add_argument('--checksum', choices=checksum.MODES, help='режим контрольной суммы')
+
+    post = commands.add_parser('post', help='отправлять строки stdin сообщениями в постоянной сессии')
+    post.add_argument('host', help='адрес сервера')
+    post.add_argument('port', type=int, help='порт сервера')
+    post.add_argument('--local-port', type=int, default=0, help='порт клиента, по умолчанию любой')
+    post.add_argument('--fragment', type=int, default=protocol.FRAGMENT_AUTO,
+                      help='размер данных фрагмента, 0 - по PMTU пути')
+    post.add_argument('--delay', type=float, default=messages.FLUSH_DELAY * 1000,
+                      help='наибольшая задержка сообщения ради объединения с соседними, мс')
+    post.add_argument('--checksum', choices=checksum.MODES, help='режим контрольной суммы')
+
+    receive = commands.add_parser('receive', help='принимать передачи без вопросов до Ctrl+C')
+    receive.add_argument('port', type=int, help='порт сервера')
+    receive.add_argument('dir', help='директория для полученных файлов')
+    receive.add_argument('--aio', action='store_true', help='одновременный прием от многих клиентов')
+    receive.add_argument('--metrics-port', type=int, help='порт метрик Prometheus на 127.0.0.1')
+    receive.add_argument('--store', action='store_true',
+                         help='хранилище по содержимому: одинаковые файлы хранятся и принимаются один раз')
+    receive.add_argument('--checksum', choices=checksum.MODES, help='режим контрольной суммы')
+    return parser
+
+
+def send(args):
+    """ Неинтерактивная отправка. Возвращает код завершения. """
+
+    fragment = args.fragment
+    if fragment != protocol.FRAGMENT_AUTO:
+        fragment = min(max(fragment, protocol.FRAGMENT_MIN), protocol.FRAGMENT_MAX) + protocol.HEADER_SIZE
+    window = max(1, min(args.window, protocol.WINDOW_MAX))
+    try:
+        compression.parse(args.compress)
+        fec.parse(args.fec)
+    except ValueError as error:
+        print('ERROR 00:', error)
+        return 2
+    options = {'algorithm': args.algorithm, 'compress': args.compress, 'redundancy': args.fec,
+               'report_path': args.report, 'verify': not args.no_verify}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
+        client_socket.bind(('', args.local_port))
+        if len(args.paths) == 1 and os.path.isfile(args.paths[0]):
+            done = client.send_file(args.host, client_socket, args.port, fragment, os.fsencode(args.paths[0]), window,
+                                    incremental=args.incremental, dedup=args.dedup, **options)
+        else:
+            done = client.send_batch(args.host, client_socket, args.port, fragment, args.paths, window, **options)
+    return 0 if done else 1
+
+
+def post(args):
+    """ Отправка строк stdin сообщениями до конца ввода. Возвращает код завершения. """
+
+    fragment = args.fragment
+    if fragment != protocol.FRAGMENT_AUTO:
+        fragment = min(max(fragment, protocol.FRAGMENT_MIN), protocol.FRAGMENT_MAX) + protocol.HEADER_SIZE
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client_socket:
+        client_socket.bind(('', args.local_port))
+        persistent = connection.Connection(client_socket, args.host, args.port, fragment)
+        if not persistent.open():
+            print('Соединение не установлено')
+            return 1
+        sender = messages.Coalescer(persistent, max(args.delay, 0) / 1000)
+        try:
+            for line in sys.stdin:
+                sender.send(line.rstrip('\n'))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sender.close()
+            persistent.close()
+    print('Отправлено сообщений:', sender.sent, ' не доставлено:', sender.lost)
+    return 0 if sender.lost == 0 else 1
+
+
+def receive(args):
+    """ Неинтерактивный прием до Ctrl+C. Возвращает код завершения. """
+
+    if not os.path.isdir(args.dir):
+        print('ERROR 01: Путь', args.dir, 'не существует!')
+        return 2
+    dir_path = os.path.join(args.dir, '')
+    content_store = store.ContentStore(dir_path) if args.store else None
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server_socket:
+        server_socket.bind(('', args.port))
+        if args.aio:
+            aioserver.run(server_socket, dir_path, metrics_port=args.metrics_port, content_store=content_store)
+            return 0
+        connections = connection.ConnectionTable()
+        exporter = metrics.start(args.metrics_port)             # счетчики общие с transfer.Transfer
+        try:
+            while True:
+                server.receive(server_socket, dir_path, content_store=content_store, connections=connections)
+        except KeyboardInterrupt:
+            print('Сервер остановлен')
+        finally:
+            metrics.stop(exporter)
+    return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.checksum:
+        protocol.set_checksum_mode(args.checksum)
+
+    logs.configure()
+    if args.command == 'client':
         client.user_interface()
-    elif sys.argv[1] == 'server':
+    elif args.command == 'server':
         server.user_interface()
+    elif args.command == 'send':
+        return send(args)
+    elif args.command == 'post':
+        return post(args)
     else:
-        print("ERROR 00: Некорректный ввод!")
-        sys.exit(-1)
+        return receive(args)
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
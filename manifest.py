@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+
+PART_SUFFIX = '.part'                                       # недополученный файл
+MANIFEST_SUFFIX = '.manifest'                               # рядом с ним - манифест принятых диапазонов
+CHECKPOINT_INTERVAL = 1.0                                   # секунд между сохранениями манифеста
+IDENTITY = ('name', 'size', 'mtime', 'count', 'fragment', 'delta')  # по этим параметрам SET передача та же
+
+
+def resumable(params):
+    """ Можно ли продолжить передачу: клиент сообщил размер и время изменения файла.
+
+    params: Параметры из сообщения инициализации. """
+    return 'size' in params and 'mtime' in params
+
+
+def part_path(path, params):
+    """ Путь к недополученному файлу. Разные версии одного файла (другой размер, время изменения
+    или размер фрагмента) получают разные пути и не мешают друг другу.
+
+    path: Путь, под которым файл будет сохранен после завершения.
+    params: Параметры из сообщения инициализации. """
+
+    identity = json.dumps([params.get(key) for key in IDENTITY])
+    return f"{path}.{hashlib.sha1(identity.encode('utf-8')).hexdigest()[:8]}{PART_SUFFIX}"
+
+
+def load(path, params):
+    """ Чтение манифеста недополученного файла. Возвращает список принятых диапазонов (начало, конец)
+    или None, если манифеста нет, он поврежден или относится к другой версии файла.
+
+    path: Путь к недополученному файлу.
+    params: Параметры из сообщения инициализации. """
+
+    try:
+        with open(path + MANIFEST_SUFFIX, encoding='utf-8') as file:
+            manifest = json.load(file)
+        received = [(int(start), int(end)) for start, end in manifest['received']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if any(manifest.get(key) != params.get(key) for key in IDENTITY) or not os.path.exists(path):
+        return None
+    return received
+
+
+def save(path, params, ranges):
+    """ Атомарная запись манифеста: новый манифест заменяет старый целиком или не заменяет вовсе.
+
+    path: Путь к недополученному файлу.
+    params: Параметры из сообщения инициализации.
+    ranges: Принятые и уже записанные на диск диапазоны фрагментов. """
+
+    manifest = {key: params.get(key) for key in IDENTITY}
+    manifest['received'] = [list(item) for item in ranges]
+    temp_path = path + MANIFEST_SUFFIX + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, path + MANIFEST_SUFFIX)
+
+
+def remove(path):
+    """ Удаление манифеста после завершения передачи. """
+    try:
+        os.remove(path + MANIFEST_SUFFIX)
+    except FileNotFoundError:
+        pass
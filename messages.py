@@ -0,0 +1,192 @@
+import client
+import protocol
+import logging
+import struct
+import threading
+import time
+
+FRAME = struct.Struct('!I')     # длина сообщения перед его байтами, сообщения идут подряд через границы датаграмм
+FLUSH_DELAY = 0.005             # сколько сообщение ждет попутчиков, прежде чем уйти, секунды
+MAX_MESSAGE = 1 << 24           # сообщение длиннее - поток считается поврежденным
+
+
+def frame(message):
+    """ Кадр сообщения: длина и байты. """
+    return FRAME.pack(len(message)) + message
+
+
+def unframe(data):
+    """ Сообщения из байтов, составленных из целых кадров. """
+
+    offset = 0
+    while offset + FRAME.size <= len(data):
+        (length,) = FRAME.unpack_from(data, offset)
+        yield data[offset + FRAME.size:offset + FRAME.size + length]
+        offset += FRAME.size + length
+
+
+def print_message(address, text):
+    """ Обработчик сообщений по умолчанию: вывод в консоль, как раньше выводился текст. """
+    print(f'{address[0]}:{address[1]}: {text}')
+
+
+def deliver(on_message, address, text):
+    """ Передача сообщения обработчику: его ошибка записывается в журнал и не прерывает прием.
+
+    on_message: Обработчик (адрес, текст) или None для messages.print_message. """
+
+    try:
+        (on_message or print_message)(address, text)
+    except Exception:
+        logging.exception(f"Ошибка обработки сообщения от {address[0]}:{address[1]}")
+
+
+def to_queue(queue):
+    """ Обработчик, кладущий пары (адрес, текст) в очередь (queue.Queue или asyncio.Queue из того же цикла),
+    чтобы сообщения разбирал другой поток или задача. """
+    return lambda address, text: queue.put_nowait((address, text))
+
+
+class MessageStream:
+    """ Прием сообщений одной постоянной сессии на сервере: датаграммы PSH складываются по порядку номеров
+    в поток байт, из которого выделяются кадры с длиной. Граница сообщения не зависит от границ датаграмм:
+    несколько коротких сообщений приходят в одной датаграмме, длинное - в нескольких. """
+
+    def __init__(self):
+        self.next_seq = 0                       # номер следующей датаграммы по порядку
+        self.pending = {}                       # номер -> данные датаграмм, пришедших раньше предыдущих
+        self.buffer = bytearray()               # начало неполного кадра
+
+    def accepts(self, seq):
+        """ Поместится ли датаграмма seq в окно приема (более далекие не подтверждаются и придут снова). """
+        return seq < self.next_seq + protocol.WINDOW_MAX
+
+    def add(self, seq, data):
+        """ Датаграмма с номером seq. Возвращает список сообщений (bytes), ставших полными.
+
+        seq: Номер датаграммы в потоке сессии.
+        data: Данные датаграммы без заголовка. """
+
+        if seq < self.next_seq or seq in self.pending:          # повтор, подтверждение которого потерялось
+            return []
+        self.pending[seq] = bytes(data)                         # данные могут лежать в буфере из пула
+        while self.next_seq in self.pending:
+            self.buffer += self.pending.pop(self.next_seq)
+            self.next_seq += 1
+        messages, offset = [], 0
+        while offset + FRAME.size <= len(self.buffer):
+            (length,) = FRAME.unpack_from(self.buffer, offset)
+            if length > MAX_MESSAGE:
+                logging.error(f"Сообщение длиной {length} байт, поток сообщений сброшен")
+                self.buffer.clear()
+                return messages
+            if offset + FRAME.size + length > len(self.buffer):
+                break
+            messages.append(bytes(self.buffer[offset + FRAME.size:offset + FRAME.size + length]))
+            offset += FRAME.size + length
+        del self.buffer[:offset]
+        return messages
+
+
+class Coalescer:
+    """ Отправка коротких сообщений в постоянной сессии (connection.Connection) с объединением: кадры сообщений
+    копятся и уходят вместе, как только набираются данные фрагмента или первое из них прождало flush_delay.
+    Фоновый поток отправляет их фрагментами PSH с номерами потока сессии - без инициализации и FIN
+    на каждое сообщение, с подтверждением и повтором потерянных, как у файла. """
+
+    def __init__(self, connection, flush_delay=FLUSH_DELAY):
+        """ connection: connection.Connection, открывается при первой отправке.
+        flush_delay: Наибольшая задержка сообщения ради объединения, секунды. """
+
+        self.connection = connection
+        self.flush_delay = flush_delay
+        self.buffer = bytearray()               # кадры, еще не переданные отправляющему потоку
+        self.deadline = None                    # когда отправить накопленное, даже если фрагмент не набран
+        self.sending = False
+        self.closed = False
+        self.sent = 0                           # доставлено сообщений
+        self.lost = 0                           # сообщений, которые не удалось доставить
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def payload_size(self):
+        fragment_size = self.connection.fragment_size
+        return fragment_size - protocol.HEADER_SIZE if fragment_size != protocol.FRAGMENT_AUTO else protocol.FRAGMENT_MAX
+
+    def send(self, message):
+        """ Ставит сообщение в очередь, не дожидаясь отправки.
+
+        message: Текст (str или bytes в UTF-8). """
+
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        with self.condition:
+            if self.closed:
+                raise ValueError('Отправитель сообщений закрыт')
+            self.buffer += frame(message)
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.flush_delay
+            self.condition.notify_all()
+
+    def flush(self):
+        """ Отправляет накопленное сразу и ждет подтверждения сервера. """
+
+        with self.condition:
+            if self.buffer:
+                self.deadline = time.monotonic()
+                self.condition.notify_all()
+            while self.buffer or self.sending:
+                self.condition.wait()
+
+    def close(self):
+        """ Отправляет накопленное и останавливает фоновый поток. Сессия остается открытой. """
+
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not (self.buffer and (self.closed or len(self.buffer) >= self.payload_size()
+                                            or time.monotonic() >= self.deadline)):
+                    if self.closed and not self.buffer:
+                        return
+                    self.condition.wait(None if self.deadline is None else max(self.deadline - time.monotonic(), 0))
+                data, self.buffer, self.deadline = bytes(self.buffer), bytearray(), None
+                self.sending = True
+            count = sum(1 for _ in unframe(data))
+            delivered = self.transmit(data)
+            with self.condition:
+                if delivered:
+                    self.sent += count
+                else:
+                    self.lost += count
+                self.sending = False
+                self.condition.notify_all()
+
+    def transmit(self, data):
+        """ Отправка кадров фрагментами в потоке сессии. Возвращает True, если сервер подтвердил все фрагменты.
+
+        data: Кадры подряд. """
+
+        connection = self.connection
+        with connection.lock:                   # сокет сессии занят одной передачей
+            if not connection.ensure():
+                logging.error("Сообщения не отправлены: постоянная сессия не открыта")
+                return False
+            payload_size = connection.fragment_size - protocol.HEADER_SIZE
+            fragments = [data[offset:offset + payload_size] for offset in range(0, len(data), payload_size)]
+            result = client.send_fragments(connection.client_socket, connection.server_ip, connection.server_port,
+                                           connection.session, fragments, connection.window_size,
+                                           estimator=connection.estimator, controller=connection.controller,
+                                           first=connection.stream_seq)
+            if result is None:
+                logging.error("Сообщения не отправлены: сервер не отвечает")
+                connection.drop()
+                return False
+            connection.stream_seq += len(fragments)
+            connection.last_activity = time.monotonic()
+            return True
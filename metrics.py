@@ -0,0 +1,333 @@
+import bisect
+import collections
+import json
+import threading
+import time
+
+RTT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)     # секунды
+GOODPUT_WINDOW = 60         # за сколько последних секунд хранится полезная скорость
+GOODPUT_RATE = 5            # по скольким последним полным секундам считается текущая полезная скорость
+METRICS_HOST = '127.0.0.1'  # метрики отдаются только локально, сборщик работает на той же машине
+
+
+class Metric:
+    """ Метрика с метками: значение хранится отдельно для каждого набора значений меток.
+    Дочерний объект labels() привязан к одному набору и обновляется без поиска по словарю. """
+
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        """ name: Имя метрики в формате Prometheus.
+        help_text: Описание.
+        labelnames: Имена меток. """
+
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values, **labels):
+        """ Дочерняя метрика для значений меток (по порядку labelnames или по именам). """
+
+        key = values or tuple(str(labels[name]) for name in self.labelnames)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f'{self.name}: ожидаются метки {self.labelnames}')
+        with self.lock:
+            if key not in self.children:
+                self.children[key] = self.child()
+            return self.children[key]
+
+    def child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """ Пары (суффикс имени, метки, значение) для экспорта. """
+
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in children:
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield suffix, {**labels, **extra}, value
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def samples(self):
+        yield '', {}, self.value
+
+
+class _CounterValue(_Value):
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _GaugeValue(_CounterValue):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield '_bucket', {'le': '+Inf' if bound == float('inf') else repr(bound)}, cumulative
+        yield '_sum', {}, total
+        yield '_count', {}, cumulative
+
+
+class _GoodputValue(_CounterValue):
+    """ Счетчик полезных байт с историей по секундам: текущая скорость и скорость во времени. """
+
+    def __init__(self):
+        super().__init__()
+        self.history = collections.deque(maxlen=GOODPUT_WINDOW)     # [секунда, байт]
+
+    def inc(self, amount=1):
+        second = int(time.time())
+        with self.lock:
+            self.value += amount
+            if self.history and self.history[-1][0] == second:
+                self.history[-1][1] += amount
+            else:
+                self.history.append([second, amount])
+
+    def series(self):
+        """ Байт в секунду за последние GOODPUT_WINDOW секунд, список [секунда, байт]. """
+
+        now = int(time.time())
+        with self.lock:
+            return [list(item) for item in self.history if item[0] > now - GOODPUT_WINDOW]
+
+    def rate(self):
+        """ Средняя полезная скорость за последние GOODPUT_RATE полных секунд, байт/с. """
+
+        now = int(time.time())
+        return sum(count for second, count in self.series() if now - GOODPUT_RATE <= second < now) / GOODPUT_RATE
+
+    def samples(self):
+        yield '_bytes_total', {}, self.value
+        yield '_bytes_per_second', {}, self.rate()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def child(self):
+        return _CounterValue()
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def child(self):
+        return _GaugeValue()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=RTT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def child(self):
+        return _HistogramValue(self.buckets)
+
+
+class Goodput(Metric):
+    """ Полезная скорость: счетчик байт (_bytes_total) и скорость за последние секунды (_bytes_per_second). """
+
+    kind = 'goodput'
+
+    def child(self):
+        return _GoodputValue()
+
+
+class Registry:
+    """ Набор метрик процесса с выгрузкой в JSON и в текстовом формате Prometheus. """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        """ Добавляет метрику. Возвращает уже зарегистрированную с тем же именем, если она есть. """
+
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self.register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=RTT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def goodput(self, name, help_text, labelnames=()):
+        return self.register(Goodput(name, help_text, labelnames))
+
+    def snapshot(self):
+        """ Значения всех метрик словарем для JSON. У полезной скорости есть ряд по секундам (series). """
+
+        result = {'time': time.time(), 'metrics': {}}
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            values = []
+            with metric.lock:
+                children = list(metric.children.items())
+            for key, child in children:
+                item = {'labels': dict(zip(metric.labelnames, key))}
+                if metric.kind == 'histogram':
+                    with child.lock:
+                        item.update(buckets=dict(zip(map(repr, metric.buckets + (float('inf'),)), child.counts)),
+                                    sum=child.sum, count=sum(child.counts))
+                elif metric.kind == 'goodput':
+                    item.update(bytes=child.value, rate=child.rate(), series=child.series())
+                else:
+                    item['value'] = child.value
+                values.append(item)
+            result['metrics'][metric.name] = {'type': metric.kind, 'help': metric.help, 'values': values}
+        return result
+
+    def prometheus(self):
+        """ Все метрики в текстовом формате Prometheus (version 0.0.4). """
+
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            if metric.kind == 'goodput':                            # два семейства: счетчик и текущая скорость
+                families = [(f'{metric.name}_bytes_total', metric.help, 'counter', ('_bytes_total',)),
+                            (f'{metric.name}_bytes_per_second', f'{metric.help}, средняя за {GOODPUT_RATE} с',
+                             'gauge', ('_bytes_per_second',))]
+            else:
+                families = [(metric.name, metric.help, metric.kind, None)]
+            samples = list(metric.samples())
+            for family, help_text, kind, suffixes in families:
+                lines += [f'# HELP {family} {help_text}', f'# TYPE {family} {kind}']
+                for suffix, labels, value in samples:
+                    if suffixes is not None and suffix not in suffixes:
+                        continue
+                    label_text = ','.join(f'{name}="{escape(value)}"' for name, value in labels.items())
+                    lines.append(f'{metric.name}{suffix}{{{label_text}}} {format_value(value)}' if label_text
+                                 else f'{metric.name}{suffix} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    """ Экранирование значения метки для формата Prometheus. """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    """ Число в формате Prometheus: целые без дробной части. """
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+REGISTRY = Registry()       # общий реестр клиента и сервера в одном процессе
+
+FRAGMENTS_SENT = REGISTRY.counter('udp_transfer_fragments_sent_total', 'Отправлено фрагментов данных, включая повторы',
+                                  ('role',))
+FRAGMENTS_RECEIVED = REGISTRY.counter('udp_transfer_fragments_received_total', 'Принято фрагментов данных',
+                                      ('role',))
+BYTES_SENT = REGISTRY.counter('udp_transfer_bytes_sent_total', 'Отправлено байт данных фрагментов', ('role',))
+BYTES_RECEIVED = REGISTRY.counter('udp_transfer_bytes_received_total', 'Принято байт данных фрагментов', ('role',))
+RETRANSMITS = REGISTRY.counter('udp_transfer_retransmits_total', 'Повторные передачи фрагментов', ('role', 'reason'))
+CRC_FAILURES = REGISTRY.counter('udp_transfer_crc_failures_total', 'Датаграммы с неверной контрольной суммой',
+                                ('role',))
+DUPLICATES = REGISTRY.counter('udp_transfer_duplicates_total', 'Повторно принятые фрагменты', ('role',))
+RECOVERED = REGISTRY.counter('udp_transfer_fec_recovered_total', 'Фрагменты, восстановленные по четности',
+                             ('role',))
+RTT = REGISTRY.histogram('udp_transfer_rtt_seconds', 'Измерения RTT', ('role',))
+WINDOW = REGISTRY.gauge('udp_transfer_congestion_window', 'Окно перегрузки последней передачи, фрагментов', ('role',))
+ACTIVE = REGISTRY.gauge('udp_transfer_active_transfers', 'Передачи в процессе', ('role',))
+CONNECTIONS = REGISTRY.gauge('udp_transfer_connections', 'Открытые постоянные сессии (connection.py)', ('role',))
+TRANSFERS = REGISTRY.counter('udp_transfer_transfers_total', 'Завершенные передачи', ('role', 'result'))
+GOODPUT = REGISTRY.goodput('udp_transfer_goodput', 'Полезные данные, подтвержденные (клиент) или сохраненные (сервер)',
+                           ('role',))
+
+
+def serve(port, registry=REGISTRY, host=METRICS_HOST):
+    """ Запуск HTTP-сервера метрик в фоновом потоке. Возвращает http.server.ThreadingHTTPServer
+    (остановка - shutdown()).
+
+    port: Порт, 0 - свободный (фактический - server_address).
+    registry: Реестр метрик.
+    host: Адрес, по умолчанию только локальный. """
+
+    import http.server                                      # нужен только серверу метрик, импорт дорогой
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        """ /metrics - текстовый формат Prometheus, /metrics.json - снимок JSON. """
+
+        def do_GET(self):
+            if self.path.split('?')[0] == '/metrics':
+                body, content_type = registry.prometheus().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+            elif self.path.split('?')[0] == '/metrics.json':
+                body, content_type = json.dumps(registry.snapshot(), ensure_ascii=False).encode('utf-8'), \
+                    'application/json'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):      # запросы сборщика не засоряют вывод сервера
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+def start(port):
+    """ Запуск сервера метрик с сообщением об адресе. Возвращает его или None, если порт не задан или занят.
+
+    port: Порт на METRICS_HOST или None. """
+
+    if port is None:
+        return None
+    try:
+        exporter = serve(port)
+    except OSError as error:
+        print('Метрики недоступны:', error)
+        return None
+    print(f'Метрики: http://{METRICS_HOST}:{exporter.server_address[1]}/metrics')
+    return exporter
+
+
+def stop(exporter):
+    """ Остановка сервера метрик, запущенного start (None - ничего не делать). """
+
+    if exporter is not None:
+        exporter.shutdown()
+        exporter.server_close()
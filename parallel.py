@@ -0,0 +1,152 @@
+import client
+import compression
+import fec
+import protocol
+import reassembly
+import rtt
+import concurrent.futures
+import math
+import os
+import socket
+import time
+
+DEFAULT_STREAMS = 4         # количество параллельных потоков передачи
+STREAMS_MAX = 16
+
+
+def split(count, streams, align=1):
+    """ Делит фрагменты 0..count на не больше чем streams непрерывных диапазонов. Возвращает список (начало, конец).
+
+    count: Общее количество фрагментов.
+    streams: Количество потоков.
+    align: Границы диапазонов кратны align, чтобы блок FEC целиком отправлялся одним потоком. """
+
+    step = math.ceil(math.ceil(count / streams) / align) * align
+    return [(start, min(start + step, count)) for start in range(0, count, step)] if step else []
+
+
+def send_range(server_ip, server_port, fragment_size, file_path, session, first, last, received, window_size,
+               checksum_mode, compress=None, redundancy=None):
+    """ Один поток передачи: свой сокет (порт), своя оценка RTT и свое окно перегрузки, фрагменты first..last файла.
+    Поток присоединяется к начатой сессии сообщением SET с параметром join. Выполняется в отдельном процессе,
+    поэтому контрольные суммы разных потоков считаются на разных ядрах. Возвращает количество отправленных
+    фрагментов, NACK, подтвержденных и восстановленных по четности фрагментов либо None, если сервер перестал отвечать.
+
+    server_ip: IP-адрес сервера.
+    server_port: Порт сервера.
+    fragment_size: Размер фрагмента с заголовком протокола.
+    file_path: Путь к файлу.
+    session: Идентификатор сессии, полученный основным потоком.
+    first: Номер первого фрагмента диапазона.
+    last: Номер после последнего фрагмента диапазона.
+    received: Диапазоны, уже принятые сервером в прерванной передаче.
+    window_size: Предельный размер окна.
+    checksum_mode: Режим контрольной суммы, процесс может не унаследовать его от родителя.
+    compress: Пара (метод, уровень) сжатия, согласованного основным потоком, или None.
+    redundancy: Пара (блок, четность) FEC, согласованного основным потоком, или None. """
+
+    protocol.set_checksum_mode(checksum_mode)
+    payload_size = fragment_size - protocol.HEADER_SIZE
+    estimator = rtt.RttEstimator()
+    skip = reassembly.FragmentBitmap(last)
+    for start, end in received:
+        skip.add_range(start, end)
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as stream_socket:
+        stream_socket.bind(('', 0))
+        joined, _ = client.initialization(stream_socket, server_ip, server_port, protocol.MsgType.SET, {'join': True},
+                                          estimator, session)
+        if joined == 0:
+            return None
+        encoder = fec.Encoder(*redundancy, last) if redundancy else None
+        with open(file_path, 'rb') as file:
+            view = client.map_file(file)
+            try:
+                result = client.send_fragments(stream_socket, server_ip, server_port, session,
+                                               (view[seq * payload_size:(seq + 1) * payload_size]
+                                                for seq in range(first, last)),
+                                               window_size, estimator=estimator, skip=skip, first=first,
+                                               compressor=compression.Compressor(*compress) if compress else None,
+                                               encoder=encoder)
+            finally:
+                view.release()
+    if result is None:
+        return None
+    all_fragment, nack_fragment, status_log = result
+    return all_fragment, nack_fragment, status_log.count(1), encoder.recovered if encoder else 0
+
+
+def send_file(server_ip, client_socket, server_port, fragment_size, file_path, streams=DEFAULT_STREAMS,
+              window_size=protocol.DEFAULT_WINDOW, processes=True, compress=None, redundancy=None):
+    """ Передача одного файла несколькими потоками. Основной сокет инициализирует передачу и завершает ее (FIN),
+    данные идут по streams сокетам, каждый со своим диапазоном фрагментов, окном и управлением перегрузкой.
+    Сервер собирает диапазоны в один файл по смещениям.
+
+    server_ip: IP-адрес сервера.
+    client_socket: Основной клиентский сокет.
+    server_port: Порт сервера.
+    fragment_size: Размер фрагмента с заголовком протокола или protocol.FRAGMENT_AUTO.
+    file_path: Путь к файлу (bytes).
+    streams: Количество потоков, не больше STREAMS_MAX.
+    window_size: Предельный размер окна каждого потока.
+    processes: Потоки в отдельных процессах (несколько ядер) или в потоках одного процесса.
+    compress: Сжатие фрагментов вида 'zlib' или 'lzma:9' (compression.parse).
+    redundancy: FEC вида '16:2' (fec.parse), каждый блок целиком отправляет один поток. """
+
+    streams = max(1, min(streams, STREAMS_MAX))
+    compress = compression.parse(compress)
+    redundancy = fec.parse(redundancy)
+    estimator = rtt.RttEstimator()
+    if fragment_size == protocol.FRAGMENT_AUTO:
+        fragment_size = client.auto_fragment_size(server_ip, server_port, estimator)
+    payload_size = fragment_size - protocol.HEADER_SIZE
+    file_size = os.path.getsize(file_path)
+    num_of_fragment = math.ceil(file_size / payload_size)
+
+    try:
+        session, accepted = client.initialization(client_socket, server_ip, server_port, protocol.MsgType.SET,
+                                                  {'name': client.get_file_name(file_path), 'count': num_of_fragment,
+                                                   'fragment': payload_size, 'window': window_size, 'size': file_size,
+                                                   'mtime': os.stat(file_path).st_mtime_ns, 'streams': streams,
+                                                   'compression': compress and compress[0], 'fec': redundancy},
+                                                  estimator)
+        if session == 0:
+            return
+        if compress and accepted.get('compression') != compress[0]:     # старый сервер принимает только несжатые
+            compress = None
+        if redundancy and accepted.get('fec') != list(redundancy):     # старый сервер четность не принимает
+            redundancy = None
+        received = accepted.get('received', [])
+        ranges = split(num_of_fragment, streams, redundancy[0] if redundancy else 1)
+
+        start_time = time.time()
+        executor_class = concurrent.futures.ProcessPoolExecutor if processes else concurrent.futures.ThreadPoolExecutor
+        with executor_class(max(len(ranges), 1)) as executor:
+            futures = [executor.submit(send_range, server_ip, server_port, fragment_size, file_path, session,
+                                       first, last, received, window_size, protocol.CHECKSUM_MODE, compress,
+                                       redundancy)
+                       for first, last in ranges]
+            results = [future.result() for future in futures]
+        if None in results or not client.finish(client_socket, server_ip, server_port, session, estimator):
+            print('Соединение не установлено')
+            return
+        end_time = time.time()
+
+        all_fragment = sum(result[0] for result in results)
+        nack_fragment = sum(result[1] for result in results)
+        fragment_count = sum(result[2] for result in results)
+        print(protocol.MsgReply.ACK.value)
+        print('Время:', end_time - start_time, ' потоков:', len(ranges))
+        print('Сохранено в', os.path.abspath(file_path.decode('utf-8')))
+        print('Отправлено фрагментов:', fragment_count, ' всего фрагментов:', num_of_fragment)
+        print('Отправлено фрагментов:', all_fragment, ' NACK фрагментов:', nack_fragment)
+        print(f'Скорость: {file_size / max(end_time - start_time, 1e-9) / 1e6:.1f} МБ/с')
+        if redundancy:
+            print('Восстановлено сервером по четности:', sum(result[3] for result in results))
+
+        client.logger.info(f"Отправленный файл: {file_path.decode('utf-8')}, потоков: {len(ranges)}")
+        client.logger.info(f"Всего фрагментов: {all_fragment}, Повторные передачи (NACK): {nack_fragment}")
+        client.logger.info(f"Время передачи: {end_time - start_time:.2f} секунд")
+
+    except ConnectionResetError:
+        print('Соединение потеряно. Включите сервер.')
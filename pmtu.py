@@ -0,0 +1,110 @@
+import protocol
+import errno
+import select
+import socket
+import sys
+import time
+
+IP_UDP_HEADERS = 28         # IP заголовок(20) + UDP заголовок(8)
+MIN_MTU = 576               # минимальный MTU IPv4, с него начинается поиск (RFC 8899: BASE_PLPMTU)
+ETHERNET_MTU = 1500
+JUMBO_MTU = 9000            # верхняя граница поиска: jumbo-кадры сети хранения
+PROBE_RETRIES = 2           # проба без ответа повторяется, затем считается слишком большой
+PRECISION = 8               # точность двоичного поиска, байты
+# константы Linux, в модуле socket они есть только с Python 3.12
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+
+
+def probe_socket(address):
+    """ Отдельный сокет для проб с запретом фрагментации (DF), соединенный с сервером.
+    Возвращает None, если запретить фрагментацию нельзя (не Linux).
+
+    address: Адрес сервера. """
+
+    if not sys.platform.startswith('linux'):
+        return None
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    sock.connect(address)
+    return sock
+
+
+def local_mtu(sock):
+    """ MTU маршрута к серверу, известный ядру (MTU интерфейса или уже обнаруженный PMTU). """
+    try:
+        return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return JUMBO_MTU
+
+
+def probe(sock, mtu, estimator):
+    """ Проверяет, проходит ли до сервера IP-пакет размером mtu без фрагментации. Потерянная проба
+    повторяется PROBE_RETRIES раз и считается слишком большой: таймаут при этом не удваивается,
+    потеря пробы - не признак перегрузки.
+
+    sock: Сокет из probe_socket.
+    mtu: Проверяемый размер IP-пакета.
+    estimator: rtt.RttEstimator, получает измерения RTT по ответам на первую отправку. """
+
+    size = mtu - IP_UDP_HEADERS
+    packet = protocol.add_header(protocol.MsgType.PRB, bytes(size - protocol.HEADER_SIZE), size)
+    for attempt in range(PROBE_RETRIES + 1):
+        try:
+            sock.send(packet)
+        except OSError as error:
+            if error.errno == errno.EMSGSIZE:                   # больше MTU интерфейса или известного PMTU
+                return False
+            raise
+        sent_time = time.monotonic()
+        deadline = sent_time + estimator.rto
+        while True:
+            ready = select.select([sock], [], [], max(deadline - time.monotonic(), 0))
+            if not ready[0]:
+                break
+            try:
+                reply = sock.recv(protocol.DEFAULT_BUFF)
+            except OSError:                                     # ICMP: пакет слишком большой или порт закрыт
+                continue
+            if protocol.check_crc(reply) == protocol.MsgType.ACK and protocol.get_seq(reply) == size \
+                    and protocol.get_msg_type(reply) == protocol.MsgType.ACK.value:
+                if attempt == 0:
+                    estimator.sample(sent_time)
+                return True
+    return False
+
+
+def discover(server_ip, server_port, estimator):
+    """ Поиск наибольшего размера датаграммы, доходящей до сервера без IP-фрагментации. Сначала проверяется
+    минимальный MTU (заодно измеряется RTT), затем MTU маршрута (до jumbo-кадров) и Ethernet,
+    затем двоичный поиск между последним прошедшим и непрошедшим размером.
+    Возвращает размер фрагмента с заголовком протокола (как fragment_size в client.send_file).
+    Если пробы невозможны или сервер не отвечает, возвращается размер для Ethernet.
+
+    server_ip: IP-адрес сервера.
+    server_port: Порт сервера.
+    estimator: rtt.RttEstimator соединения. """
+
+    fallback = protocol.FRAGMENT_MAX + protocol.HEADER_SIZE
+    sock = probe_socket((server_ip, server_port))
+    if sock is None:
+        return fallback
+    with sock:
+        if not probe(sock, MIN_MTU, estimator):
+            return fallback
+        low, high = MIN_MTU, min(local_mtu(sock), JUMBO_MTU)
+        if probe(sock, high, estimator):
+            return high - IP_UDP_HEADERS
+        if low < ETHERNET_MTU < high:
+            if probe(sock, ETHERNET_MTU, estimator):
+                low = ETHERNET_MTU
+            else:
+                high = ETHERNET_MTU
+        while high - low > PRECISION:
+            middle = (low + high) // 2
+            if probe(sock, middle, estimator):
+                low = middle
+            else:
+                high = middle
+    return low - IP_UDP_HEADERS
@@ -1,98 +1,77 @@
-
+import checksum
 import enum
-import re
-
-HEADER_SIZE = 6
+import json
+import struct
+
+CHECKSUM_MODE = 'crc32'     # 'crc32', 'crc32c' или 'legacy' (цифровая сумма CRC_KEY для старых версий)
+VERSION = 1                 # версия формата заголовка
+# версия(1) + тип(1) + флаги(2) + сессия(4) + номер фрагмента(4) + длина данных(2) + контрольная сумма(4)
+HEADER = struct.Struct('!BBHIIHI')
+HEADER_PREFIX = struct.Struct('!BBHIIH')        # заголовок без контрольной суммы, она считается и по нему
+CHECKSUM_FIELD = struct.Struct('!I')
+HEADER_SIZE = HEADER.size   # 18
 DEFAULT_BUFF = 4096
-DEFAULT_FRAGMENT_LEN = 4
-FRAGMENT_MAX = 1466         # max_fragment = данные(1500) - UDP заголовок(8) - IP заголовок(20) - новый заголовок(6) = 1466
-FRAGMENT_MIN = 1            # min_fragment = данные(46) - UDP заголовок(8) - IP заголовок(20) - новый заголовок(6) = 12
+DEFAULT_WINDOW = 32         # количество фрагментов в полете без подтверждения (Selective Repeat)
+WINDOW_MAX = 256            # окно приема сервера, больше клиент не отправляет
+MAX_RETRIES = 10            # количество повторов одного фрагмента до разрыва соединения (таймаут - rtt.RttEstimator)
+LISTEN_TIMEOUT = 20         # сколько сервер ждет инициализации передачи, секунды
+FRAGMENT_MAX = 1454         # max_fragment = данные(1500) - UDP заголовок(8) - IP заголовок(20) - новый заголовок(18) = 1454
+FRAGMENT_MIN = 1            # min_fragment = данные(46) - UDP заголовок(8) - IP заголовок(20) - новый заголовок(18) = 0
+FRAGMENT_AUTO = 0           # размер фрагмента выбирается по PMTU пути (pmtu.discover)
 CRC_KEY = '1001'            # x^3 + 1
+FLAG_COMPRESSED = 0x0001    # данные фрагмента сжаты методом, согласованным при инициализации
+FLAG_RECOVERED = 0x0002     # ACK фрагмента, восстановленного сервером по четности (fec.py)
+FLAG_ACCEPT = 0x0004        # ACK инициализации в постоянной сессии: не путать с ACK фрагмента 0 (текст не ждет его)
 
 
 class MsgType(enum.Enum):
     """ Enum with constant as signal msg in protocol. """
 
-    SET = '0'       # константа для заголовка при инициализации передачи файла
-    PSH = '1'       # константа для заголовка при отправке данных файла
-    ACK = '2'       # константа для заголовка при положительном ответе
-    RST = '3'       # константа для заголовка при отрицательном ответе
+    SET = 0         # константа для заголовка при инициализации передачи файла
+    PSH = 1         # константа для заголовка при отправке данных файла
+    ACK = 2         # константа для заголовка при положительном ответе
+    RST = 3         # константа для заголовка при отрицательном ответе
+    FIN = 4         # константа для заголовка при завершении передачи
+    PRB = 5         # константа для заголовка пробы PMTU, номер фрагмента - размер датаграммы
+    PAR = 6         # константа для заголовка фрагмента четности (fec.py), номер фрагмента - номер группы
+    SIG = 7         # константа для заголовка запроса и ответа с сигнатурами блоков (delta.py), номер - номер части
 
-    SET_MSG = '8'   # константа для заголовка при инициализации передачи сообщения
+    SET_MSG = 8     # константа для заголовка при инициализации передачи сообщения
+    DIG = 9         # константа для заголовка хешей диапазонов (integrity.py), номер - номер первого диапазона
+    KAP = 10        # константа для заголовка открытия и проверки постоянной сессии (connection.py)
 
 
 class MsgReply(enum.Enum):
     """ Перечисление констант  для взаимодействия клиент-сервер """
 
-    SET = 'Успешная инициализация передачи'  
-    ACK = 'Сообщение получено!'       
-    RST = 'Сообщение повреждено'           
-    KAP = 'Подключено'                   
-
-
-def zero_fill(data):
-    """ Заполнение фрагмента нулями, если он меньше длины по умолчанию(4).
-
-     data: Данные, которые нужно заполнить нулями. """
-
-    if DEFAULT_FRAGMENT_LEN == len(data):
-        return data
-    count = DEFAULT_FRAGMENT_LEN - len(data) - 1
-    new_data = b'0'
-    while count > 0:
-        new_data += b'0'
-        count -= 1
-    new_data += data
-    return new_data
-
+    SET = 'Успешная инициализация передачи'
+    ACK = 'Сообщение получено!'
+    RST = 'Сообщение повреждено'
+    KAP = 'Подключено'
 
-def xor(a, b):
-    """ Логический метод XOR для CRC. Возвращает строку битов.
-    a XOR b
 
-    a: Номер бита для XOR.
-    b: Номер бита для XOR. """
+def set_checksum_mode(mode):
+    """ Выбор алгоритма контрольной суммы, одинаково на клиенте и сервере до начала передачи.
+    Режим 'legacy' дает ту же цифровую сумму, что и старые версии протокола.
 
-    result = []                                            # список результатов
-    for i in range(1, len(b)):                             # проходим по всем битам
-        if a[i] == b[i]:                                   # если одинаковые - XOR 0
-            result.append('0')
-            continue
-        result.append('1')                                 # если разные - XOR 1
-    return ''.join(result)
+    mode: 'crc32', 'crc32c' или 'legacy'. """
 
+    global CHECKSUM_MODE
+    if mode not in checksum.MODES:
+        raise ValueError(f'Неизвестный режим контрольной суммы: {mode}')
+    CHECKSUM_MODE = mode
 
-def sum_checksum(checksum):
-    """ Подсчитывает биты заданной контрольной суммы. Возвращает строку.
 
-    checksum: Вычисляется контрольная сумма для суммирования всех битов. """
+def set_crc(header, data):
+    """ Получает контрольную сумму в текущем режиме CHECKSUM_MODE. Возвращает int для 32-битного поля заголовка.
+    CRC-32/CRC-32C покрывают заголовок без контрольной суммы и данные, режим legacy - только данные.
 
-    sum_digit = 0
-    for char in checksum:
-        if char.isdigit():
-            sum_digit += int(char)
-    return str(sum_digit)
+     header: Первые байты заголовка до поля контрольной суммы.
+     data: Данные для CRC (bytes, bytearray или memoryview). """
 
-
-def set_crc(data):
-    """ Получает контрольную сумму на основе CRC. Возвращает сводку всех битов контрольной суммы в виде строки.
-
-     data: Данные для CRC. """
-
-    crc_key_len = len(CRC_KEY)
-    bin_data = (''.join(format(ord(char), 'b') for char in str(data))) + ('0' * (crc_key_len - 1))
-    checksum = bin_data[:crc_key_len]
-    while crc_key_len < len(bin_data):
-        if checksum[0] == '1':
-            checksum = xor(CRC_KEY, checksum) + bin_data[crc_key_len]
-        else:
-            checksum = xor('0' * crc_key_len, checksum) + bin_data[crc_key_len]
-        crc_key_len += 1
-    if checksum[0] == '1':
-        checksum = xor(CRC_KEY, checksum)
-    else:
-        checksum = xor('0' * crc_key_len, checksum)
-    return sum_checksum(checksum)
+    if CHECKSUM_MODE == 'legacy':
+        return checksum.legacy(data)
+    return checksum.checksum(data, CHECKSUM_MODE, checksum.checksum(header, CHECKSUM_MODE))
 
 
 def check_crc(data):
@@ -100,77 +79,100 @@ def check_crc(data):
     корректны, в противном случае возвращает отрицательное подтверждение.
 
     data: Данные содержат заголовок протокола с информацией о первоначально вычисленной контрольной сумме. Вычисляется контрольная сумма для
-    полученных данных и сравнивается с оригинальной контрольной суммой. """
+    полученных данных и сравнивается с оригинальной контрольной суммой. Проверяются также версия и длина данных. """
 
-    if data[5:6].decode('utf-8') != set_crc(data[6:]):
+    if len(data) < HEADER_SIZE:
+        return MsgType.RST
+    version, _, _, _, _, length, crc = HEADER.unpack_from(data)
+    view = memoryview(data)
+    if version != VERSION or length != len(data) - HEADER_SIZE \
+            or crc != set_crc(view[:HEADER_PREFIX.size], view[HEADER_SIZE:]):
         return MsgType.RST
     return MsgType.ACK
 
 
-def get_fragment_size(data):
-    """ Получение размера фрагмента из заголовка протокола. Возвращает размер фрагмента в виде int.
+def parse_header(data):
+    """ Разбор заголовка протокола. Возвращает кортеж (версия, тип, флаги, сессия, номер, длина, контрольная сумма).
+
+    data: полученные данные с заголовком протокола. """
+    return HEADER.unpack_from(data)
+
 
-    data: содержит заголовок протокола с информацией о размере фрагмента, введенном пользователем. """
-    return int(data[1:5].decode('utf-8'))
+def get_seq(data):
+    """ Получение номера фрагмента из заголовка протокола. Возвращает номер в виде int.
 
+    data: содержит заголовок протокола с номером фрагмента. """
+    return HEADER.unpack_from(data)[4]
 
-def get_file_name(data, fragment_count):
-    """ Получение имени файла из заголовка протокола. Возвращает имя файла в виде строки.
 
-    data: содержит данные из инициализации передачи с информацией о имени файла, введенном пользователем. """
-    return data[6:-len(fragment_count)].decode('utf-8')
+def get_session(data):
+    """ Получение идентификатора сессии из заголовка протокола. Возвращает int.
+
+    data: содержит заголовок протокола. """
+    return HEADER.unpack_from(data)[3]
 
 
 def get_data(data):
     """ Получение данных без заголовка протокола. Возвращает полученные данные в виде байтов.
  """
-    return data[6:]
-
+    return data[HEADER_SIZE:]
 
-def get_fragment_count(data, msg_type=None):
-    """ Получение количества фрагментов из данных. Возвращает количество фрагментов в виде строки.
-    Для текстовой передачи сообщения просто возвращает данные с индекса 7(6-битный заголовок + 1-битные данные).
-    Для передачи файлов возвращает последнее число из данных, потому что данные также содержат имя файла, возможно, данные могут быть
-    name1.pdf720, где последнее число 720 - это количество фрагментов.
 
-    data:  полученные данные с заголовком протокола. """
+def get_flags(data):
+    """ Получение битовых флагов сообщения из заголовка протокола. Возвращает int.
 
-    if msg_type == MsgType.SET_MSG.value:
-        return data.decode('utf-8')[7:]
-    return re.compile(r'\d+').findall(data.decode('utf-8'))[-1:][0]     # получение последнего числа из имени файла
+    data: содержит заголовок протокола. """
+    return HEADER.unpack_from(data)[2]
 
 
 def get_msg_type(data):
-    """ Получение типа сигнального сообщения.
+    """ Получение типа сигнального сообщения. Возвращает значение MsgType в виде int.
 
     data:  полученные данные с заголовком протокола. """
-    return data[:1]
+    return data[1]
 
 
-def add_header(msg_type, fragment_size, data):
-    """ Добавление заголовка протокола к данным. Возвращает новые данные с заголовком протокола в виде байтов.
+def get_params(data):
+    """ Получение параметров инициализации передачи (имя файла, количество и размер фрагментов и т.д.).
+    Возвращает словарь.
+
+    data: полученные данные с заголовком протокола. """
+    return json.loads(bytes(data[HEADER_SIZE:]).decode('utf-8'))
+
+
+def make_header(msg_type, data=b'', seq=0, session=0, flags=0):
+    """ Создание заголовка протокола для данных без их копирования. Возвращает заголовок в виде байтов.
 
     msg_type: Тип сообщения в виде MsgType.
-    fragment_size:  размер фрагмента данных. Введен пользователем.
-    data:  полученные данные без заголовка протокола. """
+    data:  данные без заголовка протокола (bytes или memoryview).
+    seq: номер фрагмента, для ACK/RST - номер подтверждаемого фрагмента.
+    session: идентификатор сессии передачи.
+    flags: битовые флаги сообщения. """
+
+    prefix = HEADER_PREFIX.pack(VERSION, msg_type.value, flags, session, seq, len(data))
+    return prefix + CHECKSUM_FIELD.pack(set_crc(prefix, data))
+
+
+def add_header(msg_type, data=b'', seq=0, session=0, flags=0):
+    """ Добавление заголовка протокола к данным. Возвращает новые данные с заголовком протокола в виде байтов.
+    Параметры как у make_header. """
+    return make_header(msg_type, data, seq, session, flags) + data
+
+
+def probe_reply(data):
+    """ Ответ на пробу PMTU: короткое подтверждение с тем же номером. Возвращает None для поврежденной пробы.
 
-    fragment_size_bytes = zero_fill(bytes(str(fragment_size), 'utf-8'))
-    new_data = bytes(msg_type.value, 'utf-8') + fragment_size_bytes
-    checksum = set_crc(data)
-    new_data += bytes(checksum, 'utf-8') + data
-    return new_data
+    data: полученная проба с заголовком протокола. """
 
+    if check_crc(data) != MsgType.ACK:
+        return None
+    return add_header(MsgType.ACK, b'', get_seq(data), get_session(data))
 
-def msg_initialization(fragment_size, data):
-    """ Добавлеяет заголовок протокола к данным для инициализации.
 
-    fragment_size: размер фрагмента данных. Введен пользователем.
-    data: полученные данные без заголовка протокола. """
+def msg_initialization(msg_type, params, session):
+    """ Создает сообщение инициализации передачи с параметрами в формате JSON.
 
-    new_data = bytes(MsgType.SET.value, 'utf-8') if data[:1] != bytes(MsgType.SET_MSG.value, 'utf-8') else \
-        bytes(MsgType.SET_MSG.value, 'utf-8')                               # тип сообщения
-    fragment_size_bytes = zero_fill(bytes(str(fragment_size), 'utf-8'))     # заполнение нулями до 4 байт
-    checksum = set_crc(data)                                                # получение контрольной суммы
-    new_data += fragment_size_bytes + bytes(checksum, 'utf-8')              # добавление размера фрагмента и контрольной суммы
-    new_data += data                                                        # добавление данных
-    return new_data                                                         # возвращение заголовка + данных как новых данных
\ No newline at end of file
+    msg_type: MsgType.SET для файла или MsgType.SET_MSG для текста.
+    params: словарь параметров передачи.
+    session: идентификатор сессии передачи. """
+    return add_header(msg_type, bytes(json.dumps(params), 'utf-8'), 0, session)
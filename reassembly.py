@@ -0,0 +1,146 @@
+import os
+
+
+class FragmentBitmap:
+    """ Битовая карта принятых фрагментов: один бит на фрагмент. """
+
+    def __init__(self, count):
+        """ count: Общее количество фрагментов. """
+        self.count = count
+        self.received = 0
+        self.bits = bytearray((count + 7) // 8)
+
+    def __contains__(self, seq):
+        return bool(self.bits[seq >> 3] & (1 << (seq & 7)))
+
+    def add(self, seq):
+        """ Отмечает фрагмент как принятый. Возвращает False для дубликата.
+
+        seq: Номер фрагмента. """
+
+        mask = 1 << (seq & 7)
+        if self.bits[seq >> 3] & mask:
+            return False
+        self.bits[seq >> 3] |= mask
+        self.received += 1
+        return True
+
+    def discard_range(self, start, end):
+        """ Снимает отметку с фрагментов с start по end (не включая): они будут приняты заново.
+
+        start: Номер первого фрагмента.
+        end: Номер после последнего фрагмента. """
+
+        for seq in range(start, min(end, self.count)):
+            mask = 1 << (seq & 7)
+            if self.bits[seq >> 3] & mask:
+                self.bits[seq >> 3] &= ~mask
+                self.received -= 1
+
+    def complete(self):
+        """ Все ли фрагменты приняты. """
+        return self.received == self.count
+
+    def add_range(self, start, end):
+        """ Отмечает принятыми фрагменты с start по end (не включая).
+
+        start: Номер первого фрагмента.
+        end: Номер после последнего фрагмента. """
+
+        for seq in range(start, min(end, self.count)):
+            self.add(seq)
+
+    def ranges(self):
+        """ Принятые фрагменты в виде списка диапазонов (начало, конец), конец не включается. """
+
+        ranges = []
+        start = 0
+        for gap_start, gap_end in self.missing() + [(self.count, self.count)]:
+            if gap_start > start:
+                ranges.append((start, gap_start))
+            start = gap_end
+        return ranges
+
+    def missing(self):
+        """ Пропущенные фрагменты в виде списка диапазонов (начало, конец), конец не включается. """
+
+        ranges = []
+        seq = 0
+        while seq < self.count:
+            index = seq >> 3
+            if not seq & 7 and self.bits[index] == 0xFF:        # целый байт принят - пропуск 8 фрагментов
+                seq += 8
+                continue
+            if seq in self:
+                seq += 1
+                continue
+            start = seq
+            while seq < self.count and seq not in self:
+                seq += 1
+            ranges.append((start, seq))
+        return ranges
+
+
+class FileAssembler:
+    """ Сборка файла по смещениям: файл заранее выделяется, каждый фрагмент пишется на позицию
+    seq * payload_size. Принятые фрагменты отмечаются в bitmap вызывающей стороной. """
+
+    def __init__(self, path, count, payload_size, size=None, resume=False):
+        """ path: Путь к создаваемому файлу.
+        count: Общее количество фрагментов.
+        payload_size: Размер данных одного фрагмента (последний может быть меньше).
+        size: Точный размер файла, если известен.
+        resume: Дописывать существующий файл, не стирая уже принятые данные. """
+
+        self.path = path
+        self.payload_size = payload_size
+        self.bitmap = FragmentBitmap(count)
+        self.size = count * payload_size if size is None else size      # уточняется по последнему фрагменту
+        self.file = open(path, 'rb+' if resume else 'wb+')
+        self.fd = self.file.fileno()
+        try:
+            os.posix_fallocate(self.fd, 0, self.size)
+        except (AttributeError, OSError):                       # нет posix_fallocate или ФС не поддерживает
+            self.file.truncate(self.size)
+
+    def write(self, seq, data):
+        """ Записывает фрагмент на его место в файле.
+
+        seq: Номер фрагмента.
+        data: Данные фрагмента без заголовка. """
+
+        offset = seq * self.payload_size
+        if seq == self.bitmap.count - 1:
+            self.size = offset + len(data)
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self.fd, data, offset)
+        else:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def read(self, offset, length):
+        """ Читает уже записанные данные файла (для проверки хеша диапазона). """
+
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, length, offset)
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def sync(self):
+        """ Сбрасывает записанные данные на диск, чтобы сохраненный после этого манифест им соответствовал. """
+        if hasattr(os, 'fdatasync'):
+            os.fdatasync(self.fd)
+        else:
+            os.fsync(self.fd)
+
+    def close(self):
+        """ Обрезает файл до фактического размера и закрывает его. """
+
+        self.file.truncate(self.size)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
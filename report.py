@@ -0,0 +1,96 @@
+import argparse
+import json
+import sys
+
+FORMAT_VERSION = 1          # версия формата JSON отчета о передаче
+STEP = 0.1                  # ширина интервала графика, секунды
+
+
+def save(path, file_name, payload_size, status_log, timeline):
+    """ Сохраняет данные передачи для графиков в JSON (без matplotlib, дешево для клиента).
+
+    path: Файл отчета.
+    file_name: Имя переданного файла.
+    payload_size: Размер данных фрагмента.
+    status_log: Исходы отправок из client.send_fragments: 1 - подтверждение, 0 - повторная передача.
+    timeline: Моменты событий status_log в секундах от начала передачи. """
+
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump({'format': FORMAT_VERSION, 'file': file_name, 'fragment': payload_size,
+                   'events': [[round(moment, 6), status] for moment, status in zip(timeline, status_log)]}, file)
+
+
+def load(path):
+    """ Отчет, сохраненный save. """
+
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def series(data, step=STEP):
+    """ Ряды для графиков по интервалам step секунд. Возвращает (начала интервалов, МБ/с подтвержденных
+    данных, повторные передачи за интервал).
+
+    data: Отчет (load).
+    step: Ширина интервала, секунды. """
+
+    events = data['events']
+    count = int(events[-1][0] // step) + 1 if events else 0
+    acked, retransmits = [0] * count, [0] * count
+    for moment, status in events:
+        if status:
+            acked[int(moment // step)] += 1
+        else:
+            retransmits[int(moment // step)] += 1
+    return ([index * step for index in range(count)],
+            [fragments * data['fragment'] / step / 1e6 for fragments in acked], retransmits)
+
+
+def render(data, output=None, step=STEP):
+    """ График скорости и повторных передач. matplotlib загружается только здесь; если его нет - RuntimeError.
+
+    data: Отчет (load).
+    output: Файл изображения; None - показать окно.
+    step: Ширина интервала, секунды. """
+
+    try:
+        import matplotlib
+        if output is not None:
+            matplotlib.use('Agg')                           # без окна, можно из cron
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise RuntimeError('Для графиков нужен matplotlib: pip install matplotlib') from None
+    times, throughput, retransmits = series(data, step)
+    figure, (top, bottom) = plt.subplots(2, 1, sharex=True, figsize=(10, 6))
+    figure.suptitle(data.get('file', ''))
+    top.plot(times, throughput)
+    top.set_ylabel('МБ/с')
+    top.grid(True)
+    bottom.bar(times, retransmits, width=step, align='edge', color='tab:red')
+    bottom.set_ylabel('Повторные передачи')
+    bottom.set_xlabel('Время, с')
+    bottom.grid(True)
+    if output is None:
+        plt.show()
+    else:
+        figure.savefig(output)
+    plt.close(figure)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Графики передачи по отчету клиента (нужен matplotlib)')
+    parser.add_argument('report', help='отчет JSON, сохраненный клиентом')
+    parser.add_argument('--output', '-o', help='файл изображения, по умолчанию - окно')
+    parser.add_argument('--step', type=float, default=STEP, help='ширина интервала, секунды')
+    args = parser.parse_args(argv)
+
+    try:
+        render(load(args.report), args.output, args.step)
+    except (OSError, ValueError, KeyError, RuntimeError) as error:
+        print('Ошибка:', error)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
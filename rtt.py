@@ -0,0 +1,56 @@
+import time
+
+INITIAL_RTO = 1.0           # таймаут до первого измерения RTT, секунды
+MIN_RTO = 0.02              # нижняя граница таймаута повторной передачи
+MAX_RTO = 10.0              # верхняя граница таймаута после экспоненциального увеличения
+CLOCK_GRANULARITY = 0.001   # точность таймера
+ALPHA = 1 / 8               # вес нового измерения в сглаженном RTT (RFC 6298)
+BETA = 1 / 4                # вес нового измерения в разбросе RTT
+K = 4                       # множитель разброса в таймауте
+MIN_IDLE = 1.0              # границы времени тишины, после которого собеседник считается пропавшим
+MAX_IDLE = 30.0
+LINGER_RTO = 4              # сколько таймаутов сторона еще отвечает на повторы после завершения передачи
+
+
+class RttEstimator:
+    """ Оценка времени кругового обхода и таймаута повторной передачи по RFC 6298: сглаженный RTT, его разброс
+    и экспоненциальное увеличение таймаута при потерях. По правилу Карна измерения берутся только
+    для фрагментов, которые не передавались повторно, - это обязанность вызывающей стороны. """
+
+    def __init__(self, rto=INITIAL_RTO):
+        """ rto: Начальный таймаут повторной передачи в секундах. """
+        self.srtt = None
+        self.rttvar = None
+        self.rto = rto
+
+    def update(self, sample):
+        """ Учитывает новое измерение RTT и пересчитывает таймаут.
+
+        sample: Время от отправки до подтверждения в секундах. """
+
+        if self.srtt is None:
+            self.srtt = sample
+            self.rttvar = sample / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - sample)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * sample
+        self.rto = min(MAX_RTO, max(MIN_RTO, self.srtt + max(CLOCK_GRANULARITY, K * self.rttvar)))
+
+    def sample(self, sent_time):
+        """ Учитывает измерение от момента отправки sent_time (по time.monotonic) до текущего момента. """
+        self.update(time.monotonic() - sent_time)
+
+    def backoff(self):
+        """ Удваивает таймаут после срабатывания таймера повторной передачи. """
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+    def idle_timeout(self, retries):
+        """ Время тишины, после которого собеседник считается пропавшим: столько, сколько длятся
+        retries повторов с текущим таймаутом и его удвоением, в границах MIN_IDLE..MAX_IDLE.
+
+        retries: Количество повторов, которое делает собеседник до разрыва. """
+        return min(MAX_IDLE, max(MIN_IDLE, sum(min(self.rto * 2 ** i, MAX_RTO) for i in range(retries + 1))))
+
+    def linger(self):
+        """ Сколько после завершения передачи отвечать на повторы собеседника, не получившего ответ. """
+        return self.rto * LINGER_RTO
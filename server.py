@@ -1,145 +1,269 @@
-
-
 import client
+import aioserver
+import buffers
+import connection
+import delta
+import manifest
+import messages
 import protocol
+import transfer
 import socket
 import sys
 import os
 import select
+import time
 import logging
-from datetime import datetime
-
 
-log_filename = f"transfer_{datetime.now().strftime('%Y%m%d_%H%M')}.log"
-logging.basicConfig(
-    filename=log_filename,
-    filemode='w',
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s'
-)
 
-
-
-def write_msg(server_socket, fragment_size, fragment_no):
-    """ Выводит полученное текстовое сообщение в консоль.
+def receive_fragments(server_socket, incoming, pool, texts=None):
+    """ Прием пронумерованных фрагментов в любом порядке до FIN клиента или, если клиент пропал,
+    до тишины дольше таймаута по оценке RTT. После FIN сервер еще недолго отвечает на повторы FIN,
+    пока тот же клиент не начнет следующую передачу (ее датаграмма остается в сокете для initialization).
+    Каждый корректный фрагмент подтверждается (повторный - тоже, так как мог потеряться ACK),
+    но сохраняется только один раз. Фрагменты, восстановленные по четности, подтверждаются и сохраняются так же.
+    Датаграммы чужих сессий отбрасываются без ответа, кроме SET того же файла (supersedes).
+    Запись синхронная, поэтому все датаграммы читаются в один буфер из пула. Датаграмма читается целиком:
+    повтор инициализации длиннее фрагмента, а слишком длинный фрагмент отвергает transfer.Transfer.
 
     server_socket: Серверный сокет содержит адрес источника и метод sendto.
-    fragment_size: Максимальный размер полученного фрагмента данных. Вводится пользователем.
-    fragment_no: Общее количество фрагментов. """
+    incoming: transfer.Transfer текущей передачи.
+    pool: buffers.BufferPool буферов приема.
+    texts: Список, в который добавляются части текста по порядку (передача текста). """
 
-    fragment_count = 0
-    while True:
-        ready = select.select([server_socket], [], [], 3)
-        if ready[0]:
-            message, client_address = server_socket.recvfrom(protocol.DEFAULT_BUFF)
-            reply_crc = protocol.check_crc(message)
-            reply = protocol.add_header(reply_crc, fragment_size, b'')
-            server_socket.sendto(reply, client_address)
-            if reply_crc.value != protocol.MsgType.ACK.value:                       # ARQ Stop & Wait
+    buffer = pool.acquire()
+    view = memoryview(buffer)
+    linger_end = None
+    try:
+        while True:
+            if linger_end is None:                                      # тишина - по датаграммам этой сессии
+                timeout = incoming.idle_timeout() - (time.monotonic() - incoming.last_activity)
+            else:
+                timeout = linger_end - time.monotonic()
+            ready = select.select([server_socket], [], [], max(timeout, 0))
+            if not ready[0]:
+                break
+            if linger_end is not None:                                  # FIN уже получен
+                nbytes, client_address = server_socket.recvfrom_into(buffer, len(buffer), socket.MSG_PEEK)
+                if nbytes >= protocol.HEADER_SIZE and protocol.get_session(view[:nbytes]) != incoming.session \
+                        and client_address == finished_address:         # клиент получил FIN и начал новую передачу
+                    break
+            nbytes, client_address = server_socket.recvfrom_into(buffer)
+            data = view[:nbytes]
+            if nbytes < protocol.HEADER_SIZE:
                 continue
-            message = protocol.get_data(message)
-            print(message.decode('utf-8'), end='')
-            fragment_count += 1
-        else:
-            break
-    print('\nПолученные фрагменты:', fragment_count, ' учтенные фрагменты:', fragment_no, '\n')
+            if protocol.get_session(data) != incoming.session:
+                if supersedes(incoming, data):                          # клиент перезапущен и продолжает файл
+                    print('Передача продолжена в новой сессии')
+                    break                                               # SET придет снова, уже в initialization
+                continue
+            for reply, seq, payload in [incoming.handle(data)] + incoming.take_rebuilt():
+                if reply is not None:
+                    server_socket.sendto(reply, client_address)
+                if payload is not None:
+                    text = incoming.store(seq, payload)
+                    incoming.checkpoint()                               # манифест для продолжения передачи
+                    if text and texts is not None:
+                        texts.append(text)
+            if incoming.finished and linger_end is None:
+                linger_end = time.monotonic() + incoming.rtt.linger()
+                finished_address = client_address
+    finally:
+        pool.release(buffer)
+
+
+def supersedes(incoming, data):
+    """ Начинает ли датаграмма другой сессии передачу того же недополученного файла: клиент перезапущен
+    и продолжает его раньше, чем прежняя передача закончилась по тишине. Тогда прежняя передача прерывается
+    с сохранением манифеста, и новая продолжает ее.
+
+    incoming: transfer.Transfer текущей передачи.
+    data: Датаграмма другой сессии. """
+
+    if not incoming.resumable or protocol.get_msg_type(data) != protocol.MsgType.SET.value \
+            or protocol.check_crc(data) != protocol.MsgType.ACK:
+        return False
+    try:
+        params = protocol.get_params(data)
+    except ValueError:
+        return False
+    if not isinstance(params, dict) or not manifest.resumable(params):
+        return False
+    path = os.path.join(os.path.dirname(incoming.path), os.path.basename(params.get('name', '')))
+    return manifest.part_path(path, params) == incoming.part_path
 
-def resolve_filename_collision(path):
-    """Автоматически добавляет (1), (2), ... если файл с таким именем уже существует."""
-    if not os.path.exists(path):
-        return path
 
-    base, ext = os.path.splitext(path)
-    counter = 1
-    new_path = f"{base}({counter}){ext}"
-    while os.path.exists(new_path):
-        counter += 1
-        new_path = f"{base}({counter}){ext}"
-    return new_path
+def write_msg(server_socket, client_address, fragment_size, fragment_no, session, pool, connection_id=None,
+              on_message=None):
+    """ Принимает текстовое сообщение и передает его целиком обработчику (по умолчанию - вывод в консоль).
 
+    server_socket: Серверный сокет содержит адрес источника и метод sendto.
+    client_address: Адрес клиента для подтверждения инициализации.
+    fragment_size: Максимальный размер полученного фрагмента данных. Вводится пользователем.
+    fragment_no: Общее количество фрагментов.
+    session: Идентификатор сессии передачи.
+    pool: buffers.BufferPool буферов приема.
+    connection_id: Идентификатор постоянной сессии клиента (параметр connection) или None.
+    on_message: Обработчик (адрес, текст) или None для вывода в консоль. """
+
+    message = transfer.Transfer(session, protocol.MsgType.SET_MSG.value,
+                                {'count': fragment_no, 'fragment': fragment_size - protocol.HEADER_SIZE,
+                                 'connection': connection_id})
+    server_socket.sendto(message.accept_reply, client_address)
+    texts = []
+    try:
+        receive_fragments(server_socket, message, pool, texts)
+    finally:
+        message.close()
+    messages.deliver(on_message, client_address, ''.join(texts))
+    print('\nПолученные фрагменты:', message.bitmap.received, ' учтенные фрагменты:', fragment_no, '\n')
 
-def write_file(path, server_socket, fragment_size, fragment_no):
-    """ Запись полученного файла в указанную директорию.
-    Возвращает количество полученных фрагментов и общее количество фрагментов.
+
+def write_file(path, server_socket, client_address, params, session, pool, content_store=None):
+    """ Запись полученного файла в указанную директорию. Фрагменты пишутся по смещению
+    seq * payload_size в заранее выделенный файл, поэтому порядок прихода не важен.
+    Прерванная передача того же файла продолжается: клиенту в ответ на инициализацию
+    сообщаются уже принятые диапазоны. Возвращает transfer.Transfer завершенной передачи
+    или None, если передача не начата.
 
     server_socket: Сокет сервера содержит адрес источника и sendto метод.
+    client_address: Адрес клиента для подтверждения инициализации.
     path: Информация, где хранить полученный файл.
-    fragment_size: Максимальный размер полученного фрагмента данных. Вводится пользователем.
-    fragment_no: Общее количество фрагментов. """
+    params: Параметры из сообщения инициализации.
+    session: Идентификатор сессии передачи.
+    pool: buffers.BufferPool буферов приема.
+    content_store: store.ContentStore для приема по содержимому или None. """
 
-    fragment_count = 0
-    with open(path, 'wb+') as file:
-        while True:
-            ready = select.select([server_socket], [], [], 3)
-            if ready[0]:
-                data, client_address = server_socket.recvfrom(fragment_size)
-                reply_crc = protocol.check_crc(data)
-                reply = protocol.add_header(reply_crc, fragment_size, b'')
-                server_socket.sendto(reply, client_address)
-
-                if reply_crc.value != protocol.MsgType.ACK.value:
-                    continue
-                data = protocol.get_data(data)
-                fragment_count += 1
-                file.write(data)
-                logging.info(f"Получен фрагмент {fragment_count}/{fragment_no}")
-            else:
-                break
+    reply = content_store.claim(params, path, session) if content_store is not None else None
+    if reply is not None:                                           # содержимое уже есть, передача не нужна
+        server_socket.sendto(reply, client_address)
+        print('Файл уже есть в хранилище:', os.path.abspath(path))
+        logging.info(f"Файл уже есть в хранилище: {os.path.abspath(path)}")
+        return None
+    try:
+        file = transfer.Transfer(session, protocol.MsgType.SET.value, params, path, content_store)
+    except ValueError as error:                                     # дельта к изменившейся прежней версии
+        print(error)
+        server_socket.sendto(protocol.add_header(protocol.MsgType.RST, b'', 0, session), client_address)
+        return None
+    server_socket.sendto(file.accept_reply, client_address)
+    if file.resumed:
+        print('Продолжение передачи, уже получено фрагментов:', file.resumed)
+    try:
+        receive_fragments(server_socket, file, pool)
+    finally:
+        file.close()
 
-    print('\nПолученные фрагменты:', fragment_count, ' учтенные фрагменты:', fragment_no, '\n')
+    print('\nПолученные фрагменты:', file.bitmap.received, ' учтенные фрагменты:', file.count, '\n')
+    missing = file.bitmap.missing()
+    if missing:
+        print('Пропущенные фрагменты:', ', '.join(f'{start}-{end - 1}' for start, end in missing))
+    return file
 
 
-def initialization(server_socket):
+def initialization(server_socket, pool, dir_path='', connections=None):
     """ Получение инициализационного сообщения. Возвращает полученные данные, адрес клиента, размер фрагмента,
-    количество фрагментов и имя файла для приёма передаваемых данных.
+    количество фрагментов и имя файла для приёма передаваемых данных. Поврежденное сообщение получает RST,
+    подтверждение корректного отправляет write_file или write_msg.
 
-    server_socket: Серверный сокет, содержащий адрес источника и метод sendto. """
+    server_socket: Серверный сокет, содержащий адрес источника и метод sendto.
+    pool: buffers.BufferPool буферов приема.
+    dir_path: Директория сохранения файлов, в ней ищутся прежние версии для запросов сигнатур.
+    connections: connection.ConnectionTable постоянных сессий клиентов или None, если они не поддерживаются. """
 
-    while True:
-        ready = select.select([server_socket], [], [], 20)
-        if ready[0]:
-            data, client_address = server_socket.recvfrom(protocol.DEFAULT_BUFF)
-        else:
-            return None
-        reply_crc = protocol.check_crc(data)
-        reply = protocol.add_header(reply_crc, 0, b'')
-        server_socket.sendto(reply, client_address)
-        if reply_crc.value == protocol.MsgType.ACK.value:
-            fragment_size = protocol.get_fragment_size(data) + len(data)
-
-            if data.decode('utf-8')[:1] == protocol.MsgType.SET_MSG.value:
-                fragment_count = protocol.get_fragment_count(data, protocol.MsgType.SET_MSG.value)
+    buffer = pool.acquire()
+    try:
+        while True:
+            if connections is not None:
+                connections.expire()
+            ready = select.select([server_socket], [], [], protocol.LISTEN_TIMEOUT)
+            if ready[0]:
+                nbytes, client_address = server_socket.recvfrom_into(buffer)
+                data = memoryview(buffer)[:nbytes]
             else:
-                fragment_count = protocol.get_fragment_count(data)
-
-            file_name = protocol.get_file_name(data, fragment_count)
-            break
-    return data, client_address, fragment_size, fragment_count, file_name
-
-
-def receive(server_socket, dir_path):
+                return None
+            if len(data) < protocol.HEADER_SIZE:
+                continue
+            if protocol.get_msg_type(data) == protocol.MsgType.PRB.value:      # проба PMTU перед инициализацией
+                reply = protocol.probe_reply(data)
+                if reply is not None:
+                    server_socket.sendto(reply, client_address)
+                continue
+            if protocol.get_msg_type(data) == protocol.MsgType.SIG.value:      # сигнатуры прежней версии для дельты
+                reply = delta.signature_reply(data, dir_path)
+                if reply is not None:
+                    server_socket.sendto(reply, client_address)
+                continue
+            if connections is not None and connections.owns(data, client_address):    # открытие, пробы, сообщения и закрытие сессии
+                reply = connections.handle(data, client_address)
+                if reply is not None:
+                    server_socket.sendto(reply, client_address)
+                continue
+            if protocol.get_msg_type(data) not in (protocol.MsgType.SET.value, protocol.MsgType.SET_MSG.value):
+                continue                                                # опоздавшие фрагменты прошлой передачи
+            if protocol.check_crc(data) == protocol.MsgType.ACK:   # ACK отправит transfer.Transfer
+                try:
+                    params = protocol.get_params(data)
+                    fragment_size = params['fragment'] + protocol.HEADER_SIZE
+                    fragment_count = params['count']
+                    file_name = os.path.basename(params.get('name', ''))   # без каталогов клиента
+                    break
+                except (ValueError, KeyError):                          # повреждение, не замеченное режимом legacy
+                    pass
+            server_socket.sendto(protocol.add_header(protocol.MsgType.RST, b'', 0, protocol.get_session(data)),
+                                 client_address)
+        return bytes(data), client_address, fragment_size, fragment_count, file_name    # буфер вернется в пул
+    finally:
+        pool.release(buffer)
+
+
+def receive(server_socket, dir_path, pool=None, content_store=None, connections=None, on_message=None):
     """ Получает данные от клиента и решает, основываясь на заголовке протокола,
-      является ли это передача текстовых данных или файловых """
+      является ли это передача текстовых данных или файловых
+
+      pool: buffers.BufferPool буферов приема, по умолчанию пул из одного буфера.
+      content_store: store.ContentStore для приема по содержимому или None.
+      connections: connection.ConnectionTable постоянных сессий, общая для последовательных вызовов, или None.
+        Сообщения постоянных сессий передаются ее обработчику.
+      on_message: Обработчик текста (адрес, текст) или None для вывода в консоль. """
 
+    pool = pool or buffers.BufferPool(1)
     print('Сервер ожидает!')
     try:
-        data, client_address, fragment_size, fragment_count, file_name = initialization(server_socket)
+        data, client_address, fragment_size, fragment_count, file_name = initialization(server_socket, pool, dir_path,
+                                                                                        connections)
     except TypeError:
         print('Timeout')
         return
 
-    if protocol.get_msg_type(data).decode('utf-8') == protocol.MsgType.SET.value:
-        save_path = resolve_filename_collision(dir_path + file_name)
-        write_file(save_path, server_socket, fragment_size, fragment_count)
-        server_socket.sendto(bytes(protocol.MsgType.ACK.value, 'utf-8'), client_address)
-        print('Передача прошла успешно, файл находится', os.path.abspath(save_path), '\n')
-        logging.info(f"Файл сохранен как: {os.path.abspath(save_path)}")
-        logging.info(f"Получен файл: {file_name}")
-        logging.info(f"Сохранено в: {os.path.abspath(dir_path + file_name)}")
-        logging.info(f"Ожидаемые фрагменты: {fragment_count}")
+    session = protocol.get_session(data)
+    params = protocol.get_params(data)
+    try:
+        if protocol.get_msg_type(data) == protocol.MsgType.SET.value:
+            file = write_file(dir_path + file_name, server_socket, client_address, params, session, pool,
+                              content_store)
+            if file is None:
+                return
+            if not file.complete():
+                print('Передача прервана, при повторной отправке файла она продолжится\n')
+                logging.info(f"Передача прервана: {file_name}, получено {file.bitmap.received}/{fragment_count}")
+                return
+            if file.batch is not None:
+                print('Пакет распакован, файлов:', len(file.unpacked or ()), 'в', os.path.abspath(dir_path), '\n')
+                logging.info(f"Пакет {file_name}: распаковано файлов {len(file.unpacked or ())}")
+                return
+            save_path = file.path
+            print('Передача прошла успешно, файл находится', os.path.abspath(save_path), '\n')
+            logging.info(f"Файл сохранен как: {os.path.abspath(save_path)}")
+            logging.info(f"Получен файл: {file_name}")
+            logging.info(f"Сохранено в: {os.path.abspath(dir_path + file_name)}")
+            logging.info(f"Ожидаемые фрагменты: {fragment_count}")
 
-    else:
-        write_msg(server_socket, fragment_size, fragment_count)
+        else:
+            write_msg(server_socket, client_address, fragment_size, fragment_count, session, pool,
+                      params.get('connection'), on_message)
+    finally:
+        if connections is not None:                                 # передача, даже долгая, продлевает сессию
+            connections.touch(client_address, params)
 
 
 def set_server():
@@ -182,10 +306,13 @@ def user_interface():
     server_port, dir_path = set_server()
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     server_socket.bind(('', server_port))
+    connections = connection.ConnectionTable()                      # постоянные сессии живут между приемами
 
     while True:
         print('0 - выход\n'
               '1 - получение\n'
+              '2 - одновременный прием от многих клиентов\n'
+              '3 - прием без остановки (постоянные сессии клиентов)\n'
               '9 - переключиться на клиентский интерфейс\n')
         user_input = input('Введите, что вы хотите сделать: ')
         if user_input == '0':
@@ -193,7 +320,17 @@ def user_interface():
             server_socket.close()
             sys.exit(0)
         elif user_input == '1':
-            receive(server_socket, dir_path)
+            receive(server_socket, dir_path, connections=connections)
+        elif user_input == '2':
+            metrics_port = input('Порт метрик Prometheus на 127.0.0.1 (Enter - без метрик): ')
+            aioserver.run(server_socket, dir_path, metrics_port=int(metrics_port) if metrics_port.isdigit() else None)
+        elif user_input == '3':
+            print('Ctrl+C - остановка')
+            try:
+                while True:
+                    receive(server_socket, dir_path, connections=connections)
+            except KeyboardInterrupt:
+                print('Сервер остановлен')
         elif user_input == '9':
             client.user_interface()
         else:
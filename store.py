@@ -0,0 +1,112 @@
+import protocol
+import transfer
+import hashlib
+import json
+import os
+import shutil
+import string
+
+OBJECTS = '.objects'        # поддиректория хранилища в директории сервера
+DIGEST_SIZE = 32            # BLAKE2b-256, в параметре hash - шестнадцатеричная строка
+CHUNK = 1 << 20             # файл хешируется частями этого размера
+
+
+def file_hash(path):
+    """ Хеш содержимого файла (BLAKE2b-256, hex), файл читается потоком частями CHUNK. """
+
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(path, 'rb') as file:
+        for data in iter(lambda: file.read(CHUNK), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def valid(digest):
+    """ Подходит ли значение параметра hash: от клиента приходит что угодно, а хеш становится частью пути. """
+    return isinstance(digest, str) and len(digest) == DIGEST_SIZE * 2 and all(char in string.hexdigits[:16]
+                                                                              for char in digest)
+
+
+class ContentStore:
+    """ Хранилище файлов по содержимому в директории сервера: каждое содержимое хранится один раз
+    в .objects/<2 символа хеша>/<хеш>, а имя файла в директории - жесткая ссылка на объект (или копия,
+    если ссылки не поддерживаются). Наличие объекта и есть индекс: повторная передача того же содержимого
+    не нужна. Имя, занятое другим содержимым, не заменяется: файл получает имя name(1), name(2), ...,
+    как и без хранилища. """
+
+    def __init__(self, dir_path):
+        """ dir_path: Директория сервера для полученных файлов. """
+
+        self.dir_path = dir_path
+        self.root = os.path.join(dir_path, OBJECTS)
+
+    def object_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has(self, digest):
+        """ Есть ли в хранилище содержимое с хешем digest. """
+        return valid(digest) and os.path.isfile(self.object_path(digest))
+
+    def holds(self, path, digest):
+        """ Указывает ли имя path на объект digest: жесткая ссылка на него или, без ссылок,
+        копия того же содержимого. """
+
+        try:
+            if os.path.samefile(path, self.object_path(digest)):
+                return True
+            return os.path.getsize(path) == os.path.getsize(self.object_path(digest)) and file_hash(path) == digest
+        except OSError:                                         # имени нет
+            return False
+
+    def link(self, path, digest):
+        """ Связывает имя с объектом digest. Возвращает итоговый путь: path, если имя свободно или уже указывает
+        на этот объект, иначе свободное имя name(1), name(2), ... - другой файл с этим именем не заменяется.
+
+        path: Путь в директории сервера.
+        digest: Хеш объекта, который уже есть в хранилище. """
+
+        if self.holds(path, digest):
+            return path
+        path = transfer.resolve_filename_collision(path)
+        temp_path = path + '.link'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(self.object_path(digest), temp_path)
+        except OSError:                                         # файловая система без жестких ссылок
+            shutil.copyfile(self.object_path(digest), temp_path)
+        os.replace(temp_path, path)
+        return path
+
+    def put(self, source, path, digest):
+        """ Принятый файл source переносится в хранилище, если его содержимое совпадает с заявленным хешем,
+        и связывается с именем path. Возвращает итоговый путь (store.link) или None, если хеш не совпал
+        (source остается на месте).
+
+        source: Принятый файл.
+        path: Итоговый путь в директории сервера.
+        digest: Хеш, сообщенный клиентом. """
+
+        if not valid(digest) or file_hash(source) != digest:
+            return None
+        if self.has(digest):
+            os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(self.object_path(digest)), exist_ok=True)
+            os.replace(source, self.object_path(digest))
+        return self.link(path, digest)
+
+    def claim(self, params, path, session):
+        """ Ответ "уже есть" на инициализацию передачи файла, содержимое которого уже в хранилище:
+        имя (или, если оно занято другим файлом, name(1), ...) связывается с объектом, передача не нужна.
+        Возвращает ACK с {'have': true} или None.
+
+        params: Параметры из сообщения инициализации.
+        path: Путь, под которым сохранить файл.
+        session: Идентификатор сессии передачи. """
+
+        digest = params.get('hash')
+        if params.get('batch') is not None or not self.has(digest):
+            return None
+        self.link(path, digest)
+        return protocol.add_header(protocol.MsgType.ACK, json.dumps({'have': True}).encode('utf-8'), 0, session)
@@ -0,0 +1,54 @@
+import delta
+import io
+import os
+import random
+import tempfile
+import unittest
+
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir_path = directory.name
+
+    def round_trip(self, old, new):
+        """ Дельта new относительно old и сборка по ней. Возвращает (новые данные в дельте, собранный файл). """
+
+        basis_path = os.path.join(self.dir_path, 'basis')
+        with open(basis_path, 'wb') as file:
+            file.write(old)
+        size, _, block, blob = delta.signatures(basis_path)
+        out = io.BytesIO()
+        literal = delta.diff(memoryview(new), blob, block, size, out)
+        delta_path, out_path = os.path.join(self.dir_path, 'delta'), os.path.join(self.dir_path, 'new')
+        with open(delta_path, 'wb') as file:
+            file.write(out.getvalue())
+        delta.patch(basis_path, delta_path, out_path, block, len(new))
+        with open(out_path, 'rb') as file:
+            return literal, file.read()
+
+    def test_edits(self):
+        generator = random.Random(1)
+        old = generator.randbytes(200000)
+        new = old[:1000] + b'inserted' + old[1000:90000] + old[95000:150000] + generator.randbytes(3000) + old[150000:]
+        literal, result = self.round_trip(old, new)
+        self.assertEqual(result, new)
+        self.assertLess(literal, 20000)
+
+    def test_unrelated_and_empty(self):
+        generator = random.Random(2)
+        for old, new in ((generator.randbytes(5000), generator.randbytes(7000)), (b'', b'abc'),
+                         (generator.randbytes(3000), b''), (b'x' * 4096, b'x' * 4097)):
+            literal, result = self.round_trip(old, new)
+            self.assertEqual(result, new)
+
+    def test_damaged_delta(self):
+        basis_path, delta_path = os.path.join(self.dir_path, 'basis'), os.path.join(self.dir_path, 'delta')
+        with open(basis_path, 'wb') as file:
+            file.write(b'x' * 1024)
+        with open(delta_path, 'wb') as file:
+            file.write(b'C' + delta.COPY.pack(100, 1))
+        with self.assertRaises(ValueError):
+            delta.patch(basis_path, delta_path, os.path.join(self.dir_path, 'new'), 512, 512)
@@ -0,0 +1,73 @@
+import aioserver
+import client
+import impairment
+import protocol
+import server
+import asyncio
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+SIZE = 150000
+TIMEOUT = 60                # секунд на передачу, после них тест считается зависшим
+
+
+class LoopbackTest(unittest.TestCase):
+    """ Передача файла по loopback через impairment.Relay с потерями, повреждениями, перестановкой
+    и дублированием датаграмм в обе стороны: файл должен прийти без изменений. """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir_path = os.path.join(directory.name, 'server') + os.sep
+        os.mkdir(self.dir_path)
+        self.source = os.path.join(directory.name, 'source.bin')
+        with open(self.source, 'wb') as file:
+            file.write(random.Random(1).randbytes(SIZE))
+        self.server_socket = self.socket()
+
+    def socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        self.addCleanup(sock.close)
+        return sock
+
+    def send(self, **options):
+        """ Передача self.source через ретранслятор с помехами. Возвращает результат client.send_file. """
+
+        noise = impairment.Impairment(loss=0.05, corrupt=0.02, reorder=0.05, duplicate=0.02, seed=7)
+        with impairment.Relay(self.server_socket.getsockname(), noise, noise) as relay:
+            return client.send_file(relay.address[0], self.socket(), relay.address[1], 1000 + protocol.HEADER_SIZE,
+                                    self.source.encode(), **options)
+
+    def received(self):
+        with open(self.source, 'rb') as source, open(os.path.join(self.dir_path, 'source.bin'), 'rb') as file:
+            return file.read() == source.read()
+
+    def test_blocking_server(self):
+        thread = threading.Thread(target=server.receive, args=(self.server_socket, self.dir_path), daemon=True)
+        thread.start()
+        self.assertTrue(self.send())
+        thread.join(TIMEOUT)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(self.received())
+
+    def test_aio_server(self):
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(aioserver.serve(self.server_socket, self.dir_path))
+        thread = threading.Thread(target=loop.run_until_complete, args=(asyncio.wait([task]),), daemon=True)
+        thread.start()
+        try:
+            self.assertTrue(self.send(redundancy='8:1', verify=True))
+            deadline = time.monotonic() + TIMEOUT
+            while not os.path.exists(os.path.join(self.dir_path, 'source.bin')) and time.monotonic() < deadline:
+                time.sleep(0.05)                        # файл переносится из .part после FIN
+            self.assertTrue(self.received())
+        finally:
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join(TIMEOUT)
+            loop.close()
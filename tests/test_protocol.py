@@ -0,0 +1,68 @@
+import checksum
+import protocol
+import unittest
+
+
+def legacy_reference(data):
+    """ Старый protocol.set_crc: строка битов str(data) с тремя нулями, деление столбиком на CRC_KEY,
+    сумма битов остатка. """
+
+    number = int(''.join(format(ord(char), 'b') for char in str(data)) + '000', 2)
+    key = int(protocol.CRC_KEY, 2)
+    while number.bit_length() >= key.bit_length():
+        number ^= key << number.bit_length() - key.bit_length()
+    return bin(number).count('1')
+
+
+class ChecksumTest(unittest.TestCase):
+
+    def test_check_values(self):
+        self.assertEqual(checksum.checksum(b'123456789', 'crc32'), 0xCBF43926)
+        self.assertEqual(checksum.checksum(b'123456789', 'crc32c'), 0xE3069283)
+
+    def test_crc32c_continues(self):
+        self.assertEqual(checksum.crc32c(b'56789', checksum.crc32c(b'1234')), 0xE3069283)
+        self.assertEqual(checksum.crc32c(memoryview(b'123456789')), 0xE3069283)
+
+    def test_legacy_matches_long_division(self):
+        for data in (b'', b'a', b'\x00\xff', bytes(range(256)), b'hello world' * 50, bytearray(b'\x01\x02')):
+            self.assertEqual(checksum.legacy(data), legacy_reference(bytes(data)), data[:16])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            checksum.checksum(b'', 'md5')
+
+
+class HeaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(protocol.set_checksum_mode, protocol.CHECKSUM_MODE)
+
+    def test_round_trip(self):
+        for mode in checksum.MODES:
+            protocol.set_checksum_mode(mode)
+            data = protocol.add_header(protocol.MsgType.PSH, b'payload', 7, 42, protocol.FLAG_COMPRESSED)
+            self.assertEqual(protocol.check_crc(data), protocol.MsgType.ACK, mode)
+            self.assertEqual(protocol.get_msg_type(data), protocol.MsgType.PSH.value)
+            self.assertEqual(protocol.get_seq(data), 7)
+            self.assertEqual(protocol.get_session(data), 42)
+            self.assertEqual(protocol.get_flags(data), protocol.FLAG_COMPRESSED)
+            self.assertEqual(bytes(protocol.get_data(data)), b'payload')
+
+    def test_corruption_detected(self):
+        for mode in ('crc32', 'crc32c'):
+            protocol.set_checksum_mode(mode)
+            data = bytearray(protocol.add_header(protocol.MsgType.PSH, b'payload', 7, 42))
+            for index in range(len(data)):
+                damaged = bytearray(data)
+                damaged[index] ^= 0x10
+                self.assertEqual(protocol.check_crc(damaged), protocol.MsgType.RST, (mode, index))
+
+    def test_truncated(self):
+        data = protocol.add_header(protocol.MsgType.PSH, b'payload', 7, 42)
+        self.assertEqual(protocol.check_crc(data[:-1]), protocol.MsgType.RST)
+        self.assertEqual(protocol.check_crc(data[:protocol.HEADER_SIZE - 1]), protocol.MsgType.RST)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            protocol.set_checksum_mode('md5')
@@ -0,0 +1,96 @@
+import fec
+import manifest
+import reassembly
+import os
+import tempfile
+import unittest
+
+
+class FragmentBitmapTest(unittest.TestCase):
+
+    def test_add_and_ranges(self):
+        bitmap = reassembly.FragmentBitmap(20)
+        for seq in (0, 1, 2, 5, 9, 10, 19):
+            self.assertTrue(bitmap.add(seq))
+        self.assertFalse(bitmap.add(5))
+        self.assertEqual(bitmap.received, 7)
+        self.assertIn(9, bitmap)
+        self.assertNotIn(8, bitmap)
+        self.assertEqual(bitmap.ranges(), [(0, 3), (5, 6), (9, 11), (19, 20)])
+        self.assertEqual(bitmap.missing(), [(3, 5), (6, 9), (11, 19)])
+        self.assertFalse(bitmap.complete())
+
+    def test_discard_and_complete(self):
+        bitmap = reassembly.FragmentBitmap(13)
+        bitmap.add_range(0, 20)
+        self.assertTrue(bitmap.complete())
+        bitmap.discard_range(4, 8)
+        self.assertEqual(bitmap.received, 9)
+        self.assertEqual(bitmap.missing(), [(4, 8)])
+        bitmap.discard_range(4, 8)
+        self.assertEqual(bitmap.received, 9)
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.params = {'name': 'a.bin', 'size': 1000, 'mtime': 1, 'count': 10, 'fragment': 100}
+        self.path = manifest.part_path(os.path.join(directory.name, 'a.bin'), self.params)
+        open(self.path, 'wb').close()
+
+    def test_round_trip(self):
+        manifest.save(self.path, self.params, [(0, 3), (5, 10)])
+        self.assertEqual(manifest.load(self.path, self.params), [(0, 3), (5, 10)])
+        manifest.remove(self.path)
+        self.assertIsNone(manifest.load(self.path, self.params))
+
+    def test_other_version(self):
+        manifest.save(self.path, self.params, [(0, 3)])
+        changed = dict(self.params, mtime=2)
+        self.assertIsNone(manifest.load(self.path, changed))
+        self.assertNotEqual(manifest.part_path('a.bin', changed), manifest.part_path('a.bin', self.params))
+
+
+class FecTest(unittest.TestCase):
+
+    def test_recovers_one_loss_per_group(self):
+        block, parity, payload_size, size = 4, 2, 100, 950
+        data = os.urandom(size)
+        fragments = [data[offset:offset + payload_size] for offset in range(0, size, payload_size)]
+        encoder = fec.Encoder(block, parity, len(fragments))
+        parities = [item for seq, fragment in enumerate(fragments) for item in encoder.add(seq, fragment)]
+        lost = {1, 4, 7, 9}                             # по одному в группах 1, 2, 3 и 5
+        bitmap = reassembly.FragmentBitmap(len(fragments))
+        decoder = fec.Decoder(block, parity, bitmap, payload_size, size)
+        rebuilt = {}
+        for seq, fragment in enumerate(fragments):
+            if seq not in lost:
+                bitmap.add(seq)
+                self.assertIsNone(decoder.add(seq, fragment))
+        for group, value in parities:
+            item = decoder.add_parity(group, value)
+            if item is not None:
+                bitmap.add(item[0])
+                rebuilt[item[0]] = item[1]
+        self.assertEqual(rebuilt, {seq: fragments[seq] for seq in lost})
+        self.assertTrue(bitmap.complete())
+
+    def test_two_losses_in_group(self):
+        fragments = [bytes([seq]) * 10 for seq in range(4)]
+        encoder = fec.Encoder(4, 1, 4)
+        parities = [item for seq, fragment in enumerate(fragments) for item in encoder.add(seq, fragment)]
+        bitmap = reassembly.FragmentBitmap(4)
+        decoder = fec.Decoder(4, 1, bitmap, 10, 40)
+        for seq in (0, 3):
+            bitmap.add(seq)
+            decoder.add(seq, fragments[seq])
+        self.assertIsNone(decoder.add_parity(*parities[0]))
+
+    def test_parse(self):
+        self.assertEqual(fec.parse('16:2'), (16, 2))
+        self.assertEqual(fec.parse('8'), (8, fec.DEFAULT_PARITY))
+        self.assertIsNone(fec.parse(''))
+        with self.assertRaises(ValueError):
+            fec.parse('2:3')
@@ -0,0 +1,77 @@
+import manifest
+import protocol
+import store
+import transfer
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+
+PAYLOAD = 100
+
+
+class TransferTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir_path = directory.name
+        self.path = os.path.join(self.dir_path, 'a.bin')
+        self.data = os.urandom(PAYLOAD * 20 + 37)
+        self.fragments = [self.data[offset:offset + PAYLOAD] for offset in range(0, len(self.data), PAYLOAD)]
+        self.params = {'name': 'a.bin', 'count': len(self.fragments), 'fragment': PAYLOAD, 'size': len(self.data),
+                       'mtime': 1}
+
+    def send(self, incoming, seqs):
+        for seq in seqs:
+            reply, number, payload = incoming.handle(protocol.add_header(protocol.MsgType.PSH, self.fragments[seq],
+                                                                         seq, incoming.session))
+            self.assertEqual(protocol.get_msg_type(reply), protocol.MsgType.ACK.value)
+            self.assertEqual(number, seq)
+            if payload is not None:
+                incoming.store(seq, payload)
+
+    def test_resume(self):
+        first = transfer.Transfer(1, protocol.MsgType.SET.value, self.params, self.path)
+        self.send(first, range(0, 8))
+        self.send(first, [3])                           # повтор подтверждается, но не сохраняется второй раз
+        first.close()                                   # клиент пропал
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(manifest.load(first.part_path, self.params), [(0, 8)])
+
+        second = transfer.Transfer(2, protocol.MsgType.SET.value, self.params, self.path)
+        self.assertEqual(second.part_path, first.part_path)
+        self.assertEqual(second.resumed, 8)
+        self.assertEqual(json.loads(protocol.get_data(second.accept_reply))['received'], [[0, 8]])
+        self.send(second, reversed(range(8, len(self.fragments))))
+        self.assertTrue(second.complete())
+        second.close()
+        with open(self.path, 'rb') as file:
+            self.assertEqual(file.read(), self.data)
+        self.assertFalse(os.path.exists(second.part_path))
+        self.assertFalse(os.path.exists(second.part_path + manifest.MANIFEST_SUFFIX))
+
+    def test_other_version_starts_over(self):
+        first = transfer.Transfer(1, protocol.MsgType.SET.value, self.params, self.path)
+        self.send(first, range(0, 8))
+        first.close()
+        second = transfer.Transfer(2, protocol.MsgType.SET.value, dict(self.params, mtime=2), self.path)
+        self.assertEqual(second.resumed, 0)
+        second.close()
+
+    def test_name_collision(self):
+        for content_store in (None, store.ContentStore(self.dir_path)):
+            with open(self.path, 'wb') as file:
+                file.write(b'other file')
+            digest = hashlib.blake2b(self.data, digest_size=store.DIGEST_SIZE).hexdigest()
+            params = dict(self.params, hash=digest) if content_store else self.params
+            incoming = transfer.Transfer(1, protocol.MsgType.SET.value, params, self.path, content_store)
+            self.send(incoming, range(len(self.fragments)))
+            incoming.close()
+            self.assertEqual(incoming.path, os.path.join(self.dir_path, 'a(1).bin'))
+            with open(self.path, 'rb') as file:
+                self.assertEqual(file.read(), b'other file')
+            with open(incoming.path, 'rb') as file:
+                self.assertEqual(file.read(), self.data)
+            os.remove(incoming.path)
@@ -0,0 +1,324 @@
+import protocol
+import reassembly
+import batch
+import manifest
+import compression
+import delta
+import fec
+import integrity
+import logs
+import metrics
+import rtt
+import codecs
+import json
+import logging
+import os
+import time
+
+FRAGMENTS = metrics.FRAGMENTS_RECEIVED.labels('server')    # метрики сервера с уже выбранными метками
+BYTES = metrics.BYTES_RECEIVED.labels('server')
+CRC_FAILURES = metrics.CRC_FAILURES.labels('server')
+DUPLICATES = metrics.DUPLICATES.labels('server')
+RECOVERED = metrics.RECOVERED.labels('server')
+RTT = metrics.RTT.labels('server')
+GOODPUT = metrics.GOODPUT.labels('server')
+ACTIVE = metrics.ACTIVE.labels('server')
+
+
+def resolve_filename_collision(path):
+    """Автоматически добавляет (1), (2), ... если файл с таким именем уже существует."""
+    if not os.path.exists(path):
+        return path
+
+    base, ext = os.path.splitext(path)
+    counter = 1
+    new_path = f"{base}({counter}){ext}"
+    while os.path.exists(new_path):
+        counter += 1
+        new_path = f"{base}({counter}){ext}"
+    return new_path
+
+
+class Transfer:
+    """ Состояние одной входящей передачи файла или текста без работы с сокетом.
+    Используется блокирующим сервером (server.py) и асинхронным (aioserver.py).
+    Если клиент сообщил размер и время изменения файла, файл принимается во временный .part
+    с манифестом принятых диапазонов (manifest.py) и прерванная передача продолжается с того же места.
+    Передача с параметром delta принимает дельту (delta.py) и после завершения заменяет прежнюю версию файла,
+    с параметром batch - пакет файлов (batch.py) и после завершения распаковывает его в директорию файла. """
+
+    def __init__(self, session, msg_type, params, path=None, content_store=None):
+        """ session: Идентификатор сессии передачи.
+        msg_type: Значение MsgType.SET для файла или MsgType.SET_MSG для текста.
+        params: Параметры из сообщения инициализации (количество и размер фрагментов).
+        path: Путь, под которым сохранить файл (при совпадении имени добавляется номер), только для файла.
+        content_store: store.ContentStore, в который переносится принятый файл с параметром hash, или None.
+        Неверные параметры дельты или пакета или изменившаяся прежняя версия - ValueError. """
+
+        self.session = session
+        self.params = params
+        self.msg_type = msg_type
+        self.count = params['count']
+        self.payload_size = params['fragment']
+        self.path = path
+        self.last_activity = time.monotonic()
+        self.rtt = rtt.RttEstimator()
+        self.reply_time = self.last_activity            # ACK инициализации отправлен, первый фрагмент придет через RTT
+        self.handshake_repeated = False
+        self.finished = False                           # клиент прислал FIN
+        self.resumable = msg_type == protocol.MsgType.SET.value and manifest.resumable(params)
+        self.checkpoint_time = self.last_activity
+        method = params.get('compression')
+        self.compression = method if method in compression.METHODS else None    # неизвестный метод - без сжатия
+        accepted = {'compression': self.compression} if self.compression else {}
+        self.fec = None                                 # fec.Decoder, если клиент отправляет четность
+        self.verifier = None                            # integrity.RangeVerifier, если клиент проверяет хеши диапазонов
+        self.file_digest = None                         # хеш принятого файла после проверки всех диапазонов
+        self.rebuilt = []                               # восстановленные по четности фрагменты для take_rebuilt
+        self.delta = params.get('delta') if msg_type == protocol.MsgType.SET.value else None
+        if self.delta is not None:                              # принимается дельта к прежней версии файла
+            try:
+                stat = os.stat(path)
+                basis = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                basis = None
+            if not self.resumable or not isinstance(self.delta, dict) or basis != self.delta.get('basis') \
+                    or not isinstance(self.delta.get('block'), int) or not isinstance(self.delta.get('size'), int):
+                raise ValueError('Прежняя версия файла изменилась или отсутствует')
+        self.batch = params.get('batch') if msg_type == protocol.MsgType.SET.value else None
+        self.unpacked = None                            # пути файлов распакованного пакета
+        if self.batch is not None and (not isinstance(self.batch, dict) or not isinstance(self.batch.get('files'), int)
+                                       or self.delta is not None):
+            raise ValueError('Неверные параметры пакета')
+        self.content_store = content_store
+        self.content = params.get('hash') if content_store is not None and self.resumable and self.batch is None \
+            else None                                   # хеш содержимого для хранилища
+        if msg_type == protocol.MsgType.SET.value:
+            if not self.resumable:                              # старый клиент - файл пишется сразу под итоговым именем
+                self.path = resolve_filename_collision(path)
+            self.part_path = manifest.part_path(path, params) if self.resumable else self.path
+            received = manifest.load(self.part_path, params) if self.resumable else None
+            self.assembler = reassembly.FileAssembler(self.part_path, self.count, self.payload_size,
+                                                      params.get('size'), received is not None)
+            self.bitmap = self.assembler.bitmap
+            self.progress = logs.Progress(f'Прием {os.path.basename(path)}', self.count)
+            for start, end in received or ():
+                self.bitmap.add_range(start, end)
+            self.resumed = self.bitmap.received
+            try:
+                block, parity = fec.parse(':'.join(map(str, params.get('fec') or ()))) or (0, 0)
+            except (ValueError, TypeError):                     # неверные параметры - без FEC
+                block = parity = 0
+            if block and 'size' in params:                      # длина последнего фрагмента нужна для восстановления
+                initial = None
+                if self.resumed:                                # блоки с фрагментами прошлой передачи не восстанавливаются
+                    initial = reassembly.FragmentBitmap(self.count)
+                    initial.bits[:] = self.bitmap.bits
+                self.fec = fec.Decoder(block, parity, self.bitmap, self.payload_size, params['size'], initial)
+                accepted['fec'] = [block, parity]
+            per_range = params.get('digest')
+            if isinstance(per_range, int) and per_range > 0 and 'size' in params:
+                self.verifier = integrity.RangeVerifier(self.assembler, self.bitmap, per_range, self.payload_size)
+                accepted['digest'] = per_range
+            if self.resumable:                                  # клиент отправит только недостающие фрагменты
+                accepted['received'] = self.bitmap.ranges()
+                while len(json.dumps(accepted)) > protocol.DEFAULT_BUFF - protocol.HEADER_SIZE:    # не влезает в ответ -
+                    accepted['received'] = accepted['received'][:len(accepted['received']) // 2]  # остальное повторно
+        else:
+            self.assembler = None
+            self.bitmap = reassembly.FragmentBitmap(self.count)
+            self.resumed = 0
+            self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')   # символ на границе фрагментов
+            self.pending = {}
+            self.next_seq = 0
+        self.accept_reply = protocol.add_header(protocol.MsgType.ACK, json.dumps(accepted).encode('utf-8') if accepted
+                                                else b'', 0, session,                  # ответ на инициализацию
+                                                protocol.FLAG_ACCEPT if params.get('connection') else 0)
+        ACTIVE.inc()
+
+    def handle(self, data):
+        """ Обрабатывает датаграмму этой сессии. Возвращает ответ (или None, если отвечать не нужно), номер фрагмента
+        и данные нового фрагмента для store (None для поврежденного фрагмента или дубликата).
+        Сжатый фрагмент распаковывается сразу; если распаковать его нельзя, отправителю уходит RST.
+        Фрагменты, восстановленные по четности, после вызова забираются take_rebuilt.
+
+        data: Полученная датаграмма с заголовком протокола. """
+
+        self.last_activity = time.monotonic()
+        reply_crc = protocol.check_crc(data)
+        if reply_crc != protocol.MsgType.ACK:
+            CRC_FAILURES.inc()
+        msg_type, seq = protocol.get_msg_type(data), protocol.get_seq(data)
+        if msg_type in (protocol.MsgType.SET.value, protocol.MsgType.SET_MSG.value):   # потерян ACK инициализации
+            self.handshake_repeated = True
+            if reply_crc == protocol.MsgType.ACK:
+                return self.accept_reply, 0, None
+            return protocol.add_header(reply_crc, b'', 0, self.session), 0, None
+        if msg_type == protocol.MsgType.FIN.value and reply_crc == protocol.MsgType.ACK:
+            self.finished = True
+            return protocol.add_header(protocol.MsgType.FIN, b'', 0, self.session), 0, None
+        if msg_type == protocol.MsgType.DIG.value:               # хеши диапазонов после всех фрагментов
+            if reply_crc != protocol.MsgType.ACK or self.verifier is None:
+                return None, seq, None
+            bad = self.verifier.check(seq, bytes(protocol.get_data(data)))
+            if bad:
+                logging.warning(f"Хеши диапазонов {bad} не совпали, диапазоны принимаются заново")
+            return protocol.add_header(protocol.MsgType.DIG, b''.join(map(integrity.BAD.pack, bad)), seq,
+                                       self.session), seq, None
+        if msg_type == protocol.MsgType.PAR.value:               # четность не подтверждается
+            if reply_crc == protocol.MsgType.ACK and self.fec is not None \
+                    and len(data) - protocol.HEADER_SIZE <= self.payload_size:
+                self.recover(self.fec.add_parity(seq, protocol.get_data(data)))
+            return None, seq, None
+        if msg_type != protocol.MsgType.PSH.value or seq >= self.count:
+            return None, seq, None
+        if self.rtt.srtt is None and not self.handshake_repeated:         # правило Карна
+            self.rtt.sample(self.reply_time)
+            RTT.observe(self.rtt.srtt)
+        FRAGMENTS.inc()
+        BYTES.inc(len(data) - protocol.HEADER_SIZE)
+        reply = protocol.add_header(reply_crc, b'', seq, self.session)
+        if reply_crc != protocol.MsgType.ACK or seq in self.bitmap:    # повторный фрагмент тоже подтверждается
+            if reply_crc == protocol.MsgType.ACK:
+                DUPLICATES.inc()
+            return reply, seq, None
+        payload = protocol.get_data(data)
+        if protocol.get_flags(data) & protocol.FLAG_COMPRESSED:
+            try:
+                if self.compression is None:
+                    raise ValueError('Сжатие не согласовано')
+                payload = compression.decompress(payload, self.compression, self.payload_size)
+                if seq < self.count - 1 and len(payload) != self.payload_size:
+                    raise ValueError('Неполный фрагмент')
+            except ValueError:
+                return protocol.add_header(protocol.MsgType.RST, b'', seq, self.session), seq, None
+        elif len(payload) > self.payload_size:                  # иначе запись заденет следующий фрагмент
+            return protocol.add_header(protocol.MsgType.RST, b'', seq, self.session), seq, None
+        self.bitmap.add(seq)
+        GOODPUT.inc(len(payload))
+        if self.fec is not None:
+            self.recover(self.fec.add(seq, payload))
+        return reply, seq, payload
+
+    def recover(self, rebuilt):
+        """ Отмечает восстановленный по четности фрагмент принятым и ставит его в очередь take_rebuilt.
+
+        rebuilt: Пара (номер, данные) от fec.Decoder или None. """
+
+        if rebuilt is None:
+            return
+        seq, payload = rebuilt
+        self.bitmap.add(seq)
+        RECOVERED.inc()
+        GOODPUT.inc(len(payload))
+        self.rebuilt.append((protocol.add_header(protocol.MsgType.ACK, b'', seq, self.session,
+                                                 protocol.FLAG_RECOVERED), seq, payload))
+
+    def take_rebuilt(self):
+        """ Забирает фрагменты, восстановленные при обработке последней датаграммы. Возвращает список
+        (ответ, номер, данные) как у handle: ответ подтверждает фрагмент отправителю, данные - для store. """
+
+        rebuilt, self.rebuilt = self.rebuilt, []
+        return rebuilt
+
+    def store(self, seq, data):
+        """ Сохраняет новый фрагмент. Для файла пишет его по смещению, для текста возвращает
+        раскодированную строку, готовую к выводу по порядку (может быть пустой).
+
+        seq: Номер фрагмента.
+        data: Данные фрагмента без заголовка (bytes или memoryview). """
+
+        if self.assembler is not None:
+            self.assembler.write(seq, data)
+            if self.verifier is not None:
+                self.verifier.stored(seq)
+            self.progress.update(self.bitmap.received)
+            return ''
+        self.pending[seq] = bytes(data)                         # данные могут лежать в буфере из пула
+        text = []
+        while self.next_seq in self.pending:                    # фрагменты после пропуска ждут в буфере
+            text.append(self.decoder.decode(self.pending.pop(self.next_seq)))
+            self.next_seq += 1
+        return ''.join(text)
+
+    def complete(self):
+        """ Приняты ли все фрагменты. """
+        return self.bitmap.complete()
+
+    def checkpoint(self, ranges=None, force=False):
+        """ Сохраняет манифест принятых диапазонов не чаще раза в manifest.CHECKPOINT_INTERVAL секунд.
+        Данные сначала сбрасываются на диск, поэтому манифест не опережает файл.
+
+        ranges: Диапазоны, все фрагменты которых уже записаны; по умолчанию - все принятые.
+        force: Сохранить независимо от интервала. """
+
+        if not self.resumable or self.complete():
+            return
+        now = time.monotonic()
+        if not force and now - self.checkpoint_time < manifest.CHECKPOINT_INTERVAL:
+            return
+        self.checkpoint_time = now
+        self.assembler.sync()
+        manifest.save(self.part_path, self.params, self.bitmap.ranges() if ranges is None else ranges)
+
+    def idle_timeout(self):
+        """ Время тишины, после которого клиент считается пропавшим, по оценке RTT. """
+        return self.rtt.idle_timeout(protocol.MAX_RETRIES)
+
+    def close(self):
+        """ Завершает передачу: обрезает и закрывает файл. Полностью принятый файл переносится из .part
+        под итоговым именем (self.path) или, если его хеш совпал с заявленным, в хранилище по содержимому
+        с именем-ссылкой; для прерванной передачи сохраняется манифест. """
+
+        ACTIVE.dec()
+        metrics.TRANSFERS.labels('server', 'complete' if self.complete() else 'interrupted').inc()
+        if self.assembler is None:
+            return
+        self.checkpoint(force=True)
+        self.assembler.close()
+        if self.verifier is not None and self.complete():
+            self.file_digest = self.verifier.file_digest()
+            logging.info(f"Хеш файла {self.path}: {self.file_digest or 'не проверен'}")
+        if self.complete() and self.batch is not None:
+            self.unpack_batch()
+        elif self.resumable and self.complete() and self.delta is not None:
+            self.apply_delta()
+            if self.content is not None and self.content_store.put(self.path, self.path, self.content) is None:
+                logging.warning(f"Хеш {self.path} после дельты не совпал, файл не добавлен в хранилище")
+        elif self.resumable and self.complete():
+            stored = self.content_store.put(self.part_path, self.path, self.content) if self.content is not None \
+                else None
+            if stored is None:
+                self.path = resolve_filename_collision(self.path)
+                os.replace(self.part_path, self.path)
+            else:
+                self.path = stored                              # занятое другим файлом имя не заменяется
+            manifest.remove(self.part_path)
+
+    def unpack_batch(self):
+        """ Распаковка принятого пакета в директорию файла, существующие файлы не заменяются.
+        Пакет после распаковки удаляется, даже если он поврежден. """
+
+        try:
+            self.unpacked = batch.unpack(self.part_path, os.path.dirname(self.path), resolve_filename_collision)
+        except (OSError, ValueError) as error:
+            print('Ошибка распаковки пакета:', error)
+            logging.error(f"Ошибка распаковки пакета {self.path}: {error}")
+        os.remove(self.part_path)
+        manifest.remove(self.part_path)
+
+    def apply_delta(self):
+        """ Сборка новой версии из прежней и принятой дельты, новая версия заменяет прежнюю.
+        Если дельту применить нельзя, прежняя версия остается, дельта удаляется. """
+
+        temp_path = self.part_path + '.new'
+        try:
+            delta.patch(self.path, self.part_path, temp_path, self.delta['block'], self.delta['size'])
+            os.replace(temp_path, self.path)
+        except (OSError, ValueError) as error:
+            print('Ошибка применения дельты:', error)
+            logging.error(f"Ошибка применения дельты к {self.path}: {error}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        os.remove(self.part_path)
+        manifest.remove(self.part_path)